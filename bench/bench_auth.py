@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Compare ApiHandler.prepare db paths: token_auth followed by an access
+query on a second connection vs a single tokens and access query.
+
+Run from the repository root against the database from `server/conf.py`:
+    $ python3 -m bench.bench_auth -n 5000 -c 16
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+import nacl.encoding
+import nacl.hash
+import nacl.utils
+from psycopg2.sql import SQL, Identifier
+
+from db_manage import create_user, delete_user
+from server.app import get_db_pool
+from server.sql.insert import InsertQueries
+from server.sql.select import SelectQueries
+
+
+async def two_queries(db_pool, token_select, ids):
+    user_id = (
+        await db_pool.fetch(SelectQueries.token_auth, (token_select,))
+    )[0][0]
+    return await db_pool.fetch(
+        SelectQueries.project_folder_task_access, (user_id, *ids)
+    )
+
+
+async def single_query(db_pool, token_select, ids):
+    return await db_pool.fetch(
+        SelectQueries.token_project_folder_task_access, (*ids, token_select)
+    )
+
+
+async def run(func, db_pool, token_select, ids, requests, concurrency):
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            await func(db_pool, token_select, ids)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        worker(requests // concurrency) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests/s': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3)
+    }
+
+
+async def main(requests, concurrency):
+    user = create_user('bench_{}'.format(uuid4().hex), generate_password=True)
+    ids = (user['project_id'], user['folder_id'], user['tasks'][0])
+    token_select = uuid4().hex
+    token_verify_hash = nacl.hash.blake2b(
+        uuid4().hex.encode(), key=nacl.utils.random(size=64),
+        encoder=nacl.encoding.HexEncoder
+    )
+    db_pool = await get_db_pool()
+    try:
+        await db_pool.execute(
+            SQL(InsertQueries.tokens).format(Identifier('3600s')),
+            (token_select, token_verify_hash, uuid4().hex, user['username'])
+        )
+        for name, func in (('two queries', two_queries),
+                           ('single query', single_query)):
+            # Warm up connections and plans
+            await run(func, db_pool, token_select, ids, concurrency,
+                      concurrency)
+            res = await run(func, db_pool, token_select, ids, requests,
+                            concurrency)
+            print(name, res)
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
+        delete_user(user['username'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+""" Compare task creation throughput: one task per request vs bulk requests.
+Starts the server in-process against the database from `server/conf.py`:
+    $ python3 -m bench.bench_bulk -n 10000 -b 500 -c 8
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import url_concat
+from tornado.netutil import bind_sockets
+
+from db_manage import create_user, delete_user
+from server.app import ServerApp, get_db_pool
+
+
+async def run(requests, concurrency):
+    """ Send requests with given concurrency
+    :param requests: list of (url, method, body)
+    :return: elapsed time in seconds
+    """
+    client = AsyncHTTPClient()
+    queue = list(reversed(requests))
+
+    async def worker():
+        while queue:
+            url, method, body = queue.pop()
+            await client.fetch(url, method=method, body=body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start
+
+
+async def main(tasks, batch, concurrency):
+    user = create_user('bench_{}'.format(uuid4().hex), generate_password=True)
+    db_pool = await get_db_pool()
+    app = ServerApp(asyncio.get_running_loop(), db_pool)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    base_url = 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    try:
+        r = await AsyncHTTPClient().fetch(
+            base_url + '/api/tokens/new', method='POST',
+            body=urlencode({k: user[k] for k in ('username', 'password')})
+        )
+        tokens = json.loads(r.body)
+        tokens = {k: tokens[k] for k in ('token_select', 'token_verify')}
+
+        url = url_concat('{}/api/task/{}/{}'.format(
+            base_url, user['project_id'], user['folder_id']
+        ), tokens)
+        requests = [
+            (url, 'POST', urlencode({'title': 'Task {}'.format(i)}))
+            for i in range(tasks)
+        ]
+        elapsed = await run(requests, concurrency)
+        print('single', {'tasks/s': round(tasks / elapsed, 1)})
+
+        url = url_concat('{}/api/task/{}/{}/bulk'.format(
+            base_url, user['project_id'], user['folder_id']
+        ), tokens)
+        requests = [
+            (url, 'POST', json.dumps([
+                {'title': 'Task {}'.format(i + j)}
+                for j in range(min(batch, tasks - i))
+            ]))
+            for i in range(0, tasks, batch)
+        ]
+        elapsed = await run(requests, concurrency)
+        print('bulk', {'tasks/s': round(tasks / elapsed, 1), 'batch': batch})
+    finally:
+        server.stop()
+        db_pool.close()
+        await db_pool.wait_closed()
+        delete_user(user['username'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--tasks', type=int, default=10000)
+    parser.add_argument('-b', '--batch', type=int, default=500)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.tasks, args.batch, args.concurrency))
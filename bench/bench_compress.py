@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+""" Measure bytes saved and latency added by response compression on
+a listing of a project with 10k tasks, as a full NDJSON stream and as
+the biggest page. Every encoding available on the server is compared
+with the uncompressed response.
+Starts the server in-process against the database from `server/conf.py`:
+    $ python3 -m bench.bench_compress -n 50 -t 10000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import url_concat
+from tornado.netutil import bind_sockets
+
+from db_manage import create_user, delete_user
+from server.app import ServerApp, get_db_pool
+
+from .bench_bulk import run
+
+
+async def measure(url, encoding, requests):
+    """ Get sizes of the response body on the wire and latency in ms """
+    client = AsyncHTTPClient()
+    headers = {'Accept-Encoding': encoding or 'identity'}
+    latency = []
+    size = None
+    for _ in range(requests):
+        start = time.perf_counter()
+        r = await client.fetch(url, headers=headers, decompress_response=False)
+        latency.append((time.perf_counter() - start) * 1000)
+        assert r.headers.get('Content-Encoding') == encoding
+        size = len(r.body)
+    latency.sort()
+    return {
+        'bytes': size,
+        'p50_ms': round(statistics.median(latency), 2),
+        'p95_ms': round(latency[int(len(latency) * 0.95) - 1], 2)
+    }
+
+
+async def main(requests, tasks):
+    user = create_user('bench_{}'.format(uuid4().hex), generate_password=True)
+    db_pool = await get_db_pool()
+    app = ServerApp(asyncio.get_running_loop(), db_pool)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    base_url = 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+    try:
+        r = await AsyncHTTPClient().fetch(
+            base_url + '/api/tokens/new', method='POST',
+            body=urlencode({k: user[k] for k in ('username', 'password')})
+        )
+        tokens = json.loads(r.body)
+        tokens = {k: tokens[k] for k in ('token_select', 'token_verify')}
+        url = url_concat('{}/api/task/{}/{}/bulk'.format(
+            base_url, user['project_id'], user['folder_id']
+        ), tokens)
+        batch = app.tasks_bulk_max
+        await run([
+            (url, 'POST', json.dumps([
+                {'title': 'Task {}'.format(i + j),
+                 'description': 'Description of task {}'.format(i + j)}
+                for j in range(min(batch, tasks - i))
+            ]))
+            for i in range(0, tasks, batch)
+        ], 1)
+
+        path = '{}/api/task/{}'.format(base_url, user['project_id'])
+        urls = {
+            'stream': url_concat(path, dict(tokens, format='ndjson')),
+            'page': url_concat(path, dict(tokens, limit=app.page_size_max))
+        }
+        for name, url in urls.items():
+            base = await measure(url, None, requests)
+            print(name, 'identity', base)
+            for encoding in app.compress_encodings:
+                res = await measure(url, encoding, requests)
+                res['saved'] = '{:.1%}'.format(1 - res['bytes'] / base['bytes'])
+                res['added_p50_ms'] = round(res['p50_ms'] - base['p50_ms'], 2)
+                print(name, encoding, res)
+    finally:
+        server.stop()
+        db_pool.close()
+        await db_pool.wait_closed()
+        delete_user(user['username'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=50)
+    parser.add_argument('-t', '--tasks', type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.tasks))
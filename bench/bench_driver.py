@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+""" Compare throughput of the list endpoints with aiopg and asyncpg drivers.
+Starts the server in-process against the database from `server/conf.py`:
+    $ python3 -m bench.bench_driver -n 5000 -t 1000 -c 16
+"""
+
+import argparse
+import asyncio
+import json
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import url_concat
+from tornado.netutil import bind_sockets
+
+from db_manage import create_user, delete_user
+from server.app import ServerApp, get_db_pool
+
+from .bench_bulk import run
+
+
+async def bench_driver(driver, user, requests, concurrency):
+    db_pool = await get_db_pool(driver=driver)
+    app = ServerApp(asyncio.get_running_loop(), db_pool)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    base_url = 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+    res = {}
+    try:
+        r = await AsyncHTTPClient().fetch(
+            base_url + '/api/tokens/new', method='POST',
+            body=urlencode({k: user[k] for k in ('username', 'password')})
+        )
+        tokens = json.loads(r.body)
+        tokens = {k: tokens[k] for k in ('token_select', 'token_verify')}
+        paths = {
+            'projects': '/api/project',
+            'folders': '/api/folder/{}'.format(user['project_id']),
+            'tasks': '/api/task/{}/{}'.format(
+                user['project_id'], user['folder_id']
+            ),
+            'tasks_max': '/api/task/{}/{}'.format(
+                user['project_id'], user['folder_id']
+            )
+        }
+        for name, path in paths.items():
+            params = dict(tokens)
+            if name == 'tasks_max':
+                params['limit'] = app.page_size_max
+            url = url_concat(base_url + path, params)
+            # Warm up connections and statements
+            await run([(url, 'GET', None)] * concurrency, concurrency)
+            elapsed = await run([(url, 'GET', None)] * requests, concurrency)
+            res[name] = round(requests / elapsed, 1)
+    finally:
+        server.stop()
+        db_pool.close()
+        await db_pool.wait_closed()
+    return res
+
+
+async def main(requests, tasks, concurrency):
+    user = create_user('bench_{}'.format(uuid4().hex), generate_password=True)
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    try:
+        # Fill the folder, the pages of tasks are full
+        db_pool = await get_db_pool()
+        try:
+            app = ServerApp(asyncio.get_running_loop(), db_pool)
+            sockets = bind_sockets(0, '127.0.0.1')
+            server = HTTPServer(app)
+            server.add_sockets(sockets)
+            base_url = 'http://127.0.0.1:{}'.format(
+                sockets[0].getsockname()[1]
+            )
+            r = await AsyncHTTPClient().fetch(
+                base_url + '/api/tokens/new', method='POST',
+                body=urlencode({k: user[k] for k in ('username', 'password')})
+            )
+            tokens = json.loads(r.body)
+            url = url_concat('{}/api/task/{}/{}/bulk'.format(
+                base_url, user['project_id'], user['folder_id']
+            ), {k: tokens[k] for k in ('token_select', 'token_verify')})
+            batch = app.tasks_bulk_max
+            await run([
+                (url, 'POST', json.dumps([
+                    {'title': 'Task {}'.format(i + j)}
+                    for j in range(min(batch, tasks - i))
+                ]))
+                for i in range(0, tasks, batch)
+            ], 1)
+            server.stop()
+        finally:
+            db_pool.close()
+            await db_pool.wait_closed()
+
+        for driver in ('aiopg', 'asyncpg'):
+            res = await bench_driver(driver, user, requests, concurrency)
+            print(driver, {'requests/s': res})
+    finally:
+        delete_user(user['username'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=5000)
+    parser.add_argument('-t', '--tasks', type=int, default=1000)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.tasks, args.concurrency))
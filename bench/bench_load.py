@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+""" Load test of the API: concurrent clients drive a weighted mix of
+login, token renew, list tasks, get, create, update and delete task
+requests. Every client is a user with its own seeded project, operations
+are picked by a random generator seeded per client, so a run with the same
+arguments sends the same sequence of requests.
+Prints requests/s, p50/p95/p99 latency and error rates per operation and
+in total as JSON, `-o` saves them to a file.
+
+Starts the server in-process against the database from `server/conf.py`,
+with `--throwaway` against a temporary PostgreSQL cluster created by
+`initdb` and `pg_ctl` from PATH and removed afterwards:
+    $ python3 -m bench.bench_load -n 20000 -c 16 -t 1000 -o new.json
+
+Compare two runs, exits with 1 if the second one regressed by more than
+the threshold:
+    $ python3 -m bench.bench_load --compare old.json new.json -r 0.1
+"""
+
+import argparse
+import asyncio
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import psycopg2
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import url_concat
+from tornado.netutil import bind_sockets
+
+from db_manage import create_user, delete_user, run_create_queries
+from server.app import ServerApp, get_db_pool
+from server.conf import DB_SETTINGS
+
+from .bench_bulk import run
+
+# Weights of operations in the default mix
+MIX = {
+    'login': 1,
+    'renew': 1,
+    'list': 10,
+    'get': 20,
+    'create': 5,
+    'update': 5,
+    'delete': 2
+}
+# Metrics compared by `--compare`: 1 - higher is better, -1 - lower is
+METRICS = {'requests/s': 1, 'p50_ms': -1, 'p95_ms': -1, 'p99_ms': -1}
+
+
+@contextmanager
+def throwaway_postgres():
+    """ Create a PostgreSQL cluster in a temporary directory, listening
+    only on a unix socket in the directory, point `DB_SETTINGS` at it
+    and create the schema
+    """
+    settings = dict(DB_SETTINGS)
+    with tempfile.TemporaryDirectory(prefix='tasker-bench-') as path:
+        data = os.path.join(path, 'data')
+        subprocess.run(['initdb', '-D', data, '-U', 'tasker', '-A', 'trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            'pg_ctl', '-D', data, '-l', os.path.join(path, 'log'), '-w',
+            '-o', "-k {} -c listen_addresses=''".format(path), 'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        try:
+            conn = psycopg2.connect(dbname='postgres', user='tasker',
+                                    host=path)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute('CREATE DATABASE tasker')
+            conn.close()
+            # The dict is shared with the server and db_manage
+            DB_SETTINGS.clear()
+            DB_SETTINGS.update(database='tasker', user='tasker', host=path)
+            run_create_queries()
+            yield
+        finally:
+            DB_SETTINGS.clear()
+            DB_SETTINGS.update(settings)
+            subprocess.run(['pg_ctl', '-D', data, '-w', '-m', 'fast', 'stop'],
+                           check=True, stdout=subprocess.DEVNULL)
+
+
+class Client:
+    """ A user sending requests one after another """
+
+    def __init__(self, base_url, user, tasks, seed):
+        """
+        :param user: user created by `db_manage.create_user`
+        :type user: dict
+        :param tasks: ids of seeded tasks of the user
+        :type tasks: list
+        :param seed: seed of the generator of operations and values
+        :type seed: int
+        """
+        self.client = AsyncHTTPClient()
+        self.user = user
+        self.tasks = tasks
+        self.tokens = None
+        self.random = random.Random(seed)
+        self._project = '{}/api/task/{}'.format(base_url, user['project_id'])
+        self._folder = '{}/{}'.format(self._project, user['folder_id'])
+        self._tokens_url = base_url + '/api/tokens/'
+
+    @property
+    def auth(self):
+        return {k: self.tokens[k] for k in ('token_select', 'token_verify')}
+
+    def _task_url(self):
+        return '{}/{}'.format(self._folder, self.random.choice(self.tasks))
+
+    async def fetch(self, url, method='GET', body=None):
+        return await self.client.fetch(url, method=method, body=body,
+                                       raise_error=False)
+
+    async def login(self):
+        r = await self.fetch(self._tokens_url + 'new', 'POST', urlencode({
+            k: self.user[k] for k in ('username', 'password')
+        }))
+        if r.code == 200:
+            self.tokens = json.loads(r.body)
+        return r
+
+    async def renew(self):
+        r = await self.fetch(self._tokens_url + 'renew', 'POST', urlencode({
+            k: self.tokens[k]
+            for k in ('token_select', 'token_verify', 'token_renew')
+        }))
+        if r.code == 200:
+            self.tokens = json.loads(r.body)
+        return r
+
+    async def list(self):
+        return await self.fetch(url_concat(self._project, self.auth))
+
+    async def get(self):
+        return await self.fetch(url_concat(self._task_url(), self.auth))
+
+    async def create(self):
+        r = await self.fetch(self._folder, 'POST', urlencode(dict(
+            self.auth, title='Task {}'.format(self.random.getrandbits(32))
+        )))
+        if r.code == 200:
+            self.tasks.append(json.loads(r.body)['id'])
+        return r
+
+    async def update(self):
+        return await self.fetch(url_concat(self._task_url(), dict(
+            self.auth, title='Task {}'.format(self.random.getrandbits(32))
+        )), 'PUT', '')
+
+    async def delete(self):
+        task_id = self.tasks.pop(self.random.randrange(len(self.tasks)))
+        return await self.fetch(url_concat(
+            '{}/{}'.format(self._folder, task_id), self.auth
+        ), 'DELETE')
+
+    def choose(self, operations, weights):
+        operation = self.random.choices(operations, weights)[0]
+        # Keep a task for get and update
+        if operation in ('get', 'update', 'delete') and len(self.tasks) < 2:
+            operation = 'create'
+        return operation
+
+
+def percentile(values, q):
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[max(0, -(-len(values) * q // 100) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    :param latencies: sorted latencies in seconds
+    :param errors: number of failed requests
+    :param elapsed: duration of the run in seconds
+    """
+    count = len(latencies)
+    res = {
+        'requests': count,
+        'requests/s': round(count / elapsed, 1),
+        'error_rate': round(errors / count, 4) if count else 0
+    }
+    for q in (50, 95, 99):
+        val = percentile(latencies, q)
+        res['p{}_ms'.format(q)] = \
+            None if val is None else round(val * 1000, 3)
+    return res
+
+
+async def load(clients, requests, mix):
+    """ Send requests, every client sends its share sequentially
+    :param mix: weights of operations
+    :type mix: dict
+    """
+    operations = [name for name, weight in mix.items() if weight]
+    weights = [mix[name] for name in operations]
+    # Create is also sent instead of operations which need a task
+    latencies = {name: [] for name in MIX}
+    errors = dict.fromkeys(MIX, 0)
+
+    async def worker(client, count):
+        for _ in range(count):
+            operation = client.choose(operations, weights)
+            start = time.perf_counter()
+            r = await getattr(client, operation)()
+            latencies[operation].append(time.perf_counter() - start)
+            if r.code >= 400:
+                errors[operation] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        worker(client, requests // len(clients)) for client in clients
+    ])
+    elapsed = time.perf_counter() - start
+    for values in latencies.values():
+        values.sort()
+    return {
+        'total': summarize(sorted(sum(latencies.values(), [])),
+                           sum(errors.values()), elapsed),
+        'operations': {
+            name: summarize(latencies[name], errors[name], elapsed)
+            for name in MIX if latencies[name]
+        }
+    }
+
+
+async def main(requests, concurrency, tasks, mix, seed):
+    db_pool = await get_db_pool()
+    app = ServerApp(asyncio.get_running_loop(), db_pool)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    base_url = 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    users = []
+    try:
+        clients = []
+        for i in range(concurrency):
+            user = create_user('bench_{}'.format(uuid4().hex),
+                               generate_password=True)
+            users.append(user)
+            client = Client(base_url, user, [], seed + i)
+            await client.login()
+            clients.append(client)
+
+        # Seed tasks of every user in bulk
+        batch = app.tasks_bulk_max
+        seeds = [
+            (url_concat('{}/bulk'.format(client._folder), client.auth),
+             'POST', json.dumps([
+                 {'title': 'Task {}'.format(j),
+                  'description': 'Description of task {}'.format(j)}
+                 for j in range(i, min(i + batch, tasks))
+             ]))
+            for client in clients for i in range(0, tasks, batch)
+        ]
+        await run(seeds, concurrency)
+        for client in clients:
+            r = await client.fetch(url_concat(
+                client._project, dict(client.auth, format='ndjson')
+            ))
+            client.tasks.extend(
+                json.loads(line)['id'] for line in r.body.splitlines()
+            )
+
+        res = await load(clients, requests, mix)
+        res['config'] = {
+            'requests': requests, 'concurrency': concurrency, 'tasks': tasks,
+            'mix': mix, 'seed': seed, 'driver': db_pool.driver
+        }
+        return res
+    finally:
+        server.stop()
+        db_pool.close()
+        await db_pool.wait_closed()
+        for user in users:
+            delete_user(user['username'])
+
+
+def compare(base, new, threshold):
+    """ Find regressions of the second run against the first one
+    :param threshold: relative change of a metric, e.g. 0.1 - 10%
+    :type threshold: float
+    :return: list of regressions
+    :rtype: list
+    """
+    regressions = []
+    pairs = [('total', base['total'], new['total'])] + [
+        (name, base['operations'][name], new['operations'][name])
+        for name in base['operations'] if name in new['operations']
+    ]
+    for name, old, cur in pairs:
+        for metric, sign in METRICS.items():
+            if not old.get(metric) or cur.get(metric) is None:
+                continue
+            change = (cur[metric] - old[metric]) / old[metric]
+            if change * sign < -threshold:
+                regressions.append({
+                    'operation': name, 'metric': metric, 'base': old[metric],
+                    'new': cur[metric], 'change': '{:+.1%}'.format(change)
+                })
+        # Any new errors are a regression
+        if cur['error_rate'] > old['error_rate']:
+            regressions.append({
+                'operation': name, 'metric': 'error_rate',
+                'base': old['error_rate'], 'new': cur['error_rate']
+            })
+    return regressions
+
+
+def parse_mix(value):
+    """ Parse weights of operations, e.g. `get=20,create=5`, operations
+    not listed keep their default weights
+    """
+    mix = dict(MIX)
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in MIX:
+            raise argparse.ArgumentTypeError('unknown operation ' + name)
+        mix[name] = int(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=20000)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-t', '--tasks', type=int, default=1000,
+                        help='seeded tasks per user')
+    parser.add_argument('-m', '--mix', type=parse_mix, default=MIX)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--throwaway', action='store_true')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    parser.add_argument('-r', '--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f))
+        regressions = compare(*runs, args.threshold)
+        print(json.dumps({'regressions': regressions}, indent=2))
+        sys.exit(1 if regressions else 0)
+
+    with (throwaway_postgres() if args.throwaway else nullcontext()):
+        res = asyncio.run(main(args.requests, args.concurrency, args.tasks,
+                               args.mix, args.seed))
+    print(json.dumps(res, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+""" Compare the queries of a task request executed as text, parsed and
+planned every time, vs prepared statements executed by name. Prints
+latency of the request queries and planning time reported by EXPLAIN.
+
+Run from the repository root against the database from `server/conf.py`:
+    $ python3 -m bench.bench_prepare -n 5000 -c 16
+"""
+
+import argparse
+import asyncio
+import json
+from uuid import uuid4
+
+import nacl.encoding
+import nacl.hash
+import nacl.utils
+from psycopg2.sql import SQL, Identifier
+
+from db_manage import create_user, delete_user
+from server.app import get_db_pool
+from server.sql.insert import InsertQueries
+from server.sql.prepared import PREPARED
+from server.sql.select import SelectQueries
+
+from .bench_auth import run
+
+
+def request_queries(token_select, pub_ids, ids):
+    """ Queries of GET /api/task/<project>/<folder>/<task> and GET of
+    the folder tasks list after authentication
+    """
+    return (
+        (SelectQueries.token_project_folder_task_access,
+         (*pub_ids, token_select)),
+        (SelectQueries.task, ids),
+        (SelectQueries.tasks_by_folder, (ids[0], ids[1], 0, 100))
+    )
+
+
+async def planning_time(db_pool, queries):
+    """ Planning time in ms of queries reported by EXPLAIN ANALYZE,
+    the last of a few executions, when prepared statements use the
+    cached plan
+    """
+    res = 0
+    async with db_pool.acquire() as conn:
+        for query, args in queries:
+            if db_pool.prepare:
+                query = PREPARED.get(query)
+            for _ in range(6):
+                plan = (await conn.fetch(
+                    'EXPLAIN (ANALYZE, FORMAT JSON) ' + query, args
+                ))[0][0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+            res += plan[0]['Planning Time']
+    return round(res, 3)
+
+
+async def main(requests, concurrency):
+    user = create_user('bench_{}'.format(uuid4().hex), generate_password=True)
+    pub_ids = (user['project_id'], user['folder_id'], user['tasks'][0])
+    token_select = uuid4().hex
+    token_verify_hash = nacl.hash.blake2b(
+        uuid4().hex.encode(), key=nacl.utils.random(size=64),
+        encoder=nacl.encoding.HexEncoder
+    )
+    # PREPARE and EXECUTE by name are done by the aiopg driver
+    pools = {
+        'text': await get_db_pool(prepare=False, driver='aiopg'),
+        'prepared': await get_db_pool(prepare=True, driver='aiopg')
+    }
+    try:
+        db_pool = pools['text']
+        await db_pool.execute(
+            SQL(InsertQueries.tokens).format(Identifier('3600s')),
+            (token_select, token_verify_hash, uuid4().hex, user['username'])
+        )
+        ids = tuple((await db_pool.fetch(
+            SelectQueries.token_project_folder_task_access,
+            (*pub_ids, token_select)
+        ))[0])[5:8]
+        queries = request_queries(token_select, pub_ids, ids)
+
+        async def request(db_pool, *args):
+            async with db_pool.acquire() as conn:
+                for query, query_args in queries:
+                    await conn.fetch(query, query_args)
+
+        for name, db_pool in pools.items():
+            # Warm up connections and plans
+            await run(request, db_pool, None, None, concurrency, concurrency)
+            res = await run(request, db_pool, None, None, requests,
+                            concurrency)
+            res['planning_ms'] = await planning_time(db_pool, queries)
+            print(name, res)
+    finally:
+        for db_pool in pools.values():
+            db_pool.close()
+            await db_pool.wait_closed()
+        delete_user(user['username'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" Compare encoding of a page and a stream of tasks to JSON: a dict per
+row encoded by `tornado.escape.json_encode` vs `server.serializer` with
+orjson (if installed) and without it, encoding rows right from tuples.
+With orjson, its dicts are also compared to encoding tuples directly:
+slots dataclasses and a template of keys filled with encoded values.
+Prints rows per second and peak memory allocated per row traced by
+tracemalloc. Doesn't need a database:
+    $ python3 -m bench.bench_serialize -r 100000 -n 10
+"""
+
+import argparse
+import dataclasses
+import gc
+import json
+import time
+import tracemalloc
+
+import tornado.escape
+
+from server.db import Rows
+from server import serializer
+
+# Columns of SelectQueries.tasks_by_project
+COLUMNS = ['project_id', 'folder_id', 'id', 'title', 'datetime_from',
+           'datetime_due', 'edited']
+
+
+def make_rows(count):
+    return Rows([
+        (1234567890, 1, i, 'Task {}'.format(i), None, 1600000000 + i,
+         1600000000 + i)
+        for i in range(count)
+    ], COLUMNS)
+
+
+def encode_dicts(rows):
+    return tornado.escape.utf8(tornado.escape.json_encode({
+        'tasks': [dict(zip(rows.columns, item)) for item in rows],
+        'next': None
+    }))
+
+
+def encode_serializer(rows):
+    return serializer.dumps({'tasks': rows, 'next': None})
+
+
+def encode_stream_dicts(rows):
+    return ''.join(
+        tornado.escape.json_encode(dict(zip(rows.columns, item))) + '\n'
+        for item in rows
+    ).encode()
+
+
+def encode_stream_serializer(rows):
+    return serializer.row_shape(tuple(rows.columns)).encode_lines(rows)
+
+
+def encode_dataclasses(rows):
+    orjson = serializer.orjson
+    row = dataclasses.make_dataclass('Row', rows.columns, slots=True)
+    return orjson.dumps({'tasks': [row(*item) for item in rows], 'next': None})
+
+
+def encode_template(rows):
+    dumps = serializer.orjson.dumps
+    template = b'{' + b','.join(
+        dumps(name) + b':%b' for name in rows.columns
+    ) + b'}'
+    return b'{"tasks":[' + b','.join([
+        template % tuple([dumps(val) for val in item]) for item in rows
+    ]) + b'],"next":null}'
+
+
+def measure(func, rows, repeat):
+    """ Rows per second, the best of runs, and peak of memory allocated
+    while encoding per row
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    gc.collect()
+    tracemalloc.start()
+    func(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'rows/s': round(len(rows) / best),
+        'alloc_bytes/row': round(peak / len(rows), 1)
+    }
+
+
+def main(count, repeat):
+    rows = make_rows(count)
+    orjson = serializer.orjson
+    paths = [('json', None)]
+    if orjson is not None:
+        paths.insert(0, ('orjson', orjson))
+    for name, func in (('page dicts', encode_dicts),
+                       ('stream dicts', encode_stream_dicts)):
+        print(name, measure(func, rows, repeat))
+    if orjson is not None:
+        for name, func in (('page dataclasses', encode_dataclasses),
+                           ('page template', encode_template)):
+            assert json.loads(func(rows)) == json.loads(encode_dicts(rows))
+            print(name, 'orjson', measure(func, rows, repeat))
+    try:
+        for encoder, module in paths:
+            serializer.orjson = module
+            # Both paths produce the same documents
+            assert json.loads(encode_dicts(rows)) == \
+                json.loads(encode_serializer(rows))
+            for name, func in (
+                    ('page serializer', encode_serializer),
+                    ('stream serializer', encode_stream_serializer)):
+                print(name, encoder, measure(func, rows, repeat))
+    finally:
+        serializer.orjson = orjson
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', type=int, default=100000)
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import functools
 import getpass
+import io
+import random
+import time
 from uuid import uuid4
 
-import nacl.pwhash
 import psycopg2
-from psycopg2.sql import SQL, Identifier
 
 from server.sql.create import (CreateSchemaQueries, CreateFunctionQueries,
                                CreateSequenceQueries, CreateTableQueries,
                                CreateTriggerQueries)
 from server.sql.delete import DeleteQueries
 from server.sql.insert import InsertQueries
+from server.sql.migrations import MigrationQueries, MIGRATIONS
+from server.sql.seed import SeedQueries
 from server.sql.update import UpdateQueries
-from server.conf import DB_SETTINGS
+from server.conf import DB_SETTINGS, KEYRING_PATH, KEY_GRACE_PERIOD, \
+    TOKENS_PURGE_BATCH_SIZE, TOMBSTONES_RETENTION, \
+    TOMBSTONES_PURGE_BATCH_SIZE, PWHASH_OPSLIMIT, PWHASH_MEMLIMIT
+from server.keyring import Keyring
+from server.pwhash import hash_password
 
 
 def run_create_queries():
@@ -29,6 +39,62 @@ def run_create_queries():
                 cur.execute(query)
             for query in CreateTriggerQueries.get_create_queries():
                 cur.execute(query)
+    # The new schema is up to date, apply the rest of changes by migrations
+    migrate()
+
+
+def migrate(status=None):
+    """ Apply pending schema migrations
+    :param status: only show applied and pending migrations if True
+    :return: applied and pending migrations versions
+    :rtype: dict
+    """
+    conn = psycopg2.connect(**DB_SETTINGS)
+    # Transactions are controlled explicitly, some migrations run outside
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(MigrationQueries.lock, (MigrationQueries.lock_id,))
+            cur.execute(MigrationQueries.schema_version)
+            cur.execute(MigrationQueries.applied)
+            applied = dict(cur.fetchall())
+            pending = [m for m in MIGRATIONS if m._version not in applied]
+            results = {
+                'applied': sorted(applied),
+                'pending': [m._version for m in pending]
+            }
+            if status:
+                return results
+            for migration in pending:
+                if migration._transaction:
+                    cur.execute('BEGIN')
+                    try:
+                        for query in migration.get_create_queries():
+                            cur.execute(query)
+                        cur.execute(
+                            MigrationQueries.add_version,
+                            (migration._version, migration.description())
+                        )
+                    except Exception:
+                        cur.execute('ROLLBACK')
+                        raise
+                    cur.execute('COMMIT')
+                else:
+                    cur.execute(MigrationQueries.invalid_indexes)
+                    for index, in cur.fetchall():
+                        cur.execute(MigrationQueries.drop_index.format(index))
+                    for query in migration.get_create_queries():
+                        cur.execute(query)
+                    cur.execute(
+                        MigrationQueries.add_version,
+                        (migration._version, migration.description())
+                    )
+                results['applied'].append(migration._version)
+            results['pending'] = []
+            cur.execute(MigrationQueries.unlock, (MigrationQueries.lock_id,))
+    finally:
+        conn.close()
+    return results
 
 
 def create_user(username, password=None, generate_password=None):
@@ -38,7 +104,7 @@ def create_user(username, password=None, generate_password=None):
         results['password'] = password
     elif password is None and generate_password is None:
         password = getpass.getpass()
-    hashed = nacl.pwhash.str(password.encode())
+    hashed = hash_password(password.encode(), PWHASH_OPSLIMIT, PWHASH_MEMLIMIT)
     with psycopg2.connect(**DB_SETTINGS) as conn:
         with conn.cursor() as cur:
             # Create a user
@@ -53,41 +119,28 @@ def create_user(username, password=None, generate_password=None):
                 InsertQueries.add_user_project,
                 (project_id, results['user_id'], 2)
             )
-            # Create sequences for the project: folders, tasks
-            seq_pf = Identifier(
-                'project_folder_{}_seq'.format(project_id)
-            )
-            seq_pt = Identifier(
-                'project_task_{}_seq'.format(project_id)
-            )
-            cur.execute(
-                SQL(CreateSequenceQueries._new_sequence).format(seq=seq_pf)
-            )
-            cur.execute(
-                SQL(CreateSequenceQueries._new_sequence).format(seq=seq_pt)
-            )
             # Create default folder
             cur.execute(
-                SQL(InsertQueries.add_folder).format(seq=seq_pf),
-                ('My Tasks', project_id)
+                InsertQueries.add_folder,
+                {'title': 'My Tasks', 'project_id': project_id}
             )
             folder_id, folder_pub_id = cur.fetchall()[0]
             results['folder_id'] = folder_pub_id
             results['tasks'] = []
             # Create a few demo tasks
             for i in range(3):
-                args = (
-                    'Demo task {}'.format(i+1),  # title
-                    'This is a description of Task #{}'.format(i+1),
-                    None, None,  # datetime_from, datetime_due
-                    results['user_id'],
-                    project_id,
-                    folder_id
-                )
-                cur.execute(
-                    SQL(InsertQueries.add_task).format(seq=seq_pt),
-                    args
-                )
+                args = {
+                    'title': 'Demo task {}'.format(i+1),
+                    'description': 'This is a description of Task #{}'.format(
+                        i+1
+                    ),
+                    'datetime_from': None,
+                    'datetime_due': None,
+                    'user_id': results['user_id'],
+                    'project_id': project_id,
+                    'folder_id': folder_id
+                }
+                cur.execute(InsertQueries.add_task, args)
                 task_id, task_pub_id = cur.fetchall()[0]
                 results['tasks'].append(task_pub_id)
     return results
@@ -117,18 +170,217 @@ def modify_user(username, displayname=None, role=None):
 
 def set_password(username):
     password = getpass.getpass()
-    hashed = nacl.pwhash.str(password.encode())
+    hashed = hash_password(password.encode(), PWHASH_OPSLIMIT, PWHASH_MEMLIMIT)
     with psycopg2.connect(**DB_SETTINGS) as conn:
         with conn.cursor() as cur:
             cur.execute(UpdateQueries.password, (hashed, username))
 
 
+def purge_tokens(batch_size=None):
+    """ Delete expired tokens in batches, each batch in own transaction """
+    if batch_size is None:
+        batch_size = TOKENS_PURGE_BATCH_SIZE
+    deleted = 0
+    conn = psycopg2.connect(**DB_SETTINGS)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute(DeleteQueries.expired_tokens, (batch_size,))
+                deleted += cur.rowcount
+                if cur.rowcount < batch_size:
+                    break
+    finally:
+        conn.close()
+    return {'deleted': deleted}
+
+
+def purge_tombstones(batch_size=None, retention=None):
+    """ Delete tombstones older than the retention in batches, each batch
+    in own transaction
+    """
+    if batch_size is None:
+        batch_size = TOMBSTONES_PURGE_BATCH_SIZE
+    if retention is None:
+        retention = TOMBSTONES_RETENTION
+    deleted = 0
+    conn = psycopg2.connect(**DB_SETTINGS)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute(DeleteQueries.expired_tombstones,
+                            (retention, batch_size))
+                rowcount = cur.fetchone()[0]
+                deleted += rowcount
+                if rowcount < batch_size:
+                    break
+    finally:
+        conn.close()
+    return {'deleted': deleted}
+
+
+def _copy(cur, query, rows, batch_size):
+    """ Load rows by COPY, a statement per batch of rows
+    :param rows: iterable of tuples of values in the COPY text format,
+        None is NULL
+    :return: number of copied rows
+    :rtype: int
+    """
+    buf = io.StringIO()
+    count = 0
+    for row in rows:
+        buf.write('\t'.join('\\N' if val is None else str(val) for val in row))
+        buf.write('\n')
+        count += 1
+        if count % batch_size == 0:
+            buf.seek(0)
+            cur.copy_expert(query, buf)
+            buf = io.StringIO()
+    if buf.tell():
+        buf.seek(0)
+        cur.copy_expert(query, buf)
+    return count
+
+
+def _skewed_sizes(rng, count, total):
+    """ Split total between count items by a Pareto distribution, a few
+    items get most of it
+    """
+    if count == 0:
+        return []
+    weights = [rng.paretovariate(1.16) for _ in range(count)]
+    scale = total / sum(weights)
+    sizes = [int(weight * scale) for weight in weights]
+    for i in rng.sample(range(count), total - sum(sizes)):
+        sizes[i] += 1
+    return sizes
+
+
+def seed(users, projects_per_user, tasks_per_project, folders_per_project=3,
+         password=None, unique_passwords=None, processes=None,
+         batch_size=100000, random_seed=None):
+    """ Create synthetic users, projects, folders and tasks. Users are
+    `seed_<run>_<n>`, admins of their projects, sizes of projects are skewed,
+    tasks_per_project is the mean. Rows are loaded by COPY in one transaction
+    and counters of pub ids are set to the last seeded ones
+    :param password: password of all users, a generated one by default,
+        it's hashed once
+    :param unique_passwords: password of a user is the password followed by
+        the number of the user, hashed in a pool of processes
+    :param processes: size of the pool, number of CPUs by default
+    :param batch_size: rows per COPY statement
+    :param random_seed: seed of the generator of sizes and values
+    """
+    start = time.perf_counter()
+    rng = random.Random(random_seed)
+    run = uuid4().hex[:8]
+    if password is None:
+        password = uuid4().hex
+    if unique_passwords:
+        with ProcessPoolExecutor(processes) as executor:
+            hashed = list(executor.map(
+                functools.partial(hash_password, opslimit=PWHASH_OPSLIMIT,
+                                  memlimit=PWHASH_MEMLIMIT),
+                ['{}{}'.format(password, i).encode() for i in range(users)],
+                chunksize=max(1, users // 256)
+            ))
+    else:
+        hashed = [hash_password(password.encode(), PWHASH_OPSLIMIT,
+                                PWHASH_MEMLIMIT)] * users
+    projects = users * projects_per_user
+    sizes = _skewed_sizes(rng, projects, projects * tasks_per_project)
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            _copy(cur, SeedQueries.copy_users, (
+                ('seed_{}_{}'.format(run, i), '\\\\x' + hashed[i].hex())
+                for i in range(users)
+            ), batch_size)
+            cur.execute(SeedQueries.users, ('seed\\_{}\\_%'.format(run),))
+            user_ids = [row[0] for row in cur.fetchall()]
+            cur.execute(SeedQueries.projects, (projects,))
+            project_ids = sorted(row[0] for row in cur.fetchall())
+            owners = [
+                user_ids[i // projects_per_user] for i in range(projects)
+            ]
+            _copy(cur, SeedQueries.copy_projects_users, (
+                (project_id, owner, 2)
+                for project_id, owner in zip(project_ids, owners)
+            ), batch_size)
+            _copy(cur, SeedQueries.copy_project_counters, (
+                (project_id, folders_per_project, size)
+                for project_id, size in zip(project_ids, sizes)
+            ), batch_size)
+            _copy(cur, SeedQueries.copy_folders, (
+                (n, 'Folder {}'.format(n), project_id)
+                for project_id in project_ids
+                for n in range(1, folders_per_project + 1)
+            ), batch_size)
+            cur.execute(SeedQueries.folders, (project_ids,))
+            folders = {(project_id, pub_id): folder_id
+                       for project_id, pub_id, folder_id in cur.fetchall()}
+
+            def tasks():
+                for project_id, owner, size in zip(project_ids, owners, sizes):
+                    for n in range(1, size + 1):
+                        due = None
+                        if rng.random() < 0.3:
+                            due = now + datetime.timedelta(
+                                minutes=rng.randrange(-30 * 1440, 90 * 1440)
+                            )
+                        folder_id = folders[
+                            (project_id, rng.randint(1, folders_per_project))
+                        ]
+                        yield (
+                            n, 'Task {}'.format(n),
+                            'Description of task {}'.format(n)
+                            if rng.random() < 0.5 else None,
+                            due, owner, project_id, folder_id
+                        )
+
+            tasks_count = _copy(cur, SeedQueries.copy_tasks, tasks(),
+                                batch_size)
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(SeedQueries.analyze)
+    return {
+        # Usernames are the prefix followed by numbers from 0
+        'prefix': 'seed_{}_'.format(run),
+        'users': users,
+        'password': password + ('<n>' if unique_passwords else ''),
+        'projects': projects,
+        'folders': projects * folders_per_project,
+        'tasks': tasks_count,
+        'max_tasks_per_project': max(sizes) if sizes else 0,
+        'seconds': round(time.perf_counter() - start, 1)
+    }
+
+
+def _positive(value):
+    """ Argument type of counts of seeded rows """
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError('positive integer expected')
+    return value
+
+
+def rotate_keyring():
+    keyring = Keyring.load(KEYRING_PATH, KEY_GRACE_PERIOD)
+    return {'key_id': keyring.rotate()}
+
+
 def main():
     commands = {
         'init-db': {
             'func': run_create_queries,
             'kw': []
         },
+        'migrate': {
+            'func': migrate,
+            'kw': ['status']
+        },
         'user-add': {
             'func': create_user,
             'kw': ['username', 'password', 'generate_password']
@@ -144,6 +396,24 @@ def main():
         'user-mod-passwd': {
             'func': set_password,
             'kw': ['username']
+        },
+        'tokens-purge': {
+            'func': purge_tokens,
+            'kw': ['batch_size']
+        },
+        'tombstones-purge': {
+            'func': purge_tombstones,
+            'kw': ['batch_size', 'retention']
+        },
+        'keyring-rotate': {
+            'func': rotate_keyring,
+            'kw': []
+        },
+        'seed': {
+            'func': seed,
+            'kw': ['users', 'projects_per_user', 'tasks_per_project',
+                   'folders_per_project', 'password', 'unique_passwords',
+                   'processes', 'batch_size', 'random_seed']
         }
     }
 
@@ -153,6 +423,10 @@ def main():
     init_db = subparsers.add_parser('init-db')
     init_db.set_defaults(used='init-db')
 
+    migrate_db = subparsers.add_parser('migrate')
+    migrate_db.set_defaults(used='migrate')
+    migrate_db.add_argument('--status', action='store_true', default=None)
+
     user_add = subparsers.add_parser('user-add')
     user_add.set_defaults(used='user-add')
     user_add.add_argument('-u', '--username', type=str, required=True)
@@ -174,6 +448,39 @@ def main():
     user_mod_passwd.set_defaults(used='user-mod-passwd')
     user_mod_passwd.add_argument('-u', '--username', type=str, required=True)
 
+    tokens_purge = subparsers.add_parser('tokens-purge')
+    tokens_purge.set_defaults(used='tokens-purge')
+    tokens_purge.add_argument('-b', '--batch-size', dest='batch_size',
+                              type=int, default=None)
+
+    tombstones_purge = subparsers.add_parser('tombstones-purge')
+    tombstones_purge.set_defaults(used='tombstones-purge')
+    tombstones_purge.add_argument('-b', '--batch-size', dest='batch_size',
+                                  type=int, default=None)
+    tombstones_purge.add_argument('-r', '--retention', type=int,
+                                  default=None)
+
+    keyring_rotate = subparsers.add_parser('keyring-rotate')
+    keyring_rotate.set_defaults(used='keyring-rotate')
+
+    seed_db = subparsers.add_parser('seed')
+    seed_db.set_defaults(used='seed')
+    seed_db.add_argument('--users', type=_positive, required=True)
+    seed_db.add_argument('--projects-per-user', dest='projects_per_user',
+                         type=_positive, default=1)
+    seed_db.add_argument('--tasks-per-project', dest='tasks_per_project',
+                         type=_positive, default=100)
+    seed_db.add_argument('--folders-per-project', dest='folders_per_project',
+                         type=_positive, default=3)
+    seed_db.add_argument('-p', '--password', type=str, default=None)
+    seed_db.add_argument('--unique-passwords', dest='unique_passwords',
+                         action='store_true', default=None)
+    seed_db.add_argument('--processes', type=_positive, default=None)
+    seed_db.add_argument('-b', '--batch-size', dest='batch_size',
+                         type=_positive, default=100000)
+    seed_db.add_argument('--random-seed', dest='random_seed', type=int,
+                         default=None)
+
     args = parser.parse_args()
     if 'used' not in args:
         return
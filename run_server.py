@@ -1,24 +1,61 @@
 #!/usr/bin/env python3
 
+import argparse
+
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 
-from server.conf import HOST, PORT
-from server.app import ServerApp, get_db_pool
+from server.conf import HOST, PORT, ADMIN_HOST, ADMIN_PORT, KEYRING_PATH, \
+    KEY_GRACE_PERIOD, KEYRING_RELOAD_INTERVAL
+from server.app import AdminApp, ServerApp, get_db_pool, get_replica_pools
+from server.keyring import Keyring
 
 
 def main():
+    parser = argparse.ArgumentParser(prog='tasker-server')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of server processes, 0 - one per CPU')
+    args = parser.parse_args()
+
+    # Load or create the keyring before forking, all processes share keys
+    keyring = Keyring.load(KEYRING_PATH, KEY_GRACE_PERIOD)
+    processes = args.processes or tornado.process.cpu_count()
+    multiprocess = processes != 1
+    if multiprocess:
+        tornado.process.fork_processes(processes)
+    # Every process binds its own socket with SO_REUSEPORT,
+    # the kernel balances connections between them
+    sockets = tornado.netutil.bind_sockets(PORT, HOST, reuse_port=multiprocess)
+
     loop = tornado.ioloop.IOLoop.current()
     db_pool = loop.asyncio_loop.run_until_complete(get_db_pool())
-    app = ServerApp(loop.asyncio_loop, db_pool)
+    replica_pools = loop.asyncio_loop.run_until_complete(get_replica_pools())
+    app = ServerApp(loop.asyncio_loop, db_pool, keyring, replica_pools,
+                    processes)
     http_server = tornado.httpserver.HTTPServer(app)
-    http_server.listen(PORT, HOST)
+    http_server.add_sockets(sockets)
+    if ADMIN_PORT:
+        # Metrics are collected per process, so is the admin port
+        AdminApp(app).listen(
+            ADMIN_PORT + (tornado.process.task_id() or 0), ADMIN_HOST
+        )
+    # Pick up keys rotated by `db_manage.py keyring-rotate`
+    tornado.ioloop.PeriodicCallback(
+        keyring.reload, KEYRING_RELOAD_INTERVAL * 1000
+    ).start()
+    app.tokens_reaper.start()
+    app.tombstones_reaper.start()
+    app.replicas.start()
 
     try:
         loop.start()
     except KeyboardInterrupt:
-        app.db_pool.close()
-        loop.asyncio_loop.run_until_complete(app.db_pool.wait_closed())
+        app.pwhash.shutdown()
+        for _db_pool in [app.db_pool, *app.replicas.db_pools]:
+            _db_pool.close()
+            loop.asyncio_loop.run_until_complete(_db_pool.wait_closed())
         loop.stop()
     finally:
         loop.close()
@@ -1,25 +1,82 @@
 
 from concurrent.futures import ThreadPoolExecutor
 
-import aiopg
-import nacl.utils
 import tornado.web
 
-from .conf import DEBUG, TOKEN_EXPIRES_TIME, WORKERS, DB_SETTINGS
+from .cache import TokenCache
+from .conf import DEBUG, TOKEN_EXPIRES_TIME, TOKEN_CACHE_SIZE, \
+    TOKEN_CACHE_TTL, KEYRING_PATH, KEY_GRACE_PERIOD, TOKENS_PURGE_INTERVAL, \
+    TOKENS_PURGE_BATCH_SIZE, PAGE_SIZE, PAGE_SIZE_MAX, STREAM_FETCH_SIZE, \
+    TASKS_BULK_MAX, BATCH_REQUESTS_MAX, WORKERS, CRYPTO_DISPATCH, \
+    DB_SETTINGS, DB_PREPARE, DB_DRIVER, DB_REPLICAS, DB_REPLICA_MAX_LAG, \
+    DB_REPLICA_CHECK_INTERVAL, DB_SLOW_QUERY_TIME, DB_SLOW_QUERY_EXPLAIN, \
+    READ_YOUR_WRITES_WINDOW, TOMBSTONES_RETENTION, \
+    TOMBSTONES_PURGE_INTERVAL, TOMBSTONES_PURGE_BATCH_SIZE, \
+    COMPRESS_ENCODINGS, COMPRESS_LEVELS, COMPRESS_MIN_SIZE, \
+    COMPRESS_EXECUTOR_SIZE, PWHASH_PROCESSES, PWHASH_QUEUE_SIZE, \
+    PWHASH_OPSLIMIT, PWHASH_MEMLIMIT, PWHASH_RETRY_AFTER
+from .compression import COMPRESSORS, KNOWN_ENCODINGS
+from .db import DRIVERS
+from .handlers.admin import MetricsHandler
+from .handlers.api.batch import ApiBatchHandler
 from .handlers.api.tokens import ApiTokensNewHandler, ApiTokensRenewHandler
 from .handlers.api.projects import ApiProjectHandler, ApiProjectAllHandler
 from .handlers.api.folders import ApiFolderProjectHandler, ApiFolderHandler
+from .handlers.api.sync import ApiSyncHandler
 from .handlers.api.tasks import ApiTaskFolderHandler, ApiTaskProjectHandler, \
-    ApiTaskHandler
+    ApiTaskHandler, ApiTaskFolderBulkHandler, ApiTaskProjectBulkHandler
+from .keyring import Keyring
+from .metrics import Metrics
+from .pwhash import PasswordHasher
+from .reaper import TokensReaper, TombstonesReaper
+from .replicas import Replicas
 
 
 class ServerApp(tornado.web.Application):
-    def __init__(self, loop, db_pool):
+    def __init__(self, loop, db_pool, keyring=None, replica_pools=(),
+                 server_processes=1):
         self.loop = loop
         self.db_pool = db_pool
-        self.mac_key = nacl.utils.random(size=64)
+        self.replicas = Replicas(
+            list(replica_pools), DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL,
+            READ_YOUR_WRITES_WINDOW
+        )
+        if keyring is None:
+            keyring = Keyring.load(KEYRING_PATH, KEY_GRACE_PERIOD)
+        self.keyring = keyring
         self.token_expires_time = TOKEN_EXPIRES_TIME
+        self.token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+        self.tokens_reaper = TokensReaper(
+            db_pool, TOKENS_PURGE_INTERVAL, TOKENS_PURGE_BATCH_SIZE
+        )
+        self.tombstones_reaper = TombstonesReaper(
+            db_pool, TOMBSTONES_PURGE_INTERVAL, TOMBSTONES_PURGE_BATCH_SIZE,
+            TOMBSTONES_RETENTION
+        )
+        self.page_size = PAGE_SIZE
+        self.page_size_max = PAGE_SIZE_MAX
+        self.stream_fetch_size = STREAM_FETCH_SIZE
+        self.tasks_bulk_max = TASKS_BULK_MAX
+        self.batch_requests_max = BATCH_REQUESTS_MAX
+        self.metrics = Metrics()
         self.pool_executor = ThreadPoolExecutor(max_workers=WORKERS)
+        if CRYPTO_DISPATCH not in ('inline', 'executor'):
+            raise ValueError('invalid CRYPTO_DISPATCH value')
+        self.crypto_dispatch = CRYPTO_DISPATCH
+        # PWHASH_PROCESSES is shared by all server processes of the host
+        self.pwhash = PasswordHasher(
+            max(1, PWHASH_PROCESSES // server_processes), PWHASH_QUEUE_SIZE,
+            PWHASH_OPSLIMIT, PWHASH_MEMLIMIT
+        )
+        self.pwhash_retry_after = PWHASH_RETRY_AFTER
+        if not set(COMPRESS_ENCODINGS) <= set(KNOWN_ENCODINGS):
+            raise ValueError('invalid COMPRESS_ENCODINGS value')
+        self.compress_encodings = [
+            item for item in COMPRESS_ENCODINGS if item in COMPRESSORS
+        ]
+        self.compress_levels = COMPRESS_LEVELS
+        self.compress_min_size = COMPRESS_MIN_SIZE
+        self.compress_executor_size = COMPRESS_EXECUTOR_SIZE
 
         handlers = [
             (r'/api/tokens/new', ApiTokensNewHandler),
@@ -32,8 +89,14 @@ class ServerApp(tornado.web.Application):
             (r'/api/folder/([0-9]*)/([0-9]*/?)', ApiFolderHandler),
 
             (r'/api/task/([0-9]*/?)', ApiTaskProjectHandler),
+            (r'/api/task/([0-9]*)/bulk/?', ApiTaskProjectBulkHandler),
             (r'/api/task/([0-9]*)/([0-9]*/?)', ApiTaskFolderHandler),
-            (r'/api/task/([0-9]*)/([0-9]*)/([0-9]*/?)', ApiTaskHandler)
+            (r'/api/task/([0-9]*)/([0-9]*)/bulk/?', ApiTaskFolderBulkHandler),
+            (r'/api/task/([0-9]*)/([0-9]*)/([0-9]*/?)', ApiTaskHandler),
+
+            (r'/api/sync/([0-9]*/?)', ApiSyncHandler),
+
+            (r'/api/batch/?', ApiBatchHandler)
         ]
         #template_path = os.path.join(os.path.dirname(__file__), 'templates')
         #static_path = os.path.join(os.path.dirname(__file__), 'static')
@@ -42,11 +105,50 @@ class ServerApp(tornado.web.Application):
             #'static_path': static_path,
             'debug': DEBUG,
             'xsrf_cookies': True,
-            'cookie_secret': nacl.utils.random(size=64)
+            'cookie_secret': self.keyring.cookie_secret
         }
 
         super().__init__(handlers, **settings)
 
 
-async def get_db_pool():
-    return await aiopg.create_pool(**DB_SETTINGS)
+class AdminApp(tornado.web.Application):
+    """ Admin endpoints of a server process, served on a separate port """
+
+    def __init__(self, app):
+        """
+        :param app: the server application
+        :type app: ServerApp
+        """
+        handlers = [
+            (r'/metrics', MetricsHandler, {'app': app})
+        ]
+        super().__init__(handlers)
+
+
+async def get_db_pool(prepare=DB_PREPARE, driver=DB_DRIVER,
+                      settings=DB_SETTINGS):
+    """ Create the db pool
+    :param prepare: prepare statements of queries
+    :type prepare: bool
+    :param driver: name of the db driver, one of `server.db.DRIVERS`
+    :type driver: str
+    :param settings: connection settings
+    :type settings: dict
+    :rtype: server.db.Database
+    """
+    if driver not in DRIVERS:
+        raise ValueError('invalid DB_DRIVER value')
+    db_pool = DRIVERS[driver](
+        settings, prepare, slow_query_time=DB_SLOW_QUERY_TIME,
+        explain=DEBUG and DB_SLOW_QUERY_EXPLAIN
+    )
+    await db_pool.connect()
+    return db_pool
+
+
+async def get_replica_pools():
+    """ Create pools of read replicas from `DB_REPLICAS` """
+    return [
+        await get_db_pool(settings=dict(DB_SETTINGS, **replica))
+        for replica in DB_REPLICAS
+    ]
@@ -0,0 +1,87 @@
+from collections import OrderedDict, namedtuple
+import time
+
+CachedToken = namedtuple(
+    'CachedToken',
+    ['user_id', 'username', 'token_verify', 'key_id', 'expires_in']
+)
+
+
+class TokenCache:
+    """ Bounded LRU cache of authenticated tokens keyed by token_select.
+
+    An entry lives until the token expires or until `ttl` seconds pass,
+    whichever comes first, so tokens deleted outside of the app (e.g. by
+    `db_manage.py user-del`) stop working after `ttl` seconds at most.
+    The same holds for tokens renewed by another server process, entries
+    are evicted only by the process which has served the renew. Requests
+    which check access select tokens from db anyway and evict stale entries.
+    The cache is used only from the event loop thread, no locking needed.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        :param size: max number of cached tokens, 0 disables the cache
+        :type size: int
+        :param ttl: max lifetime of a cache entry in seconds
+        :type ttl: int
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token_select):
+        """ Get cached token
+        :param token_select: select token
+        :type token_select: str
+        :return: cached token or None if it isn't cached or has expired
+        :rtype: CachedToken
+        """
+        entry = self._entries.get(token_select)
+        if entry is not None and entry.expires_in <= time.monotonic():
+            del self._entries[token_select]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token_select)
+        self.hits += 1
+        return entry
+
+    def set(self, token_select, user_id, username, token_verify, key_id,
+            expires_in):
+        """ Cache authenticated token
+        :param token_select: select token
+        :type token_select: str
+        :param user_id: id of the token owner
+        :type user_id: int
+        :param username: username of the token owner
+        :type username: str
+        :param token_verify: hash of verify token selected from db
+        :type token_verify: bytes
+        :param key_id: id of the key used for hashing verify token
+        :type key_id: str
+        :param expires_in: number of seconds the token remains valid
+        :type expires_in: int
+        """
+        if self.size <= 0:
+            return
+        expires_in = time.monotonic() + min(expires_in, self.ttl)
+        self._entries[token_select] = CachedToken(
+            user_id, username, token_verify, key_id, expires_in
+        )
+        self._entries.move_to_end(token_select)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def evict(self, token_select):
+        """ Remove token from the cache """
+        self._entries.pop(token_select, None)
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
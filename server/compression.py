@@ -0,0 +1,111 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor:
+    """ Streaming compressor of a content encoding. Every compressed chunk
+    can be decoded by a client as soon as it's received
+    """
+
+    encoding = None
+
+    def __init__(self, level):
+        """
+        :param level: compression level, its range depends on the encoding
+        :type level: int
+        """
+        self.level = level
+
+    def compress(self, data, final=False):
+        """ Compress a chunk
+        :param data: chunk of the body
+        :type data: bytes
+        :param final: the chunk is the last one, end the stream
+        :type final: bool
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    encoding = 'gzip'
+
+    def __init__(self, level):
+        super().__init__(level)
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, final=False):
+        mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._obj.compress(data) + self._obj.flush(mode)
+
+
+class BrotliCompressor(Compressor):
+    encoding = 'br'
+
+    def __init__(self, level):
+        super().__init__(level)
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data, final=False):
+        res = self._obj.process(data)
+        return res + (self._obj.finish() if final else self._obj.flush())
+
+
+class ZstdCompressor(Compressor):
+    encoding = 'zstd'
+
+    def __init__(self, level):
+        super().__init__(level)
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data, final=False):
+        mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else \
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._obj.compress(data) + self._obj.flush(mode)
+
+
+# Encodings which can be used, brotli and zstd are optional dependencies
+COMPRESSORS = {GzipCompressor.encoding: GzipCompressor}
+if brotli is not None:
+    COMPRESSORS[BrotliCompressor.encoding] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS[ZstdCompressor.encoding] = ZstdCompressor
+KNOWN_ENCODINGS = ('gzip', 'br', 'zstd')
+
+
+def negotiate(accept_encoding, encodings):
+    """ Choose a content encoding accepted by a client
+    :param accept_encoding: value of `Accept-Encoding` header
+    :type accept_encoding: str
+    :param encodings: encodings in order of the server preference
+    :type encodings: list
+    :return: encoding or None if the body has to be sent as is
+    :rtype: str
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
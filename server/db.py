@@ -0,0 +1,509 @@
+from contextlib import asynccontextmanager
+import functools
+import json
+import time
+
+import aiopg
+import psycopg2
+from psycopg2 import sql
+from tornado.log import app_log
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .metrics import Histogram
+from .sql.names import QUERY_NAMES
+from .sql.prepared import PREPARED, number_placeholders
+from .sql.select import SelectQueries
+
+
+class Rows(list):
+    """ Rows selected by a query. Rows are indexed like tuples,
+    `columns` are names of the columns
+    """
+
+    def __init__(self, rows, columns):
+        super().__init__(rows)
+        self.columns = columns
+
+
+class Database:
+    """ Pool of db connections of a driver. Queries are written for psycopg2:
+    text with `%s` or `%(name)s` placeholders or `psycopg2.sql.Composed`,
+    arguments are a sequence or a dict.
+    Subclasses implement `connect`, `close`, `wait_closed`, `stats`
+    and `_acquire`
+    """
+
+    driver = None
+
+    def __init__(self, settings, prepare=True, slow_query_time=0,
+                 explain=False):
+        """
+        :param settings: connection settings, `DB_SETTINGS`
+        :type settings: dict
+        :param prepare: prepare statements of queries
+        :type prepare: bool
+        :param slow_query_time: queries running for the time in seconds
+            or longer are logged, 0 disables the log
+        :type slow_query_time: float
+        :param explain: log plans of slow select queries
+        :type explain: bool
+        """
+        self.settings = settings
+        self.prepare = prepare
+        self.slow_query_time = slow_query_time
+        self.explain = explain
+        # Time waited for a free connection
+        self.acquire_wait = Histogram()
+        # Time of queries by their names
+        self.queries = {}
+        self._pool = None
+
+    async def connect(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    async def wait_closed(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """ Get numbers of open connections `size`, connections in use
+        `in_use` and max number of connections `max_size`
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def acquire(self):
+        """ Acquire a connection from the pool
+        :return: async context manager of `Connection`
+        """
+        start = time.perf_counter()
+        async with self._acquire() as conn:
+            self.acquire_wait.observe(time.perf_counter() - start)
+            yield conn
+
+    def observe_query(self, name, elapsed):
+        """
+        :param name: name of the query, see `server.sql.names`
+        :type name: str
+        :param elapsed: time of the query in seconds
+        :type elapsed: float
+        """
+        histogram = self.queries.get(name)
+        if histogram is None:
+            histogram = self.queries[name] = Histogram()
+        histogram.observe(elapsed)
+
+    async def fetch(self, query, args=None):
+        """ Execute a query on any connection and fetch all rows """
+        async with self.acquire() as conn:
+            return await conn.fetch(query, args)
+
+    async def execute(self, query, args=None):
+        """ Execute a query on any connection
+        :return: number of rows affected by the query
+        """
+        async with self.acquire() as conn:
+            return await conn.execute(query, args)
+
+
+def _redact(args):
+    """ Describe query arguments without their values """
+    if not args:
+        return '()'
+    if isinstance(args, dict):
+        return '{' + ', '.join('{}: ?'.format(key) for key in args) + '}'
+    return '(' + ', '.join('?' for _ in args) + ')'
+
+
+class Connection:
+    """ Connection of a driver. Every query is timed and observed by
+    the name of the query, see `server.sql.names`.
+    Subclasses implement `_fetch`, `_execute`, `_transaction` and `stream`
+    """
+
+    def __init__(self, conn, db):
+        self._conn = conn
+        self._db = db
+        # Depth of nested transactions
+        self._transactions = 0
+
+    async def fetch(self, query, args=None):
+        """ Execute a query and fetch all rows
+        :rtype: Rows
+        """
+        start = time.perf_counter()
+        rows = await self._fetch(query, args)
+        await self._observe(query, args, time.perf_counter() - start)
+        return rows
+
+    async def execute(self, query, args=None):
+        """ Execute a query
+        :return: number of rows affected by the query
+        :rtype: int
+        """
+        start = time.perf_counter()
+        count = await self._execute(query, args)
+        await self._observe(query, args, time.perf_counter() - start)
+        return count
+
+    @asynccontextmanager
+    async def transaction(self, isolation=None, readonly=False):
+        """ Async context manager of a transaction, it's committed on exit
+        and rolled back on an exception. A nested transaction is a savepoint,
+        it can't set modes
+        :param isolation: isolation level: 'read_committed',
+            'repeatable_read' or 'serializable', None - the default one
+        :type isolation: str
+        :param readonly: start a read-only transaction
+        :type readonly: bool
+        """
+        self._transactions += 1
+        try:
+            async with self._transaction(isolation, readonly):
+                yield self
+        finally:
+            self._transactions -= 1
+
+    async def _fetch(self, query, args):
+        raise NotImplementedError
+
+    async def _execute(self, query, args):
+        raise NotImplementedError
+
+    def _transaction(self, isolation, readonly):
+        raise NotImplementedError
+
+    async def _observe(self, query, args, elapsed, name=None):
+        """ Observe time of a query and log it if the query is slow.
+        A slow select query is run again with EXPLAIN ANALYZE if it's
+        enabled, unless it's in a transaction, a failure would abort it
+        :param name: name of the query, by default it's found by the text
+        """
+        text = _render(query)
+        if name is None:
+            name = QUERY_NAMES.get(text)
+        self._db.observe_query(name, elapsed)
+        if not self._db.slow_query_time or \
+                elapsed < self._db.slow_query_time:
+            return
+        plan = ''
+        if self._db.explain and not self._transactions and \
+                name.startswith('SelectQueries.'):
+            try:
+                _res = await self._fetch(
+                    SelectQueries.explain.format(text), args
+                )
+                plan = '\n' + '\n'.join(row[0] for row in _res)
+            except Exception:
+                app_log.warning('EXPLAIN of %s failed', name, exc_info=True)
+        if name == QUERY_NAMES.unknown:
+            name = text.strip()
+        # Values of arguments may be secrets, e.g. tokens
+        app_log.warning('Slow query %s: %.3fs, args %s%s',
+                        name, elapsed, _redact(args), plan)
+
+    def stream(self, query, args=None):
+        """ Select rows through a server-side cursor inside a transaction
+        :return: async context manager of a cursor with
+            `async fetch(size)` method, empty Rows mean the end of rows
+        """
+        raise NotImplementedError
+
+
+class SingleConnection:
+    """ A connection used in place of a pool, e.g. by sub-requests of
+    a batch sharing a transaction. Queries are executed one after another
+    """
+
+    def __init__(self, conn):
+        """
+        :param conn: connection acquired from a pool
+        :type conn: Connection
+        """
+        self._conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self._conn
+
+    async def fetch(self, query, args=None):
+        return await self._conn.fetch(query, args)
+
+    async def execute(self, query, args=None):
+        return await self._conn.execute(query, args)
+
+
+class AiopgConnection(Connection):
+    _set_transaction = 'SET TRANSACTION {}'
+    # Nested transactions are savepoints named by their depth
+    _savepoint = 'SAVEPOINT tasker_{}'
+    _release_savepoint = 'RELEASE SAVEPOINT tasker_{}'
+    _rollback_savepoint = 'ROLLBACK TO SAVEPOINT tasker_{}'
+
+    def _query(self, query):
+        if self._db.prepare and isinstance(query, str):
+            return PREPARED.get(query)
+        return query
+
+    async def _fetch(self, query, args):
+        async with self._conn.cursor() as cur:
+            await cur.execute(self._query(query), args)
+            rows = await cur.fetchall()
+            return Rows(rows, [item.name for item in cur.description])
+
+    async def _execute(self, query, args):
+        async with self._conn.cursor() as cur:
+            await cur.execute(self._query(query), args)
+            return cur.rowcount
+
+    @asynccontextmanager
+    async def _transaction(self, isolation, readonly):
+        modes = []
+        if isolation is not None:
+            modes.append(
+                'ISOLATION LEVEL ' + isolation.replace('_', ' ').upper()
+            )
+        if readonly:
+            modes.append('READ ONLY')
+        if self._transactions > 1:
+            if modes:
+                raise ValueError('modes of a nested transaction')
+            async with self._nested_transaction(self._transactions):
+                yield self
+            return
+        async with self._conn.cursor() as cur:
+            async with cur.begin():
+                if modes:
+                    await cur.execute(
+                        self._set_transaction.format(', '.join(modes))
+                    )
+                yield self
+
+    @asynccontextmanager
+    async def _nested_transaction(self, depth):
+        async with self._conn.cursor() as cur:
+            await cur.execute(self._savepoint.format(depth))
+            try:
+                yield
+            except BaseException:
+                await cur.execute(self._rollback_savepoint.format(depth))
+                raise
+            await cur.execute(self._release_savepoint.format(depth))
+
+    @asynccontextmanager
+    async def stream(self, query, args=None):
+        async with self.transaction():
+            await self.execute(
+                SelectQueries.stream_declare.format(query), args
+            )
+            yield AiopgStream(self, QUERY_NAMES.get(_render(query)))
+
+
+class AiopgStream:
+    def __init__(self, conn, name):
+        """
+        :param conn: connection of the stream
+        :type conn: AiopgConnection
+        :param name: name of the streamed query
+        :type name: str
+        """
+        self._conn = conn
+        self._name = name
+
+    async def fetch(self, size):
+        start = time.perf_counter()
+        rows = await self._conn._fetch(SelectQueries.stream_fetch, (size,))
+        await self._conn._observe(
+            SelectQueries.stream_fetch, (size,), time.perf_counter() - start,
+            self._name + ' (stream)'
+        )
+        return rows
+
+
+class AiopgDatabase(Database):
+    driver = 'aiopg'
+
+    async def connect(self):
+        # Statements are prepared on every new connection
+        on_connect = self._prepare if self.prepare else None
+        self._pool = await aiopg.create_pool(
+            on_connect=on_connect, **self.settings
+        )
+
+    async def _prepare(self, conn):
+        """ Prepare statements on a new connection. Statements refer to
+        the current schema, if the database hasn't been migrated yet
+        queries are executed as text
+        """
+        if not self.prepare:
+            return
+        try:
+            await PREPARED.prepare(conn)
+        except psycopg2.Error:
+            app_log.error('Statements can\'t be prepared, queries are '
+                          'executed as text. Run `db_manage.py migrate`',
+                          exc_info=True)
+            self.prepare = False
+
+    def close(self):
+        self._pool.close()
+
+    async def wait_closed(self):
+        await self._pool.wait_closed()
+
+    def stats(self):
+        return {
+            'size': self._pool.size,
+            'in_use': self._pool.size - self._pool.freesize,
+            'max_size': self._pool.maxsize
+        }
+
+    @asynccontextmanager
+    async def _acquire(self):
+        async with self._pool.acquire() as conn:
+            yield AiopgConnection(conn, self)
+
+
+def _render(query):
+    """ Get text of `psycopg2.sql.Composable` without a psycopg2 connection,
+    only SQL, Identifier and Placeholder are used by the queries
+    """
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return ''.join(_render(item) for item in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return '.'.join(
+            '"{}"'.format(s.replace('"', '""')) for s in query.strings
+        )
+    if isinstance(query, sql.Placeholder):
+        if query.name is None:
+            return '%s'
+        return '%({})s'.format(query.name)
+    raise TypeError('unsupported query part: {!r}'.format(query))
+
+
+@functools.lru_cache(maxsize=1024)
+def _numbered(query):
+    return number_placeholders(query)
+
+
+class AsyncpgConnection(Connection):
+    @staticmethod
+    def _query(query, args):
+        """ Convert a query and its arguments for asyncpg
+        :return: query with `$n` parameters, positional arguments
+        :rtype: tuple
+        """
+        query, names = _numbered(_render(query))
+        if not names:
+            return query, ()
+        if isinstance(args, dict):
+            return query, [args[key] for key in names]
+        return query, args
+
+    async def _fetch(self, query, args):
+        query, args = self._query(query, args)
+        rows = await self._conn.fetch(query, *args)
+        return Rows(rows, list(rows[0].keys()) if rows else [])
+
+    async def _execute(self, query, args):
+        query, args = self._query(query, args)
+        # Status is a command tag, e.g. `DELETE 10`
+        status = await self._conn.execute(query, *args)
+        count = status.rsplit(' ', 1)[-1]
+        return int(count) if count.isdigit() else -1
+
+    @asynccontextmanager
+    async def _transaction(self, isolation, readonly):
+        async with self._conn.transaction(isolation=isolation,
+                                          readonly=readonly):
+            yield self
+
+    @asynccontextmanager
+    async def stream(self, query, args=None):
+        name = QUERY_NAMES.get(_render(query))
+        query, args = self._query(query, args)
+        async with self.transaction():
+            cursor = await self._conn.cursor(query, *args)
+            yield AsyncpgStream(self, cursor, name)
+
+
+class AsyncpgStream:
+    def __init__(self, conn, cursor, name):
+        """
+        :param conn: connection of the stream
+        :type conn: AsyncpgConnection
+        :param cursor: asyncpg cursor
+        :param name: name of the streamed query
+        :type name: str
+        """
+        self._conn = conn
+        self._cursor = cursor
+        self._name = name
+
+    async def fetch(self, size):
+        start = time.perf_counter()
+        rows = await self._cursor.fetch(size)
+        await self._conn._observe(
+            SelectQueries.stream_fetch, (size,), time.perf_counter() - start,
+            self._name + ' (stream)'
+        )
+        return Rows(rows, list(rows[0].keys()) if rows else [])
+
+
+class AsyncpgDatabase(Database):
+    driver = 'asyncpg'
+
+    @staticmethod
+    async def _init(conn):
+        # aiopg decodes json by default
+        await conn.set_type_codec(
+            'json', encoder=json.dumps, decoder=json.loads,
+            schema='pg_catalog'
+        )
+
+    async def connect(self):
+        if asyncpg is None:
+            raise RuntimeError('asyncpg is not installed')
+        # asyncpg prepares and caches statements of queries itself,
+        # the cache size 0 disables it
+        self._pool = await asyncpg.create_pool(
+            min_size=1, max_size=10, init=self._init,
+            statement_cache_size=100 if self.prepare else 0,
+            **self.settings
+        )
+
+    def close(self):
+        # asyncpg closes the pool gracefully in a coroutine, see wait_closed
+        pass
+
+    async def wait_closed(self):
+        await self._pool.close()
+
+    def stats(self):
+        return {
+            'size': self._pool.get_size(),
+            'in_use': self._pool.get_size() - self._pool.get_idle_size(),
+            'max_size': self._pool.get_max_size()
+        }
+
+    @asynccontextmanager
+    async def _acquire(self):
+        async with self._pool.acquire() as conn:
+            yield AsyncpgConnection(conn, self)
+
+
+DRIVERS = {
+    AiopgDatabase.driver: AiopgDatabase,
+    AsyncpgDatabase.driver: AsyncpgDatabase
+}
@@ -0,0 +1,16 @@
+import tornado.web
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, app):
+        """
+        :param app: the server application
+        :type app: server.app.ServerApp
+        """
+        self.app = app
+
+    def get(self):
+        """ Return metrics of the process in the Prometheus text format """
+        self.set_header('Content-Type',
+                        'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.app.metrics.expose(self.app))
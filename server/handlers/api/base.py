@@ -1,4 +1,6 @@
 
+import base64
+import binascii
 from datetime import datetime
 import functools
 
@@ -9,18 +11,37 @@ import tornado.escape
 import tornado.web
 
 from ..base import BaseHandler
+from ...serializer import dumps, row_shape
 from ...sql.select import SelectQueries
 
 
 class BaseApiHandler(BaseHandler):
     @property
-    def mac_key(self):
-        return self.application.mac_key
+    def keyring(self):
+        return self.application.keyring
+
+    @property
+    def token_cache(self):
+        return self.application.token_cache
 
     def check_xsrf_cookie(self):
         """ Don't verify _xsrf when use token-based access """
         pass
 
+    def write(self, chunk):
+        """ Write a chunk, dicts are encoded by `server.serializer.dumps` """
+        if isinstance(chunk, dict):
+            chunk = dumps(chunk)
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        super().write(chunk)
+
+    def write_row(self, rows):
+        """ Write the first of selected rows as an object
+        :type rows: server.db.Rows
+        """
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(row_shape(tuple(rows.columns)).encode(rows[0]))
+
     async def hash_token(self, token, mac_key=None):
         """ Get hash of a token
         :param token: token for hashing
@@ -30,8 +51,7 @@ class BaseApiHandler(BaseHandler):
         :return: hex encoded hash of the token
         :rtype: bytes
         """
-        return await self.loop.run_in_executor(
-            self.pool_executor,
+        return await self.run_crypto(
             # functools.partial used to pass keyword arguments to function
             functools.partial(
                 # function
@@ -43,97 +63,375 @@ class BaseApiHandler(BaseHandler):
             )
         )
 
-    async def check_token_verify(self, plain, hashed):
+    async def check_token_verify(self, plain, hashed, key_id):
         """ Check given plain-text token with a hashed one
         :param plain: verify token in plain text provided by user
         :type plain: str
         :param hashed: verify token selected from db
         :type hashed: bytes
+        :param key_id: id of the key used for hashing the token
+        :type key_id: str
         :return: True if hashed_token equals hash of plain_token
         :rtype: bool
         """
-        _hashed = await self.hash_token(plain, self.mac_key)
-        return await self.loop.run_in_executor(
-            self.pool_executor, sodium_memcmp, hashed, _hashed
-        )
+        mac_key = self.keyring.get(key_id)
+        # The key has been retired and its grace period has passed
+        if mac_key is None:
+            return False
+        _hashed = await self.hash_token(plain, mac_key)
+        return await self.run_crypto(sodium_memcmp, hashed, _hashed)
 
 
 class ApiHandler(BaseApiHandler):
-    _access_check = ('folder', 'task', 'project')
+    _access_check = ('folder', 'task', 'project', 'sync')
+    # Last path segments which aren't ids, e.g. /api/task/1/1/bulk
+    _path_actions = ('bulk',)
+    # Pool of a replica used by a GET request, None - the primary
+    _read_pool = None
+    # Batch of a sub-request of /api/batch, see `handlers.api.batch`
+    _batch = None
+    # GET responses depend only on the content of the requested project,
+    # its version is the ETag
+    _etag = False
+    # Version of the project in the pool the content is read from
+    _version = None
+    # Number of pub ids in a path: (access query, tokens and access query)
+    _access_queries = {
+        0: (None, SelectQueries.token_auth),
+        1: (SelectQueries.project_access, SelectQueries.token_project_access),
+        2: (SelectQueries.project_folder_access,
+            SelectQueries.token_project_folder_access),
+        3: (SelectQueries.project_folder_task_access,
+            SelectQueries.token_project_folder_task_access)
+    }
+
+    @property
+    def db_pool(self):
+        """ Pool used by the request handler: a replica for GET requests
+        if there is a healthy one, otherwise the primary. Tokens and access
+        are always checked on the primary. Sub-requests of a batch sharing
+        a transaction use its connection
+        """
+        if self._read_pool is not None:
+            return self._read_pool
+        if self._batch is not None and self._batch.connection is not None:
+            return self._batch.connection
+        return self.application.db_pool
+
+    def on_finish(self):
+        super().on_finish()
+        replicas = self.application.replicas
+        if self._read_pool is not None and self.get_status() >= 500:
+            replicas.fail(self._read_pool)
+        elif self.request.method != 'GET' and self.get_status() < 400 and \
+                self.current_user is not None:
+            replicas.mark_write(self.current_user['token_select'])
 
     @staticmethod
     def datetime_from_timestamp(val):
         try:
             res = datetime.utcfromtimestamp(int(val))
-        # ValueError if value cannot be converted to int
+        # ValueError or TypeError if value cannot be converted to int
         # OSError if value is too big for being timestamp
-        except (ValueError, OSError):
+        except (ValueError, TypeError, OSError):
             res = None
         return res
 
+    def get_access_ids(self):
+        """ Get pub ids of a project, folder and task requested by a user
+        :return: (project_pub_id, folder_pub_id, task_pub_id) truncated to
+            the ids present in the request path, empty if the path doesn't
+            require access check
+        :rtype: tuple
+        """
+        path_list = self.request.path.strip('/').split('/')
+        if path_list[-1] in self._path_actions:
+            path_list.pop()
+        if path_list[1] not in self._access_check or \
+                (path_list[1] == 'project' and len(path_list) == 2):
+            return ()
+        ids = path_list[2:5]
+        # e.g. empty segment of /api/task//1
+        if not all(item.isdigit() for item in ids):
+            raise tornado.web.HTTPError(404)
+        return tuple(int(item) for item in ids)
+
+    def get_task_patch(self, values):
+        """ Validate new values of task fields
+        :param values: new values by field names, missing fields aren't
+            changed, empty string or None clears optional fields
+        :type values: dict
+        :return: valid values by field names
+        :rtype: dict
+        """
+        args = {}
+        for arg in ('title', 'description', 'datetime_from', 'datetime_due'):
+            if arg not in values:
+                continue
+            val = values[arg]
+            if val in ('', None) and arg != 'title':
+                args[arg] = None
+            # Timestamp validity check
+            elif arg in ('datetime_from', 'datetime_due'):
+                _datetime_val = self.datetime_from_timestamp(val)
+                if _datetime_val is None:
+                    raise tornado.web.HTTPError(400, 'invalid timestamp')
+                args[arg] = _datetime_val
+            elif not isinstance(val, str):
+                raise tornado.web.HTTPError(400, 'invalid {}'.format(arg))
+            else:
+                args[arg] = val
+        return args
+
+    def get_json_body(self):
+        """ Decode JSON request body """
+        try:
+            return tornado.escape.json_decode(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'invalid json')
+
+    @staticmethod
+    def encode_cursor(val):
+        """ Make an opaque pagination cursor from the last seen id """
+        return base64.urlsafe_b64encode(str(val).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """ Get the last seen id from a pagination cursor
+        :return: id or None if the cursor is invalid
+        :rtype: int
+        """
+        try:
+            return int(base64.urlsafe_b64decode(cursor))
+        # binascii.Error if cursor isn't base64
+        # ValueError if decoded cursor isn't int
+        except (binascii.Error, ValueError):
+            return None
+
+    def get_page_args(self):
+        """ Get keyset pagination arguments: `after` is a cursor returned
+        as `next` with the previous page, `limit` is a page size
+        :return: last seen id, page size
+        :rtype: tuple
+        """
+        after = self.get_argument('after', None)
+        limit = self.get_argument('limit', None)
+        if after is None:
+            # All pub ids are positive
+            after = 0
+        else:
+            after = self.decode_cursor(after)
+            if after is None:
+                raise tornado.web.HTTPError(400, 'invalid cursor')
+        if limit is None:
+            limit = self.application.page_size
+        else:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise tornado.web.HTTPError(400, 'invalid limit')
+            if not 0 < limit <= self.application.page_size_max:
+                raise tornado.web.HTTPError(400, 'invalid limit')
+        return after, limit
+
+    def write_page(self, key, rows, limit):
+        """ Write a page of a list
+        :param key: name of the list in the response
+        :type key: str
+        :param rows: rows selected with `limit + 1`, the extra row only
+            shows that the next page exists and isn't written, one of
+            the columns is `id`
+        :type rows: server.db.Rows
+        :param limit: page size
+        :type limit: int
+        """
+        next_cursor = None
+        if len(rows) > limit:
+            del rows[limit:]
+            next_cursor = self.encode_cursor(
+                rows[-1][rows.columns.index('id')]
+            )
+        self.write({key: rows, 'next': next_cursor})
+
+    def is_stream(self):
+        """ Check if a list is requested as a stream of rows in NDJSON """
+        return self.get_argument('format', None) == 'ndjson'
+
+    async def write_stream(self, query, args):
+        """ Write all rows selected by a query as NDJSON, one object per line.
+        Rows are read through a server-side cursor in batches of
+        `STREAM_FETCH_SIZE` and every batch is flushed to the client before
+        the next one is fetched, so memory usage doesn't depend on the
+        number of rows. Batches are compressed if a client accepts it
+        :param query: select query
+        :type query: str
+        :param args: query arguments
+        """
+        self.set_header('Content-Type', 'application/x-ndjson')
+        fetch_size = self.application.stream_fetch_size
+        # Every batch is compressed and flushed separately
+        compressor = self.get_compressor()
+        async with self.db_pool.acquire() as conn:
+            async with conn.stream(query, args) as stream:
+                while True:
+                    _res = await stream.fetch(fetch_size)
+                    if not _res:
+                        break
+                    shape = row_shape(tuple(_res.columns))
+                    chunk = shape.encode_lines(_res)
+                    if compressor is not None:
+                        chunk = await self.compress(compressor, chunk)
+                    self.write(chunk)
+                    await self.flush()
+        if compressor is not None:
+            self.write(await self.compress(compressor, b'', final=True))
+
     async def prepare(self):
         self.current_user = None
+        # Sub-requests of a batch are authenticated by the batch
+        self._batch = getattr(self.request, 'batch', None)
+        if self._batch is not None:
+            return await self._prepare_batched()
         try:
             token_select = self.get_argument('token_select')
             token_verify = self.get_argument('token_verify')
         except tornado.web.MissingArgumentError:
             raise tornado.web.HTTPError(403, 'invalid tokens')
 
-        # Check tokens validity
+        # Project, folder and task ids to check access to
+        access_ids = self.get_access_ids()
+        token_query = self._access_queries[len(access_ids)][1]
+
+        # Check tokens validity, cached tokens don't need a db round trip.
+        # Access needs one anyway, then tokens and access are checked with
+        # a single query, so tokens renewed or deleted by another process
+        # aren't accepted from the cache
         check_token = False
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(SelectQueries.token_auth, (token_select,))
-                _res = await cur.fetchall()
+        cached = None
+        if not access_ids:
+            cached = self.token_cache.get(token_select)
+        if cached is not None:
+            _res = [cached]
+        else:
+            _res = await self.application.db_pool.fetch(
+                token_query, (*access_ids, token_select)
+            )
+            if not _res:
+                self.token_cache.evict(token_select)
         if _res:
-            user_id, username, token_verify_hashed = _res[0]
-            token_verify_hashed = token_verify_hashed.tobytes()
-            if await self.check_token_verify(token_verify, token_verify_hashed):
-                check_token = True
+            user_id, username, token_verify_hashed, key_id, expires_in = \
+                tuple(_res[0])[:5]
+            # memoryview if selected with aiopg, bytes with asyncpg or cached
+            token_verify_hashed = bytes(token_verify_hashed)
+            check_token = await self.check_token_verify(
+                token_verify, token_verify_hashed, key_id
+            )
         if not check_token:
             raise tornado.web.HTTPError(403, 'invalid tokens')
+        if cached is None:
+            self.token_cache.set(
+                token_select, user_id, username, token_verify_hashed, key_id,
+                expires_in
+            )
         current_user = {
             'user_id': user_id,
             # TODO: do i need username and token select here? not sure
             'username': username,
             'token_select': token_select
         }
-
-        # Check access to project and verify project, folder and task ids
-        path_list = self.request.path.strip('/').split('/')
-        path_len = len(path_list)
-        if path_list[1] not in self._access_check or \
-                (path_list[1] == 'project' and path_len == 2):
+        if not access_ids:
             self.current_user = current_user
+            self._route_reads()
             return
-        # project and folder and task, requested task by id
-        elif path_list[1] == 'task' and path_len == 5:
-            # user_id, project_pub_id, folder_pub_id, task_pub_id
-            args = (user_id, path_list[2], path_list[3], path_list[4])
-            query = SelectQueries.project_folder_task_access
-        # project and folder, requested list of tasks by folder
-        elif path_list[1] in ('task', 'folder') and path_len == 4:
-            # user_id, project_pub_id, folder_pub_id
-            args = (user_id, path_list[2], path_list[3])
-            query = SelectQueries.project_folder_access
-        # project, requested project details or list of tasks/folders
-        elif path_list[1] in self._access_check and path_len == 3:
-            # user_id, project_pub_id
-            args = (user_id, path_list[2])
-            query = SelectQueries.project_access
 
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, args)
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        if not _res:
+        # Access to project and project, folder and task ids are checked
+        # Skip user_id, username, token_verify, key_id, expires_in
+        access = dict(zip(_res.columns[5:], tuple(_res[0])[5:]))
+        if access['project_id'] is None:
             raise tornado.web.HTTPError(404)
 
         # Add project_id, folder_id, task_id, role to current_user
         # folder_id and task_id are optional, depends what users accesses
-        current_user.update(dict(zip(desc, _res[0])))
+        current_user.update(access)
         # Read-only restriction
         if self.request.method != 'GET' and current_user['role'] == 0:
             raise tornado.web.HTTPError(405)
         self.current_user = current_user
+        self._route_reads()
+        if self._etag and self.request.method == 'GET':
+            await self._check_version()
+
+    async def _check_version(self):
+        """ Answer a conditional GET by the project version without any
+        query of the content. The version is read from the pool the content
+        is read from, a replica may not have the latest one
+        """
+        version = self.current_user['version']
+        if self._read_pool is not None:
+            _res = await self._read_pool.fetch(
+                SelectQueries.project_version,
+                (self.current_user['project_id'],)
+            )
+            if _res:
+                version = _res[0][0]
+            else:
+                # The replica doesn't have the project yet
+                self._read_pool = None
+        self._version = version
+        self.set_header('Etag', self.compute_etag())
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+
+    async def fetch_row(self, query, args):
+        """ Select a row of an object which access is checked. A replica
+        may not have it yet, then the row is read from the primary
+        :raises tornado.web.HTTPError: 404 if the row isn't found
+        :rtype: server.db.Rows
+        """
+        _res = await self.db_pool.fetch(query, args)
+        if not _res and self._read_pool is not None:
+            self._read_pool = None
+            # The ETag follows the pool, the version of the primary
+            if self._version is not None:
+                self._version = self.current_user['version']
+                self.set_header('Etag', self.compute_etag())
+            _res = await self.db_pool.fetch(query, args)
+        if not _res:
+            raise tornado.web.HTTPError(404)
+        return _res
+
+    async def _prepare_batched(self):
+        """ Use the user of a batch, access to a project, folder and task
+        is checked once per batch
+        """
+        current_user = dict(self._batch.user)
+        access_ids = self.get_access_ids()
+        if access_ids:
+            access = await self._batch.access(
+                access_ids, self._access_queries[len(access_ids)][0]
+            )
+            if access is None:
+                raise tornado.web.HTTPError(404)
+            current_user.update(access)
+            if self.request.method != 'GET' and current_user['role'] == 0:
+                raise tornado.web.HTTPError(405)
+        self.current_user = current_user
+        if self._batch.connection is None:
+            self._route_reads()
+
+    def compute_etag(self):
+        """ ETag of the project version if it's checked,
+        otherwise a hash of the body
+        """
+        if self._version is not None:
+            return self.format_etag(
+                '{}-{}'.format(self.get_access_ids()[0], self._version)
+            )
+        return super().compute_etag()
+
+    def _route_reads(self):
+        if self.request.method == 'GET':
+            self._read_pool = self.application.replicas.get(
+                self.current_user['token_select']
+            )
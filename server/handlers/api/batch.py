@@ -0,0 +1,219 @@
+import asyncio
+import re
+
+from tornado.concurrent import Future
+import tornado.httputil
+import tornado.web
+
+from .base import ApiHandler, BaseApiHandler
+from ...db import SingleConnection
+from ...serializer import dumps
+
+
+class Batch:
+    """ Context shared by sub-requests of a batch: the authenticated user
+    and access to projects, folders and tasks. Access to the same ids is
+    checked once until the next write, e.g. a task may have been deleted
+    """
+
+    def __init__(self, user, db_pool, connection=None):
+        """
+        :param user: the user of the batch request
+        :type user: dict
+        :param db_pool: pool used for access checks
+        :param connection: connection shared by sub-requests running
+            in a transaction, None - sub-requests use pools as usual
+        :type connection: server.db.SingleConnection
+        """
+        self.user = user
+        self.db_pool = db_pool
+        self.connection = connection
+        self._access = {}
+
+    def access(self, ids, query):
+        """ Check access of the user to a project, folder and task
+        :param ids: pub ids from a path
+        :type ids: tuple
+        :param query: access query by the number of ids
+        :type query: str
+        :return: awaitable of access ids and role or None if there is
+            no access, concurrent sub-requests share the check
+        """
+        if ids not in self._access:
+            self._access[ids] = asyncio.ensure_future(
+                self._check_access(ids, query)
+            )
+        return self._access[ids]
+
+    async def _check_access(self, ids, query):
+        _res = await (self.connection or self.db_pool).fetch(
+            query, (self.user['user_id'], *ids)
+        )
+        return dict(zip(_res.columns, _res[0])) if _res else None
+
+    def forget(self):
+        self._access.clear()
+
+
+class _Response(tornado.httputil.HTTPConnection):
+    """ Connection of a sub-request, the response is kept in memory """
+
+    def __init__(self, context):
+        # Address of the client for the request
+        self.context = context
+        self.status = None
+        self.headers = None
+        self.chunks = []
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None):
+        self.status = start_line.code
+        self.headers = headers
+        return self.write(chunk or b'')
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def finish(self):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def encode(self):
+        """ Encode the response as an object with `status` and `body`,
+        the body is null unless it's JSON
+        :rtype: bytes
+        """
+        body = b'null'
+        if self.chunks and self.headers.get('Content-Type', '').startswith(
+                'application/json'):
+            body = b''.join(self.chunks)
+        return b'{"status":%d,"body":%s}' % (self.status, body)
+
+
+class _Rollback(Exception):
+    """ A sub-request running in a transaction has failed """
+
+
+class ApiBatchHandler(ApiHandler):
+    _methods = ('GET', 'POST', 'PUT', 'DELETE')
+    # Paths of sub-requests
+    _paths = re.compile(r'/api/(project|folder|task)(/|$)')
+
+    def on_finish(self):
+        # Sub-requests mark writes for read-your-writes themselves
+        BaseApiHandler.on_finish(self)
+
+    async def post(self):
+        """ Run sub-requests from a JSON object: `requests` is an array
+        of objects with `method`, `path`, optional `args` (arguments of
+        the query string) and `body` (JSON body of bulk requests).
+        The user is authenticated once. Consecutive GET sub-requests run
+        concurrently, the rest one after another in order.
+        With `transaction` all sub-requests run in order in a transaction,
+        it's rolled back and the rest are skipped if one of them fails
+        :return: `responses` in order of the requests with `status` and
+            JSON `body`, `committed` with a transaction
+        """
+        data = self.get_json_body()
+        requests = data.get('requests') if isinstance(data, dict) else None
+        if not isinstance(requests, list) or not requests:
+            raise tornado.web.HTTPError(400, 'array of requests expected')
+        if len(requests) > self.application.batch_requests_max:
+            raise tornado.web.HTTPError(413, 'too many requests')
+        requests = [self._sub_request(item) for item in requests]
+        committed = None
+        if data.get('transaction'):
+            responses, committed = await self._run_transaction(requests)
+        else:
+            responses = await self._run(requests)
+        body = b'{"responses":[' + b','.join(
+            response.encode() for response in responses
+        ) + b']'
+        if committed is not None:
+            body += b',"committed":' + (b'true' if committed else b'false')
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(body + b'}')
+
+    def _sub_request(self, item):
+        """ Make a request of an item of a batch
+        :return: request, body and response
+        :rtype: tuple
+        """
+        if not isinstance(item, dict):
+            raise tornado.web.HTTPError(400, 'invalid request')
+        method = item.get('method')
+        path = item.get('path')
+        args = item.get('args', {})
+        if method not in self._methods or not isinstance(path, str) or \
+                not self._paths.match(path) or not isinstance(args, dict):
+            raise tornado.web.HTTPError(400, 'invalid request')
+        if args.get('format') == 'ndjson':
+            raise tornado.web.HTTPError(400, 'streams are not batched')
+        headers = tornado.httputil.HTTPHeaders({'Host': self.request.host})
+        body = b''
+        if 'body' in item:
+            body = dumps(item['body'])
+            headers['Content-Type'] = 'application/json'
+        response = _Response(self.request.connection.context)
+        request = tornado.httputil.HTTPServerRequest(
+            method=method, uri=tornado.httputil.url_concat(path, args),
+            headers=headers, connection=response
+        )
+        return request, body, response
+
+    async def _fetch(self, batch, request, body, response):
+        """ Run a sub-request by the handler of its path """
+        request.batch = batch
+        delegate = self.application.find_handler(request)
+        if body:
+            delegate.data_received(body)
+        delegate.finish()
+        await response.finished
+        return response
+
+    async def _run(self, requests):
+        batch = Batch(self.current_user, self.application.db_pool)
+        responses = []
+        reads = []
+        for request, body, response in requests:
+            if request.method == 'GET':
+                reads.append(self._fetch(batch, request, body, response))
+                continue
+            # Reads before a write don't see it
+            responses.extend(await asyncio.gather(*reads))
+            reads = []
+            responses.append(
+                await self._fetch(batch, request, body, response)
+            )
+            batch.forget()
+        responses.extend(await asyncio.gather(*reads))
+        return responses
+
+    async def _run_transaction(self, requests):
+        """
+        :return: responses, True if the transaction is committed
+        :rtype: tuple
+        """
+        responses = []
+        async with self.application.db_pool.acquire() as conn:
+            connection = SingleConnection(conn)
+            batch = Batch(self.current_user, connection, connection)
+            try:
+                async with conn.transaction():
+                    for request, body, response in requests:
+                        responses.append(
+                            await self._fetch(batch, request, body, response)
+                        )
+                        if response.status >= 400:
+                            raise _Rollback
+                        if request.method != 'GET':
+                            batch.forget()
+            except _Rollback:
+                return responses, False
+        return responses, True
@@ -1,6 +1,4 @@
 
-from psycopg2.sql import SQL, Identifier
-
 from .base import ApiHandler
 from ...sql.delete import DeleteQueries
 from ...sql.insert import InsertQueries
@@ -9,52 +7,43 @@ from ...sql.update import UpdateQueries
 
 
 class ApiFolderProjectHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id):
-        """ Return all folders in a project """
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.folders, (self.current_user['project_id'],)
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        self.write({'folders': [dict(zip(desc, item)) for item in _res]})
+        """ Return a page of folders in a project """
+        after, limit = self.get_page_args()
+        _res = await self.db_pool.fetch(
+            SelectQueries.folders,
+            (self.current_user['project_id'], after, limit + 1)
+        )
+        self.write_page('folders', _res, limit)
 
     async def post(self, project_pub_id):
         """ Create a new folder """
-        title = self.get_argument('title')
-        project_id = self.current_user['project_id']
-        seq_pf = Identifier('project_folder_{}_seq'.format(project_id))
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SQL(InsertQueries.add_folder).format(seq=seq_pf),
-                    (title, project_id)
-                )
-                folder_pub_id = (await cur.fetchall())[0][1]
+        args = {
+            'title': self.get_argument('title'),
+            'project_id': self.current_user['project_id']
+        }
+        folder_pub_id = (
+            await self.db_pool.fetch(InsertQueries.add_folder, args)
+        )[0][1]
         self.write({'id': folder_pub_id})
 
 
 class ApiFolderHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id, folder_pub_id):
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.folder, (self.current_user['folder_id'],)
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        self.write(dict(zip(desc, _res[0])))
+        _res = await self.fetch_row(
+            SelectQueries.folder, (self.current_user['folder_id'],)
+        )
+        self.write_row(_res)
 
     async def put(self, project_pub_id, folder_pub_id):
         args = (self.get_argument('title'), self.current_user['folder_id'])
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(UpdateQueries.folder, args)
+        await self.db_pool.execute(UpdateQueries.folder, args)
 
     async def delete(self, project_pub_id, folder_pub_id):
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    DeleteQueries.folder, (self.current_user['folder_id'],)
-                )
+        await self.db_pool.execute(
+            DeleteQueries.folder, (self.current_user['folder_id'],)
+        )
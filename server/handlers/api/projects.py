@@ -1,9 +1,7 @@
 
-from psycopg2.sql import SQL, Identifier
 import tornado.web
 
 from .base import ApiHandler
-from ...sql.create import CreateSequenceQueries
 from ...sql.delete import DeleteQueries
 from ...sql.insert import InsertQueries
 from ...sql.select import SelectQueries
@@ -11,17 +9,16 @@ from ...sql.select import SelectQueries
 
 class ApiProjectAllHandler(ApiHandler):
     async def get(self):
-        """ Return all projects available for a user"""
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.projects, (self.current_user['user_id'],)
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        if not _res:
+        """ Return a page of projects available for a user"""
+        after, limit = self.get_page_args()
+        _res = await self.db_pool.fetch(
+            SelectQueries.projects,
+            (self.current_user['user_id'], after, limit + 1)
+        )
+        # The user doesn't have any projects
+        if not _res and after == 0:
             raise tornado.web.HTTPError(404)
-        self.write({'projects': [dict(zip(desc, item)) for item in _res]})
+        self.write_page('projects', _res, limit)
 
     async def post(self):
         """ Create a new project """
@@ -30,55 +27,37 @@ class ApiProjectAllHandler(ApiHandler):
         user_id = self.current_user['user_id']
 
         async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                # Create project
-                await cur.execute(
-                    InsertQueries.add_project, (title, description)
-                )
-                project_id, project_pub_id = (await cur.fetchall())[0]
-
-                # Set owner
-                await cur.execute(
-                    InsertQueries.add_user_project, (project_id, user_id, 2)
-                )
-
-                # Create sequences for the project: folders, tasks
-                seq_pf = Identifier('project_folder_{}_seq'.format(project_id))
-                seq_pt = Identifier('project_task_{}_seq'.format(project_id))
-                await cur.execute(
-                    SQL(CreateSequenceQueries._new_sequence).format(seq=seq_pf)
-                )
-                await cur.execute(
-                    SQL(CreateSequenceQueries._new_sequence).format(seq=seq_pt)
-                )
-
-                # Create default folder
-                await cur.execute(
-                    SQL(InsertQueries.add_folder).format(seq=seq_pf),
-                    ('My Tasks', project_id)
-                )
+            # Create project
+            project_id, project_pub_id = (await conn.fetch(
+                InsertQueries.add_project, (title, description)
+            ))[0]
+
+            # Set owner
+            await conn.execute(
+                InsertQueries.add_user_project, (project_id, user_id, 2)
+            )
+
+            # Create default folder
+            await conn.execute(
+                InsertQueries.add_folder,
+                {'title': 'My Tasks', 'project_id': project_id}
+            )
         self.write({'id': project_pub_id})
 
 
 class ApiProjectHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id):
         """ Return detailed info about a project """
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.project,
-                    (self.current_user['user_id'], project_pub_id)
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        if not _res:
-            raise tornado.web.HTTPError(404)
-        self.write(dict(zip(desc, _res[0])))
+        _res = await self.fetch_row(
+            SelectQueries.project,
+            (self.current_user['user_id'], self.get_access_ids()[0])
+        )
+        self.write_row(_res)
 
     async def delete(self, project_pub_id):
         """ Delete a project by id """
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    DeleteQueries.project, (self.current_user['project_id'],)
-                )
+        await self.db_pool.execute(
+            DeleteQueries.project, (self.current_user['project_id'],)
+        )
@@ -0,0 +1,51 @@
+import tornado.web
+
+from .base import ApiHandler
+from ...sql.select import SelectQueries
+
+
+class ApiSyncHandler(ApiHandler):
+    # The version changes with any change of the project content,
+    # 304 means nothing to sync since the previous response
+    _etag = True
+
+    async def get(self, project_pub_id):
+        """ Return folders and tasks created or edited and ids of deleted
+        ones since a cursor, all folders and tasks without a cursor.
+        The next cursor is returned as `next`. A change may be returned
+        more than once, 410 means tombstones since the cursor have been
+        purged and the client has to sync from scratch
+        """
+        since = self.get_argument('since', None)
+        if since is not None:
+            since = self.decode_cursor(since)
+            if since is None:
+                raise tornado.web.HTTPError(400, 'invalid cursor')
+            # The cursor of an empty client, e.g. of a fresh database,
+            # is a full sync
+            if since == 0:
+                since = None
+        project_id = self.current_user['project_id']
+        deleted = {'folders': [], 'tasks': []}
+        async with self.db_pool.acquire() as conn:
+            # All queries see the same snapshot
+            async with conn.transaction(isolation='repeatable_read',
+                                        readonly=True):
+                next_xid, horizon_xid = tuple(
+                    (await conn.fetch(SelectQueries.sync_snapshot))[0]
+                )
+                if since is not None and since <= horizon_xid:
+                    raise tornado.web.HTTPError(410, 'cursor is too old')
+                args = (project_id, since or 0)
+                folders = await conn.fetch(SelectQueries.sync_folders, args)
+                tasks = await conn.fetch(SelectQueries.sync_tasks, args)
+                if since is not None:
+                    for kind, pub_id in await conn.fetch(
+                            SelectQueries.sync_tombstones, args):
+                        deleted[kind + 's'].append(pub_id)
+        self.write({
+            'folders': folders,
+            'tasks': tasks,
+            'deleted': deleted,
+            'next': self.encode_cursor(next_xid)
+        })
@@ -12,107 +12,189 @@ from ...sql.update import UpdateQueries
 
 
 class ApiTaskFolderHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id, folder_pub_id):
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.tasks_by_folder,
-                    (self.current_user['project_id'],
-                     self.current_user['folder_id'])
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        self.write({'tasks': [dict(zip(desc, item)) for item in _res]})
+        """ Return a page of tasks in a folder or all of them as a stream """
+        after, limit = self.get_page_args()
+        if self.is_stream():
+            await self.write_stream(
+                SelectQueries.tasks_by_folder,
+                (self.current_user['project_id'],
+                 self.current_user['folder_id'], after, None)
+            )
+            return
+        _res = await self.db_pool.fetch(
+            SelectQueries.tasks_by_folder,
+            (self.current_user['project_id'], self.current_user['folder_id'],
+             after, limit + 1)
+        )
+        self.write_page('tasks', _res, limit)
 
     async def post(self, project_pub_id, folder_pub_id):
-        title = self.get_argument('title')
-        dates = []
+        args = {
+            'title': self.get_argument('title'),
+            'description': self.get_argument('description', None),
+            'user_id': self.current_user['user_id'],
+            'project_id': self.current_user['project_id'],
+            'folder_id': self.current_user['folder_id']
+        }
         for arg in ('datetime_from', 'datetime_due'):
             val = self.get_argument(arg, None)
-            if val is None:
-                dates.append(val)
-                continue
-            # Timestamp validity check
-            _datetime_val = self.datetime_from_timestamp(val)
-            if _datetime_val is None:
-                raise tornado.web.HTTPError(400, 'invalid timestamp')
-            dates.append(_datetime_val)
-        args = (
-            title,
-            self.get_argument('description', None),
-            *dates,
-            self.current_user['user_id'],
-            self.current_user['project_id'],
-            self.current_user['folder_id']
-        )
-        seq_pt = Identifier(
-            'project_task_{}_seq'.format(self.current_user['project_id'])
-        )
-        query = SQL(InsertQueries.add_task).format(seq=seq_pt)
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, args)
-                task_pub_id = (await cur.fetchall())[0][1]
+            if val is not None:
+                # Timestamp validity check
+                val = self.datetime_from_timestamp(val)
+                if val is None:
+                    raise tornado.web.HTTPError(400, 'invalid timestamp')
+            args[arg] = val
+        task_pub_id = (
+            await self.db_pool.fetch(InsertQueries.add_task, args)
+        )[0][1]
         self.write({'id': task_pub_id})
 
 
+class ApiTaskFolderBulkHandler(ApiHandler):
+    _task_keys = ('title', 'description', 'datetime_from', 'datetime_due')
+
+    async def post(self, project_pub_id, folder_pub_id):
+        """ Create tasks from a JSON array of objects with the same keys
+        as arguments of a single task creation. All tasks are validated
+        before any of them is created and created in one statement
+        :return: ids of created tasks in order of the array
+        """
+        tasks = self.get_json_body()
+        if not isinstance(tasks, list) or not tasks:
+            raise tornado.web.HTTPError(400, 'array of tasks expected')
+        if len(tasks) > self.application.tasks_bulk_max:
+            raise tornado.web.HTTPError(413, 'too many tasks')
+        args = {k: [] for k in self._task_keys}
+        for task in tasks:
+            if not isinstance(task, dict) or \
+                    not isinstance(task.get('title'), str):
+                raise tornado.web.HTTPError(400, 'invalid task')
+            description = task.get('description')
+            if description is not None and not isinstance(description, str):
+                raise tornado.web.HTTPError(400, 'invalid task')
+            args['title'].append(task['title'])
+            args['description'].append(description)
+            for arg in ('datetime_from', 'datetime_due'):
+                val = task.get(arg)
+                if val is not None:
+                    # Timestamp validity check
+                    val = self.datetime_from_timestamp(val)
+                    if val is None:
+                        raise tornado.web.HTTPError(400, 'invalid timestamp')
+                args[arg].append(val)
+        args.update({
+            'count': len(tasks),
+            'user_id': self.current_user['user_id'],
+            'project_id': self.current_user['project_id'],
+            'folder_id': self.current_user['folder_id']
+        })
+        # Composed queries aren't executed as prepared statements by aiopg,
+        # arrays of NULLs sent by psycopg2 are TEXT[] and can't be passed
+        # to the prepared statement
+        _res = await self.db_pool.fetch(SQL(InsertQueries.add_tasks), args)
+        # Ids are allocated in order of the array
+        self.write({'ids': sorted(item[0] for item in _res)})
+
+
+class ApiTaskProjectBulkHandler(ApiHandler):
+    async def put(self, project_pub_id):
+        """ Update or move tasks of a project with a single statement.
+        JSON body:
+            * ids - list of task ids
+            * patch - optional, new values of task fields, see
+                `ApiHandler.get_task_patch`
+            * folder_id - optional, id of a folder to move tasks to
+        :return: ids of updated tasks, tasks which don't exist are skipped,
+            404 if the folder doesn't exist
+        """
+        data = self.get_json_body()
+        if not isinstance(data, dict):
+            raise tornado.web.HTTPError(400, 'object expected')
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not ids or \
+                not all(isinstance(i, int) for i in ids):
+            raise tornado.web.HTTPError(400, 'invalid ids')
+        if len(ids) > self.application.tasks_bulk_max:
+            raise tornado.web.HTTPError(413, 'too many tasks')
+        patch = data.get('patch', {})
+        if not isinstance(patch, dict):
+            raise tornado.web.HTTPError(400, 'invalid patch')
+        args = self.get_task_patch(patch)
+        sets = [
+            SQL('{} = {}').format(Identifier(k), Placeholder(k)) for k in args
+        ]
+        query = UpdateQueries.tasks
+        if data.get('folder_id') is not None:
+            if not isinstance(data['folder_id'], int):
+                raise tornado.web.HTTPError(400, 'invalid folder_id')
+            # The folder is joined by the update query
+            sets.append(SQL('folder_id = f.folder_id'))
+            query = UpdateQueries.tasks_move
+            args['folder_pub_id'] = data['folder_id']
+        if not sets:
+            raise tornado.web.HTTPError(400)
+        query = SQL(query).format(SQL(', ').join(sets))
+        args['ids'] = ids
+        args['project_id'] = self.current_user['project_id']
+        _res = await self.db_pool.fetch(query, args)
+        if not _res and 'folder_pub_id' in args:
+            raise tornado.web.HTTPError(404)
+        self.write({'ids': sorted(
+            item[0] for item in _res if item[0] is not None
+        )})
+
+
 class ApiTaskProjectHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id):
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.tasks_by_project,
-                    (self.current_user['project_id'],)
-                )
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        self.write({'tasks': [dict(zip(desc, item)) for item in _res]})
+        """ Return a page of tasks in a project or all of them as a stream """
+        after, limit = self.get_page_args()
+        if self.is_stream():
+            await self.write_stream(
+                SelectQueries.tasks_by_project,
+                (self.current_user['project_id'], after, None)
+            )
+            return
+        _res = await self.db_pool.fetch(
+            SelectQueries.tasks_by_project,
+            (self.current_user['project_id'], after, limit + 1)
+        )
+        self.write_page('tasks', _res, limit)
 
 
 class ApiTaskHandler(ApiHandler):
+    _etag = True
+
     async def get(self, project_pub_id, folder_pub_id, task_pub_id):
         """ Get task by id """
         args = [
             self.current_user[k] for k in ('project_id', 'folder_id', 'task_id')
         ]
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(SelectQueries.task, args)
-                _res = await cur.fetchall()
-                desc = [item.name for item in cur.description]
-        self.write(dict(zip(desc, _res[0])))
+        _res = await self.fetch_row(SelectQueries.task, args)
+        self.write_row(_res)
 
     async def delete(self, project_pub_id, folder_pub_id, task_pub_id):
         """ Delete a task by id """
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    DeleteQueries.task, (self.current_user['task_id'],)
-                )
+        await self.db_pool.execute(
+            DeleteQueries.task, (self.current_user['task_id'],)
+        )
 
     async def put(self, project_pub_id, folder_pub_id, task_pub_id):
         """ Update a task by id """
-        args = {}
+        values = {}
         for arg in ('title', 'description', 'datetime_from', 'datetime_due'):
             val = self.get_argument(arg, None)
-            if val is None:
-                continue
-            if val == '' and arg != 'title':
-                args[arg] = None
-            # Timestamp validity check
-            elif arg in ('datetime_from', 'datetime_due'):
-                _datetime_val = self.datetime_from_timestamp(val)
-                if _datetime_val is None:
-                    raise tornado.web.HTTPError(400, 'invalid timestamp')
-                args[arg] = _datetime_val
-            else:
-                args[arg] = val
+            if val is not None:
+                values[arg] = val
+        args = self.get_task_patch(values)
         if not args:
             raise tornado.web.HTTPError(400)
         query = SQL(UpdateQueries.task).format(SQL(', ').join(
             [SQL('{} = {}').format(Identifier(k), Placeholder(k)) for k in args]
         ))
         args['task_id'] = self.current_user['task_id']
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, args)
+        await self.db_pool.execute(query, args)
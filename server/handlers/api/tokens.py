@@ -5,9 +5,7 @@ from psycopg2.sql import SQL, Identifier
 import tornado.web
 
 from .base import BaseApiHandler
-from ...sql.delete import DeleteQueries
 from ...sql.insert import InsertQueries
-from ...sql.select import SelectQueries
 
 
 class BaseTokensHandler(BaseApiHandler):
@@ -15,8 +13,8 @@ class BaseTokensHandler(BaseApiHandler):
     def token_expires_time(self):
         return self.application.token_expires_time
 
-    async def generate_tokens(self, username):
-        """ Generate three new tokens for a user with given username:
+    async def new_tokens(self):
+        """ Generate three new tokens:
             * select_token used in select queries in db.
             * verify_token used for verification of select and renew tokens.
                 verify_token isn't stored directly in db. Instead of that
@@ -27,30 +25,42 @@ class BaseTokensHandler(BaseApiHandler):
                 used for hashing and the app always hashes the content of
                 the verify_token argument of post request.
             * renew_token used for one-time issuing new three tokens.
-        :return: a dict with tokens
+        :return: a dict with tokens, hash of verify_token, id of the key
+        :rtype: tuple
         """
-        token_select = uuid4().hex
-        token_verify = uuid4().hex
-        token_renew = uuid4().hex
+        tokens = {
+            'token_select': uuid4().hex,
+            'token_verify': uuid4().hex,
+            'token_renew': uuid4().hex
+        }
         # verify_token stored as a hash instead of plain-text
-        token_verify_hash = await self.hash_token(token_verify, self.mac_key)
-        # Formatted query has expression like
-        # `CURRENT_TIMESTAMP + '7200s'::INTERVAL`
-        # where 7200 is `TOKEN_EXPIRES_TIME` defined in `conf.py`
-        query = SQL(InsertQueries.tokens).format(
+        # along with id of the key used for hashing
+        key_id, mac_key = self.keyring.current()
+        token_verify_hash = await self.hash_token(
+            tokens['token_verify'], mac_key
+        )
+        return tokens, token_verify_hash, key_id
+
+    def tokens_query(self, query):
+        """ Format a query inserting tokens, it has expression like
+        `CURRENT_TIMESTAMP + '7200s'::INTERVAL`
+        where 7200 is `TOKEN_EXPIRES_TIME` defined in `conf.py`
+        """
+        return SQL(query).format(
             Identifier('{}s'.format(self.token_expires_time))
         )
-        args = (token_select, token_verify_hash, token_renew, username)
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, args)
-                _res = await cur.fetchall()
-        tokens = {
-            'token_select': token_select,
-            'token_verify': token_verify,
-            'token_renew': token_renew,
-            'expires_in': _res[0][0]
-        }
+
+    async def generate_tokens(self, username):
+        """ Generate new tokens for a user with given username
+        :return: a dict with tokens
+        """
+        tokens, token_verify_hash, key_id = await self.new_tokens()
+        args = (tokens['token_select'], token_verify_hash, key_id,
+                tokens['token_renew'], username)
+        _res = await self.db_pool.fetch(
+            self.tokens_query(InsertQueries.tokens), args
+        )
+        tokens['expires_in'] = _res[0][0]
         return tokens
 
 
@@ -79,28 +89,30 @@ class ApiTokensRenewHandler(BaseTokensHandler):
         except tornado.web.MissingArgumentError:
             raise tornado.web.HTTPError(403, 'invalid tokens')
 
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    SelectQueries.token_renew,
-                    (token_select, token_renew)
-                )
-                _res = await cur.fetchall()
-
+        # The stored hash is compared by the query with hashes by every
+        # valid key. Hashes of guessed tokens are MACs unknown to a client,
+        # timing of the comparison doesn't help to find a valid token
+        key_ids = []
+        hashes = []
+        for key_id, mac_key in self.keyring.valid():
+            key_ids.append(key_id)
+            hashes.append(await self.hash_token(token_verify, mac_key))
+        tokens, token_verify_hash, key_id = await self.new_tokens()
+        # Used tokens are deleted and the new ones are inserted at once
+        _res = await self.db_pool.fetch(
+            self.tokens_query(InsertQueries.tokens_renew), {
+                'token_select': token_select,
+                'token_renew': token_renew,
+                'key_ids': key_ids,
+                'hashes': hashes,
+                'new_select': tokens['token_select'],
+                'new_verify': token_verify_hash,
+                'key_id': key_id,
+                'new_renew': tokens['token_renew']
+            }
+        )
         if not _res:
             raise tornado.web.HTTPError(403, 'invalid tokens')
-
-        username, token_verify_hashed, token_id = _res[0]
-        token_verify_hashed = token_verify_hashed.tobytes()
-        # Compare hashes
-        check = await self.check_token_verify(token_verify, token_verify_hashed)
-        if not check:
-            raise tornado.web.HTTPError(403, 'invalid tokens')
-
-        # Delete used tokens
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(DeleteQueries.delete_tokens, (token_id,))
-        # Generate new set
-        tokens = await self.generate_tokens(username)
+        self.token_cache.evict(token_select)
+        tokens['expires_in'] = _res[0][0]
         self.write(tokens)
@@ -1,13 +1,23 @@
 
-import nacl.exceptions
-import nacl.pwhash
+import asyncio
+import time
 
+import tornado.iostream
+from tornado.log import app_log
 import tornado.web
 
+from ..compression import COMPRESSORS, negotiate
+from ..pwhash import Saturated
 from ..sql.select import SelectQueries
+from ..sql.update import UpdateQueries
 
 
 class BaseHandler(tornado.web.RequestHandler):
+    # Content encoding of the response, False - not negotiated yet
+    _content_encoding = False
+    # Seconds sent in Retry-After of an error response
+    _retry_after = None
+
     @property
     def loop(self):
         return self.application.loop
@@ -20,8 +30,164 @@ class BaseHandler(tornado.web.RequestHandler):
     def db_pool(self):
         return self.application.db_pool
 
+    def write_error(self, status_code, **kwargs):
+        if self._retry_after is not None:
+            self.set_header('Retry-After', self._retry_after)
+        super().write_error(status_code, **kwargs)
+
+    def on_finish(self):
+        self.application.metrics.observe_request(
+            type(self).__name__, self.request.method, self.get_status(),
+            self.request.request_time()
+        )
+
+    async def run_in_executor(self, func, *args):
+        """ Run a function in the thread pool executor, its queue wait and
+        latency are observed by metrics
+        :param func: function to call
+        :param args: positional arguments for the function
+        :return: result of the function
+        """
+        started = []
+
+        def call():
+            started.append(time.perf_counter())
+            return func(*args)
+
+        submitted = time.perf_counter()
+        try:
+            return await self.loop.run_in_executor(self.pool_executor, call)
+        finally:
+            if started:
+                self.application.metrics.observe_executor(
+                    started[0] - submitted, time.perf_counter() - submitted
+                )
+
+    async def run_crypto(self, func, *args, expensive=False):
+        """ Run a crypto function according to the dispatch policy.
+        Cheap functions are called right on the event loop because handing
+        them off to the executor costs more than the work itself, unless
+        `CRYPTO_DISPATCH` is 'executor'. Expensive ones always run in
+        the executor
+        :param func: function to call
+        :param args: positional arguments for the function
+        :param expensive: True if the function may block the loop for long
+        :type expensive: bool
+        :return: result of the function
+        """
+        if expensive or self.application.crypto_dispatch == 'executor':
+            return await self.run_in_executor(func, *args)
+        return func(*args)
+
+    def get_content_encoding(self):
+        """ Get the content encoding negotiated with a client
+        :return: encoding or None if the response isn't compressed
+        :rtype: str
+        """
+        if self._content_encoding is False:
+            encodings = self.application.compress_encodings
+            self._content_encoding = None
+            if encodings:
+                # Responses differ by Accept-Encoding for caches
+                self.add_header('Vary', 'Accept-Encoding')
+                self._content_encoding = negotiate(
+                    self.request.headers.get('Accept-Encoding'), encodings
+                )
+        return self._content_encoding
+
+    def get_compressor(self):
+        """ Get a streaming compressor of the negotiated encoding and
+        set `Content-Encoding`
+        :rtype: server.compression.Compressor or None
+        """
+        encoding = self.get_content_encoding()
+        if encoding is None:
+            return None
+        self.set_header('Content-Encoding', encoding)
+        return COMPRESSORS[encoding](
+            self.application.compress_levels[encoding]
+        )
+
+    async def compress(self, compressor, data, final=False):
+        """ Compress a chunk, big chunks are compressed in the executor
+        so they don't block the loop
+        """
+        if len(data) < self.application.compress_executor_size:
+            return compressor.compress(data, final)
+        return await self.run_in_executor(compressor.compress, data, final)
+
+    def finish(self, chunk=None):
+        """ Compress the body if a client accepts it and it isn't too small.
+        A big body is compressed in the executor and the response
+        is finished after it
+        """
+        if chunk is not None:
+            self.write(chunk)
+        if not self._headers_written:
+            self._check_etag()
+        if self._headers_written or 'Content-Encoding' in self._headers or \
+                self.get_content_encoding() is None or \
+                sum(len(part) for part in self._write_buffer) < \
+                self.application.compress_min_size:
+            return super().finish()
+        data = b''.join(self._write_buffer)
+        compressor = self.get_compressor()
+        if len(data) < self.application.compress_executor_size:
+            self._write_buffer = [compressor.compress(data, final=True)]
+            return super().finish()
+        return asyncio.ensure_future(self._finish_compressed(compressor, data))
+
+    def compute_etag(self):
+        """ Hash of the body with the negotiated encoding """
+        etag = super().compute_etag()
+        if etag is None:
+            return None
+        return self.format_etag(etag.strip('"'))
+
+    def format_etag(self, value):
+        """ Quote ETag value, representations in different encodings
+        have different ETags
+        :rtype: str
+        """
+        encoding = self.get_content_encoding()
+        if encoding is not None:
+            value += '-' + encoding
+        return '"{}"'.format(value)
+
+    def _check_etag(self):
+        """ Set ETag of the body and replace the response with 304 if it
+        matches `If-None-Match`, as `finish()` of tornado does, so a body
+        isn't compressed just to be dropped
+        """
+        if self._status_code == 200 and \
+                self.request.method in ('GET', 'HEAD') and \
+                'Etag' not in self._headers:
+            self.set_etag_header()
+            if self.check_etag_header():
+                self._write_buffer = []
+                self.set_status(304)
+
+    async def _finish_compressed(self, compressor, data):
+        # Nothing awaits the future, the response is finished here anyway
+        try:
+            self._write_buffer = [await self.compress(compressor, data, True)]
+        except Exception:
+            app_log.error('Failed to compress response of %s %s',
+                          self.request.method, self.request.uri,
+                          exc_info=True)
+            self._write_buffer = []
+            finish = self.send_error
+        else:
+            finish = super().finish
+        try:
+            finish()
+        except tornado.iostream.StreamClosedError:
+            # The client has gone while the body was compressed
+            pass
+
     async def check_user(self, username, password):
-        """ Check given username and password
+        """ Check given username and password. A hash made with other
+        parameters than the current ones is replaced with a new one
         :param username: username
         :type username: str
         :param password: user's password
@@ -30,16 +196,17 @@ class BaseHandler(tornado.web.RequestHandler):
             otherwise - False
         :rtype: bool
         """
-        async with self.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(SelectQueries.password_auth, (username,))
-                _res = await cur.fetchall()
+        _res = await self.db_pool.fetch(
+            SelectQueries.password_auth, (username,)
+        )
         check = False
         if _res:
-            check = await self.check_password_hash(
-                _res[0][0].tobytes(),
-                tornado.escape.utf8(password)
-            )
+            # memoryview with aiopg, bytes with asyncpg
+            hashed = bytes(_res[0][0])
+            password = tornado.escape.utf8(password)
+            check = await self.check_password_hash(hashed, password)
+            if check and self.application.pwhash.needs_rehash(hashed):
+                await self.rehash_password(username, password)
         return check
 
     async def check_password_hash(self, hashed, password):
@@ -49,13 +216,24 @@ class BaseHandler(tornado.web.RequestHandler):
         :param password: a password entered by a user
         :type password: bytes
         :return: False if the password is wrong, otherwise - True
+        :raises tornado.web.HTTPError: 503 if the pwhash pool is saturated
+        """
+        try:
+            return await self.application.pwhash.verify(hashed, password)
+        except Saturated:
+            self._retry_after = self.application.pwhash_retry_after
+            raise tornado.web.HTTPError(503, 'password hashing is saturated')
+
+    async def rehash_password(self, username, password):
+        """ Store a hash of a password made with the current parameters.
+        It's skipped if the pwhash pool is saturated, the next login
+        does it
+        :type username: str
+        :type password: bytes
         """
         try:
-            return await self.loop.run_in_executor(
-                self.pool_executor,
-                nacl.pwhash.verify,
-                hashed,
-                password
-            )
-        except nacl.exceptions.InvalidkeyError:
-            return False
+            hashed = await self.application.pwhash.hash(password)
+        except Saturated:
+            app_log.info('Rehash of password of %s is postponed', username)
+            return
+        await self.db_pool.execute(UpdateQueries.password, (hashed, username))
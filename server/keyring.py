@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from uuid import uuid4
+
+import nacl.encoding
+import nacl.utils
+
+
+class Keyring:
+    """ MAC keys for token hashing and the cookie secret kept in a file
+    shared by all server processes and nodes, so tokens survive restarts
+    and are valid in any process.
+
+    Tokens store the id of the key used for hashing their verify token.
+    After rotation the previous key is retired but still accepted for
+    `grace_period` seconds, then it is removed from the keyring.
+
+    File format:
+    {
+        "cookie_secret": "<hex>",
+        "keys": [
+            {"id": "<hex>", "key": "<hex>", "created": <ts>, "retired": <ts>}
+        ]
+    }
+    The last key in the list is the current one, its "retired" is null.
+    """
+
+    key_size = 64
+    # Min seconds between reloads on a miss, any client can send a token
+    # with an unknown key id
+    miss_reload_interval = 1
+
+    def __init__(self, path, grace_period):
+        """
+        :param path: path to the keyring file
+        :type path: str
+        :param grace_period: seconds retired keys remain valid
+        :type grace_period: int
+        """
+        self.path = path
+        self.grace_period = grace_period
+        self.cookie_secret = None
+        self._keys = []
+        self._mtime = None
+        self._miss_reloaded = None
+
+    @classmethod
+    def load(cls, path, grace_period):
+        """ Load the keyring, create a new one if the file doesn't exist """
+        keyring = cls(path, grace_period)
+        if not keyring.reload():
+            keyring.create()
+        return keyring
+
+    @classmethod
+    def _new_key(cls):
+        return {
+            'id': uuid4().hex[:8],
+            'key': nacl.utils.random(size=cls.key_size).hex(),
+            'created': int(time.time()),
+            'retired': None
+        }
+
+    def create(self):
+        """ Create a keyring file with a new key and cookie secret.
+        If another process has created the file first, load it instead
+        """
+        data = {
+            'cookie_secret': nacl.utils.random(size=self.key_size).hex(),
+            'keys': [self._new_key()]
+        }
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            self.reload()
+            return
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        self.reload()
+
+    def reload(self):
+        """ Read the keyring file if it has changed since the last read
+        :return: False if the file doesn't exist, otherwise - True
+        :rtype: bool
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return True
+        with open(self.path) as f:
+            data = json.load(f)
+        self.cookie_secret = bytes.fromhex(data['cookie_secret'])
+        self._keys = data['keys']
+        self._mtime = mtime
+        return True
+
+    def save(self):
+        data = {'cookie_secret': self.cookie_secret.hex(), 'keys': self._keys}
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        # Atomic replace, running servers never read a partial file
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def current(self):
+        """ Get the key used for hashing new tokens
+        :return: key id, key
+        :rtype: tuple
+        """
+        key = self._keys[-1]
+        return key['id'], bytes.fromhex(key['key'])
+
+    def get(self, key_id):
+        """ Get a key by id
+        :param key_id: key id stored with a token
+        :type key_id: str
+        :return: key or None if the key doesn't exist or its grace period
+            has passed
+        :rtype: bytes
+        """
+        key = self._find(key_id)
+        if key is None and self._reload_on_miss():
+            key = self._find(key_id)
+        if key is None or key['retired'] is not None and \
+                key['retired'] + self.grace_period < time.time():
+            return None
+        return bytes.fromhex(key['key'])
+
+    def _reload_on_miss(self):
+        """ Reload the file changed by a rotation in another process
+        before the periodic reload, at most once per `miss_reload_interval`
+        :return: True if the file has been checked
+        :rtype: bool
+        """
+        now = time.monotonic()
+        if self._miss_reloaded is not None and \
+                now - self._miss_reloaded < self.miss_reload_interval:
+            return False
+        self._miss_reloaded = now
+        self.reload()
+        return True
+
+    def _find(self, key_id):
+        for key in reversed(self._keys):
+            if key['id'] == key_id:
+                return key
+        return None
+
+    def valid(self):
+        """ Get keys which tokens are valid. The key of a token isn't
+        known in advance, so the file is reloaded first as on a miss
+        :return: list of (key id, key)
+        :rtype: list
+        """
+        self._reload_on_miss()
+        now = time.time()
+        return [
+            (key['id'], bytes.fromhex(key['key'])) for key in self._keys
+            if key['retired'] is None or key['retired'] + self.grace_period >= now
+        ]
+
+    def rotate(self):
+        """ Retire the current key, add a new one and remove keys which
+        grace period has passed
+        :return: id of the new key
+        :rtype: str
+        """
+        now = int(time.time())
+        self._keys = [
+            key for key in self._keys
+            if key['retired'] is None or key['retired'] + self.grace_period > now
+        ]
+        for key in self._keys:
+            if key['retired'] is None:
+                key['retired'] = now
+        key = self._new_key()
+        self._keys.append(key)
+        self.save()
+        return key['id']
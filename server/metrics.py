@@ -0,0 +1,230 @@
+from bisect import bisect_left
+
+# Upper bounds of histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """ Histogram of observed values. Observations are made on the event
+    loop only, so there is no locking
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: upper bounds of buckets in ascending order
+        :type buckets: tuple
+        """
+        self.buckets = buckets
+        # The last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Get cumulative counts of buckets
+        :return: list of (upper bound, count), the last bound is '+Inf'
+        :rtype: list
+        """
+        res = []
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(val).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for name, val in labels.items()
+    ) + '}'
+
+
+class Exposition:
+    """ Metrics in the Prometheus text format """
+
+    def __init__(self, prefix='tasker_'):
+        self.prefix = prefix
+        self._lines = []
+
+    def add(self, name, kind, doc, samples):
+        """ Add a metric
+        :param name: name of the metric without the prefix
+        :type name: str
+        :param kind: 'counter', 'gauge' or 'histogram'
+        :type kind: str
+        :param doc: description of the metric
+        :type doc: str
+        :param samples: list of (labels dict, value), values of
+            histograms are `Histogram`
+        :type samples: list
+        """
+        name = self.prefix + name
+        self._lines.append('# HELP {} {}'.format(name, doc))
+        self._lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            if kind != 'histogram':
+                self._lines.append('{}{} {}'.format(
+                    name, _labels(labels), value
+                ))
+                continue
+            for bound, count in value.cumulative():
+                self._lines.append('{}_bucket{} {}'.format(
+                    name, _labels(dict(labels, le=bound)), count
+                ))
+            self._lines.append('{}_sum{} {}'.format(
+                name, _labels(labels), value.sum
+            ))
+            self._lines.append('{}_count{} {}'.format(
+                name, _labels(labels), value.count
+            ))
+
+    def render(self):
+        return '\n'.join(self._lines) + '\n'
+
+
+class Metrics:
+    """ Metrics of requests and the thread pool executor of a server
+    process. Handlers and the executor observe them on the event loop,
+    the rest (db pools, caches, reapers) is collected on a scrape
+    """
+
+    def __init__(self):
+        # Latency by (route, method)
+        self.requests = {}
+        # Number of responses by (route, method, status)
+        self.responses = {}
+        # Time tasks wait in the executor queue and their total latency
+        self.executor_wait = Histogram()
+        self.executor_latency = Histogram()
+
+    def observe_request(self, route, method, status, duration):
+        """
+        :param route: name of the handler class
+        :type route: str
+        :param method: HTTP method
+        :type method: str
+        :param status: response status
+        :type status: int
+        :param duration: seconds from the start of the request
+        :type duration: float
+        """
+        key = (route, method)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram()
+        histogram.observe(duration)
+        key = (route, method, status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_executor(self, wait, latency):
+        """
+        :param wait: seconds a task waited for a worker thread
+        :type wait: float
+        :param latency: seconds from submission to the result
+        :type latency: float
+        """
+        self.executor_wait.observe(wait)
+        self.executor_latency.observe(latency)
+
+    def expose(self, app):
+        """ Render metrics of the process
+        :param app: the server application
+        :type app: server.app.ServerApp
+        :return: metrics in the Prometheus text format
+        :rtype: str
+        """
+        res = Exposition()
+        res.add('request_duration_seconds', 'histogram',
+                'Request latency by route and method', [
+                    ({'route': route, 'method': method}, histogram)
+                    for (route, method), histogram in self.requests.items()
+                ])
+        res.add('responses_total', 'counter',
+                'Responses by route, method and status', [
+                    ({'route': route, 'method': method, 'status': status},
+                     count)
+                    for (route, method, status), count
+                    in self.responses.items()
+                ])
+
+        pools = [('primary', app.db_pool)] + [
+            ('replica{}'.format(i), db_pool)
+            for i, db_pool in enumerate(app.replicas.db_pools)
+        ]
+        stats = [({'pool': name}, db_pool.stats()) for name, db_pool in pools]
+        for key, kind, doc in (
+                ('size', 'gauge', 'Open connections'),
+                ('in_use', 'gauge', 'Connections in use'),
+                ('max_size', 'gauge', 'Max number of connections')):
+            res.add('db_pool_' + key, kind, doc, [
+                (labels, item[key]) for labels, item in stats
+            ])
+        res.add('db_pool_acquire_seconds', 'histogram',
+                'Time waited for a connection', [
+                    ({'pool': name}, db_pool.acquire_wait)
+                    for name, db_pool in pools
+                ])
+        res.add('db_query_duration_seconds', 'histogram',
+                'Query latency by pool and query name', [
+                    ({'pool': name, 'query': query}, histogram)
+                    for name, db_pool in pools
+                    for query, histogram in db_pool.queries.items()
+                ])
+
+        # The queue is internal to ThreadPoolExecutor, qsize is thread-safe
+        res.add('executor_queue_depth', 'gauge',
+                'Tasks waiting for a worker thread',
+                [({}, app.pool_executor._work_queue.qsize())])
+        res.add('executor_wait_seconds', 'histogram',
+                'Time tasks waited for a worker thread',
+                [({}, self.executor_wait)])
+        res.add('executor_latency_seconds', 'histogram',
+                'Time from submission of tasks to their results',
+                [({}, self.executor_latency)])
+
+        pwhash = app.pwhash.stats()
+        res.add('pwhash_pending', 'gauge',
+                'Passwords being hashed and waiting for a process',
+                [({}, pwhash['pending'])])
+        res.add('pwhash_rejected_total', 'counter',
+                'Logins rejected by the saturated pwhash pool',
+                [({}, pwhash['rejected'])])
+
+        cache = app.token_cache.stats()
+        res.add('token_cache_size', 'gauge', 'Cached tokens',
+                [({}, cache['size'])])
+        res.add('token_cache_hits_total', 'counter', 'Token cache hits',
+                [({}, cache['hits'])])
+        res.add('token_cache_misses_total', 'counter', 'Token cache misses',
+                [({}, cache['misses'])])
+
+        reapers = [({'reaper': 'tokens'}, app.tokens_reaper.stats()),
+                   ({'reaper': 'tombstones'}, app.tombstones_reaper.stats())]
+        res.add('reaper_runs_total', 'counter', 'Purge runs', [
+            (labels, item['runs']) for labels, item in reapers
+        ])
+        res.add('reaper_rows_total', 'counter', 'Purged rows', [
+            (labels, item['rows_reclaimed']) for labels, item in reapers
+        ])
+
+        replicas = app.replicas.stats()
+        res.add('replicas_healthy', 'gauge', 'Replicas in the rotation',
+                [({}, replicas['healthy'])])
+        res.add('replica_lag_seconds', 'gauge', 'Replication lag', [
+            ({'pool': 'replica{}'.format(i)}, lag)
+            for i, lag in replicas['lags'].items() if lag is not None
+        ])
+        return res.render()
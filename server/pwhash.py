@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import re
+
+import nacl.exceptions
+import nacl.pwhash
+
+# Parameters of an Argon2 hash string
+_params = re.compile(rb'^\$(argon2id?)\$v=\d+\$m=(\d+),t=(\d+),p=\d+\$')
+
+
+class Saturated(Exception):
+    """ Too many passwords are waiting to be hashed """
+
+
+def hash_password(password, opslimit, memlimit):
+    """ Hash a password with Argon2id
+    :type password: bytes
+    :param opslimit: number of passes
+    :type opslimit: int
+    :param memlimit: memory in bytes
+    :type memlimit: int
+    :rtype: bytes
+    """
+    return nacl.pwhash.argon2id.str(password, opslimit, memlimit)
+
+
+def verify_password(hashed, password):
+    """
+    :return: False if the password doesn't match the hash
+    :rtype: bool
+    """
+    try:
+        return nacl.pwhash.verify(hashed, password)
+    except nacl.exceptions.InvalidkeyError:
+        return False
+
+
+class PasswordHasher:
+    """ Hashing and verification of passwords in a dedicated pool of
+    processes, so memory-hard hashes don't occupy the thread pool shared by
+    the rest of requests. The number of waiting passwords is bounded,
+    over the limit calls fail right away with `Saturated`.
+    The pool is started on the first call, after server processes are forked
+    """
+
+    def __init__(self, processes, queue_size, opslimit, memlimit):
+        """
+        :param processes: number of processes
+        :type processes: int
+        :param queue_size: max number of passwords waiting for a process
+        :type queue_size: int
+        :param opslimit: Argon2 number of passes
+        :type opslimit: int
+        :param memlimit: Argon2 memory in bytes
+        :type memlimit: int
+        """
+        self.processes = processes
+        # Passwords being hashed and waiting for a process
+        self.max_pending = processes + queue_size
+        self.opslimit = opslimit
+        self.memlimit = memlimit
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated
+        if self._executor is None:
+            # Forking a process with threads (the thread pool, db drivers)
+            # isn't safe, workers are forked from a clean server process
+            self._executor = ProcessPoolExecutor(
+                self.processes, multiprocessing.get_context('forkserver')
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        """ Hash a password with the current parameters
+        :type password: bytes
+        :rtype: bytes
+        """
+        return await self._run(
+            hash_password, password, self.opslimit, self.memlimit
+        )
+
+    async def verify(self, hashed, password):
+        """ Check a password against its hash
+        :type hashed: bytes
+        :type password: bytes
+        :rtype: bool
+        """
+        return await self._run(verify_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """ Check if a hash was made with other parameters
+        :type hashed: bytes
+        :rtype: bool
+        """
+        match = _params.match(hashed)
+        if match is None:
+            return True
+        alg, memory, passes = match.groups()
+        # Memory is in KiB
+        return alg != b'argon2id' or int(passes) != self.opslimit or \
+            int(memory) != self.memlimit // 1024
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'rejected': self.rejected
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
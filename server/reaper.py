@@ -0,0 +1,125 @@
+import time
+
+import tornado.ioloop
+from tornado.log import app_log
+
+from .sql.delete import DeleteQueries
+
+
+class Reaper:
+    """ Periodically delete expired rows. Rows are deleted in batches,
+    every batch is a separate short transaction, so the purge doesn't hold
+    locks for long. Several server processes can run the purge at the
+    same time, locked rows are skipped.
+    Subclasses implement `_purge_batch`
+    """
+    # What is purged, for the log
+    _rows = 'rows'
+
+    def __init__(self, db_pool, interval, batch_size):
+        """
+        :param db_pool: database pool
+        :param interval: seconds between purges, 0 disables purging
+        :type interval: int
+        :param batch_size: max number of rows deleted by one statement
+        :type batch_size: int
+        """
+        self.db_pool = db_pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.rows_reclaimed = 0
+        self.last_run_rows = 0
+        self.last_run_duration = 0.0
+        self._running = False
+        self._periodic_callback = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        self._periodic_callback = tornado.ioloop.PeriodicCallback(
+            self._spawn, self.interval * 1000
+        )
+        self._periodic_callback.start()
+
+    def stop(self):
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+
+    def _spawn(self):
+        # Skip the run if the previous one hasn't finished yet
+        if not self._running:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.purge)
+
+    async def _purge_batch(self):
+        """ Delete a batch of expired rows
+        :return: number of deleted rows
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    async def purge(self):
+        """ Delete all expired rows
+        :return: number of deleted rows
+        :rtype: int
+        """
+        self._running = True
+        start = time.monotonic()
+        deleted = 0
+        try:
+            while True:
+                rowcount = await self._purge_batch()
+                deleted += rowcount
+                if rowcount < self.batch_size:
+                    break
+        finally:
+            self._running = False
+            self.runs += 1
+            self.rows_reclaimed += deleted
+            self.last_run_rows = deleted
+            self.last_run_duration = time.monotonic() - start
+        if deleted:
+            app_log.info('Purged %d %s in %.3fs',
+                         deleted, self._rows, self.last_run_duration)
+        return deleted
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'rows_reclaimed': self.rows_reclaimed,
+            'last_run_rows': self.last_run_rows,
+            'last_run_duration': self.last_run_duration
+        }
+
+
+class TokensReaper(Reaper):
+    """ Periodically delete expired tokens """
+    _rows = 'expired tokens'
+
+    async def _purge_batch(self):
+        return await self.db_pool.execute(
+            DeleteQueries.expired_tokens, (self.batch_size,)
+        )
+
+
+class TombstonesReaper(Reaper):
+    """ Periodically delete tombstones of deleted tasks and folders older
+    than the retention. Sync from a cursor older than purged tombstones
+    has to start over
+    """
+    _rows = 'tombstones'
+
+    def __init__(self, db_pool, interval, batch_size, retention):
+        """
+        :param retention: seconds tombstones are kept for
+        :type retention: int
+        """
+        super().__init__(db_pool, interval, batch_size)
+        self.retention = retention
+
+    async def _purge_batch(self):
+        _res = await self.db_pool.fetch(
+            DeleteQueries.expired_tombstones,
+            (self.retention, self.batch_size)
+        )
+        return _res[0][0]
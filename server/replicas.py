@@ -0,0 +1,137 @@
+from collections import OrderedDict
+import time
+
+import tornado.ioloop
+from tornado.log import app_log
+
+from .sql.select import SelectQueries
+
+
+class Replicas:
+    """ Read replicas used for GET requests. Replicas are checked
+    periodically, a replica which is down or lags behind the primary more
+    than `max_lag` seconds is dropped from the rotation until it catches up.
+    A replica which fails a request is dropped until the next check.
+
+    Tokens which have made a write read from the primary for `window`
+    seconds after it, so their users see their own changes.
+    The window is tracked per process.
+    """
+
+    def __init__(self, db_pools, max_lag, interval, window, size=10000):
+        """
+        :param db_pools: pools of replicas
+        :type db_pools: list
+        :param max_lag: max replication lag of a healthy replica in seconds
+        :type max_lag: int
+        :param interval: seconds between health checks
+        :type interval: int
+        :param window: seconds a token reads from the primary after a write
+        :type window: int
+        :param size: max number of tracked tokens
+        :type size: int
+        """
+        self.db_pools = db_pools
+        self.max_lag = max_lag
+        self.interval = interval
+        self.window = window
+        self.size = size
+        self.lags = {}
+        self.reads = 0
+        self.primary_reads = 0
+        self._healthy = list(db_pools)
+        self._next = 0
+        self._writes = OrderedDict()
+        self._running = False
+        self._periodic_callback = None
+
+    def __len__(self):
+        return len(self._healthy)
+
+    def start(self):
+        if not self.db_pools or self.interval <= 0:
+            return
+        self._periodic_callback = tornado.ioloop.PeriodicCallback(
+            self._spawn, self.interval * 1000
+        )
+        self._periodic_callback.start()
+        self._spawn()
+
+    def stop(self):
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+
+    def _spawn(self):
+        # Skip the check if the previous one hasn't finished yet
+        if not self._running:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.check)
+
+    async def check(self):
+        """ Check lag of every replica and update the rotation
+        :return: number of healthy replicas
+        :rtype: int
+        """
+        self._running = True
+        healthy = []
+        try:
+            for i, db_pool in enumerate(self.db_pools):
+                try:
+                    _res = await db_pool.fetch(SelectQueries.replica_lag)
+                    lag = _res[0][0]
+                except Exception:
+                    app_log.warning('Replica %d is down', i, exc_info=True)
+                    lag = None
+                self.lags[i] = lag
+                if lag is not None and lag <= self.max_lag:
+                    healthy.append(db_pool)
+                elif lag is not None:
+                    app_log.warning('Replica %d lags behind for %.1fs', i, lag)
+        finally:
+            self._running = False
+        self._healthy = healthy
+        return len(healthy)
+
+    def fail(self, db_pool):
+        """ Drop a replica from the rotation until the next check """
+        if db_pool in self._healthy:
+            self._healthy.remove(db_pool)
+            app_log.warning('Replica %d failed a request',
+                            self.db_pools.index(db_pool))
+
+    def mark_write(self, token_select):
+        """ Read from the primary with the token for `window` seconds """
+        if not self.db_pools or self.window <= 0:
+            return
+        self._writes[token_select] = time.monotonic() + self.window
+        self._writes.move_to_end(token_select)
+        while len(self._writes) > self.size:
+            self._writes.popitem(last=False)
+
+    def get(self, token_select):
+        """ Get a pool for reads with a token
+        :param token_select: select token of the request
+        :type token_select: str
+        :return: pool of a healthy replica or None if reads have to go to
+            the primary
+        """
+        if not self._healthy:
+            return None
+        self.reads += 1
+        deadline = self._writes.get(token_select)
+        if deadline is not None:
+            if deadline > time.monotonic():
+                self.primary_reads += 1
+                return None
+            del self._writes[token_select]
+        # Round robin over healthy replicas
+        self._next = (self._next + 1) % len(self._healthy)
+        return self._healthy[self._next]
+
+    def stats(self):
+        return {
+            'replicas': len(self.db_pools),
+            'healthy': len(self._healthy),
+            'lags': self.lags,
+            'reads': self.reads,
+            'primary_reads': self.primary_reads
+        }
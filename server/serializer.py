@@ -0,0 +1,121 @@
+import functools
+import json
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .db import Rows
+
+
+def _dumps(obj):
+    """ Encode an object to JSON
+    :rtype: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+# Encoders of values of the types selected by queries, values of other
+# types, e.g. json_agg lists, are encoded with `_dumps`
+_ENCODERS = {
+    str: encode_basestring,
+    int: int.__repr__,
+    float: float.__repr__,
+    bool: lambda val: 'true' if val else 'false',
+    type(None): lambda val: 'null'
+}
+
+
+def _encode_value(val):
+    return _dumps(val).decode()
+
+
+class RowShape:
+    """ Encoder of rows with the same columns to JSON objects.
+    With orjson rows are encoded as dicts: a dict per row is built in C,
+    encoding tuples directly (slots dataclasses, a template of keys filled
+    with values encoded one by one) calls Python code per row or value and
+    is slower, see `bench/bench_serialize.py`. Without orjson keys are
+    encoded once into a template and rows are formatted right from their
+    tuples without building dicts
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: names of the columns
+        :type columns: tuple
+        """
+        self.columns = columns
+        self._template = '{' + ','.join(
+            encode_basestring(name) + ':%s' for name in columns
+        ) + '}'
+
+    def _format(self, row):
+        get = _ENCODERS.get
+        return self._template % tuple(
+            [get(type(val), _encode_value)(val) for val in row]
+        )
+
+    def encode(self, row):
+        """ Encode a row to an object
+        :rtype: bytes
+        """
+        if orjson is not None:
+            return orjson.dumps(dict(zip(self.columns, row)))
+        return self._format(row).encode()
+
+    def encode_rows(self, rows):
+        """ Encode rows to an array of objects
+        :rtype: bytes
+        """
+        if orjson is not None:
+            columns = self.columns
+            return orjson.dumps([dict(zip(columns, row)) for row in rows])
+        return ('[' + ','.join([self._format(row) for row in rows])
+                + ']').encode()
+
+    def encode_lines(self, rows):
+        """ Encode rows to NDJSON, an object per line
+        :rtype: bytes
+        """
+        if orjson is not None:
+            columns = self.columns
+            dumps = orjson.dumps
+            newline = orjson.OPT_APPEND_NEWLINE
+            return b''.join(
+                [dumps(dict(zip(columns, row)), option=newline)
+                 for row in rows]
+            )
+        return ''.join([self._format(row) + '\n' for row in rows]).encode()
+
+
+@functools.lru_cache(maxsize=256)
+def row_shape(columns):
+    """ Get a shape of rows, shapes are cached by columns, every query
+    selects the same columns every time
+    :param columns: names of the columns
+    :type columns: tuple
+    :rtype: RowShape
+    """
+    return RowShape(columns)
+
+
+def dumps(obj):
+    """ Encode a response to JSON. `Rows` values of a dict are encoded
+    by their shapes, the rest with orjson if it's installed or json
+    :rtype: bytes
+    """
+    if isinstance(obj, dict) and \
+            any(isinstance(val, Rows) for val in obj.values()):
+        return b'{' + b','.join(
+            _dumps(key) + b':' + (
+                row_shape(tuple(val.columns)).encode_rows(val)
+                if isinstance(val, Rows) else _dumps(val)
+            )
+            for key, val in obj.items()
+        ) + b'}'
+    return _dumps(obj)
@@ -58,8 +58,6 @@ class CreateSequenceQueries(CreateQueries):
     # folder_id = 'CREATE SEQUENCE tasker.folder_id_seq'
     # task_id = 'CREATE SEQUENCE tasker.task_id_seq'
     # comment_id = 'CREATE SEQUENCE tasker.comment_id_seq'
-    # project_folder, project_task
-    _new_sequence = 'CREATE SEQUENCE tasker.{seq} as INT'
 
 
 class CreateTableQueries(CreateQueries):
@@ -88,6 +86,7 @@ CREATE TABLE IF NOT EXISTS tasker.tokens(
     token_id INT GENERATED ALWAYS AS IDENTITY,
     token_select TEXT,
     token_verify BYTEA,
+    key_id TEXT,
     token_renew TEXT,
     expires_in TIMESTAMP,
     user_id INT,
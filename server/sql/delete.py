@@ -1,7 +1,38 @@
 
 class DeleteQueries:
     delete_user = 'DELETE FROM tasker.users WHERE username = %s'
-    delete_tokens = 'DELETE FROM tasker.tokens WHERE token_id = %s'
     task = 'DELETE FROM tasker.tasks WHERE task_id = %s'
     project = 'DELETE FROM tasker.projects WHERE project_id = %s'
     folder = 'DELETE FROM tasker.folders WHERE folder_id = %s'
+    # Delete a batch of expired tokens, rows locked by a concurrent purge
+    # are skipped
+    expired_tokens = """
+DELETE FROM tasker.tokens
+WHERE token_id IN (
+    SELECT token_id
+    FROM tasker.tokens
+    WHERE expires_in < now()
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+"""
+    # Delete a batch of tombstones older than the retention and move
+    # the sync horizon past them
+    expired_tombstones = """
+WITH purged AS (
+    DELETE FROM tasker.tombstones
+    WHERE tombstone_id IN (
+        SELECT tombstone_id
+        FROM tasker.tombstones
+        WHERE deleted < now() - CAST(%s as INT) * INTERVAL '1 second'
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING sync_xid
+), horizon AS (
+    UPDATE tasker.sync_horizon
+    SET xid = GREATEST(xid, (SELECT MAX(sync_xid) FROM purged))
+    WHERE EXISTS (SELECT 1 FROM purged)
+)
+SELECT count(*) FROM purged
+"""
@@ -1,33 +1,123 @@
 
 class InsertQueries:
+    # Types of parameters in select lists are given explicitly, otherwise
+    # they can't be inferred when a query is prepared
     add_user = """
 INSERT INTO tasker.users(username, password) VALUES(%s, %s) RETURNING user_id
 """
+    # Every project has a row in project_counters with the last allocated
+    # folder_pub_id and task_pub_id
     add_project = """
-INSERT INTO tasker.projects(title, description) VALUES(%s, %s) 
-RETURNING project_id, project_pub_id
+WITH project AS (
+    INSERT INTO tasker.projects(title, description) VALUES(%s, %s)
+    RETURNING project_id, project_pub_id
+), counters AS (
+    INSERT INTO tasker.project_counters(project_id)
+    SELECT project_id FROM project
+)
+SELECT project_id, project_pub_id FROM project
 """
     add_folder = """
+WITH counter AS (
+    UPDATE tasker.project_counters
+    SET folder_pub_id = folder_pub_id + 1
+    WHERE project_id = %(project_id)s
+    RETURNING folder_pub_id
+)
 INSERT INTO tasker.folders(folder_pub_id, title, project_id)
-VALUES(nextval('tasker.{seq}'), %s, %s)
+SELECT
+    folder_pub_id, CAST(%(title)s as TEXT), CAST(%(project_id)s as INT)
+FROM counter
 RETURNING folder_id, folder_pub_id
 """
     add_task = """
+WITH counter AS (
+    UPDATE tasker.project_counters
+    SET task_pub_id = task_pub_id + 1
+    WHERE project_id = %(project_id)s
+    RETURNING task_pub_id
+)
 INSERT INTO tasker.tasks(
     task_pub_id, title, description, datetime_from, datetime_due,
     user_id, project_id, folder_id
 )
-VALUES(nextval('tasker.{seq}'), %s, %s, %s, %s, %s, %s, %s)
+SELECT
+    task_pub_id,
+    CAST(%(title)s as TEXT),
+    CAST(%(description)s as TEXT),
+    CAST(%(datetime_from)s as TIMESTAMP),
+    CAST(%(datetime_due)s as TIMESTAMP),
+    CAST(%(user_id)s as INT),
+    CAST(%(project_id)s as INT),
+    CAST(%(folder_id)s as INT)
+FROM counter
 RETURNING task_id, task_pub_id
+"""
+    # Insert tasks from arrays of values in order of the arrays,
+    # allocate a range of task_pub_id at once
+    add_tasks = """
+WITH counter AS (
+    UPDATE tasker.project_counters
+    SET task_pub_id = task_pub_id + %(count)s
+    WHERE project_id = %(project_id)s
+    RETURNING task_pub_id - %(count)s first_pub_id
+)
+INSERT INTO tasker.tasks(
+    task_pub_id, title, description, datetime_from, datetime_due,
+    user_id, project_id, folder_id
+)
+SELECT
+    counter.first_pub_id + t.n, t.title, t.description, t.datetime_from,
+    t.datetime_due, CAST(%(user_id)s as INT), CAST(%(project_id)s as INT),
+    CAST(%(folder_id)s as INT)
+FROM
+    counter,
+    unnest(
+        CAST(%(title)s as TEXT[]),
+        CAST(%(description)s as TEXT[]),
+        CAST(%(datetime_from)s as TIMESTAMP[]),
+        CAST(%(datetime_due)s as TIMESTAMP[])
+    ) WITH ORDINALITY t(title, description, datetime_from, datetime_due, n)
+RETURNING task_pub_id
 """
     add_user_project = """
 INSERT INTO tasker.projects_users(project_id, user_id, role) VALUES(%s, %s, %s)
 """
     tokens = """
-INSERT INTO 
-    tasker.tokens(token_select, token_verify, token_renew, expires_in, user_id)
-SELECT %s, %s, %s, CURRENT_TIMESTAMP + '{}'::INTERVAL, user_id
+INSERT INTO tasker.tokens(
+    token_select, token_verify, key_id, token_renew, expires_in, user_id
+)
+SELECT
+    CAST(%s as TEXT), CAST(%s as BYTEA), CAST(%s as TEXT), CAST(%s as TEXT),
+    CURRENT_TIMESTAMP + '{}'::INTERVAL, user_id
 FROM tasker.users
 WHERE username = %s
 RETURNING CAST(FLOOR(EXTRACT(EPOCH FROM expires_in)) as INT)
+"""
+    # Replace used tokens with new ones. The hash of the verify token
+    # by every valid key is passed, the stored hash has to be one of them.
+    # A concurrent renew with the same tokens waits for the row lock
+    # and deletes nothing, only one of them inserts new tokens
+    tokens_renew = """
+WITH used AS (
+    DELETE FROM tasker.tokens
+    WHERE
+        token_select = %(token_select)s
+        and token_renew = %(token_renew)s
+        and (key_id, token_verify) IN (
+            SELECT * FROM unnest(
+                CAST(%(key_ids)s as TEXT[]), CAST(%(hashes)s as BYTEA[])
+            )
+        )
+    RETURNING user_id
+)
+INSERT INTO tasker.tokens(
+    token_select, token_verify, key_id, token_renew, expires_in, user_id
+)
+SELECT
+    CAST(%(new_select)s as TEXT), CAST(%(new_verify)s as BYTEA),
+    CAST(%(key_id)s as TEXT), CAST(%(new_renew)s as TEXT),
+    CURRENT_TIMESTAMP + '{}'::INTERVAL, user_id
+FROM used
+RETURNING CAST(FLOOR(EXTRACT(EPOCH FROM expires_in)) as INT)
 """
@@ -0,0 +1,342 @@
+from .create import CreateQueries
+
+
+class MigrationQueries:
+    # Id of the advisory lock taken by `db_manage.py migrate`,
+    # prevents concurrent runs from applying the same migration twice
+    lock_id = 7412001
+    lock = 'SELECT pg_advisory_lock(%s)'
+    unlock = 'SELECT pg_advisory_unlock(%s)'
+    schema_version = """
+CREATE TABLE IF NOT EXISTS tasker.schema_version(
+    version INT,
+    description TEXT,
+    applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY(version)
+)
+"""
+    applied = """
+SELECT
+    version, CAST(FLOOR(EXTRACT(EPOCH FROM applied)) as INT) applied
+FROM
+    tasker.schema_version
+ORDER BY
+    version
+"""
+    add_version = """
+INSERT INTO tasker.schema_version(version, description) VALUES(%s, %s)
+"""
+    # Indexes left invalid by a failed CREATE INDEX CONCURRENTLY,
+    # `IF NOT EXISTS` skips them so they have to be dropped before retry
+    invalid_indexes = """
+SELECT
+    CAST(indexrelid::regclass as TEXT)
+FROM
+    pg_index INNER JOIN pg_class on pg_index.indrelid = pg_class.oid
+WHERE
+    not pg_index.indisvalid
+    and pg_class.relnamespace = CAST('tasker' as regnamespace)
+"""
+    drop_index = 'DROP INDEX CONCURRENTLY IF EXISTS {}'
+
+
+class Migration(CreateQueries):
+    """ Base class of schema migrations. Public attributes are queries
+    executed in order of attribute names, `_version` is a number of the
+    migration in `tasker.schema_version`. If `_transaction` is False
+    queries are executed outside of a transaction, it is required by
+    `CREATE INDEX CONCURRENTLY`, so such queries have to be idempotent
+    """
+    _version = None
+    _transaction = True
+
+    @classmethod
+    def description(cls):
+        return cls.__doc__.strip()
+
+
+class TokensKeyIdMigration(Migration):
+    """ Store id of the MAC key with tokens """
+    _version = 1
+    key_id = 'ALTER TABLE tasker.tokens ADD COLUMN IF NOT EXISTS key_id TEXT'
+
+
+class HotPathIndexesMigration(Migration):
+    """ Add indexes for access checks, lists and tokens expiration """
+    _version = 2
+    _transaction = False
+    folders_project = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS folders_project_idx
+ON tasker.folders(project_id, folder_pub_id)
+"""
+    projects_users_user = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_users_user_idx
+ON tasker.projects_users(user_id, project_id)
+"""
+    # Used by cascade deletion of projects as well
+    projects_users_project = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_users_project_idx
+ON tasker.projects_users(project_id)
+"""
+    tasks_folder = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_folder_idx
+ON tasker.tasks(folder_id, task_pub_id)
+"""
+    tasks_project = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_project_idx
+ON tasker.tasks(project_id, task_pub_id)
+"""
+    tokens_expires_in = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tokens_expires_in_idx
+ON tasker.tokens(expires_in)
+"""
+
+
+class ProjectCountersMigration(Migration):
+    """ Allocate pub ids from project_counters instead of sequences """
+    _version = 3
+    # Last allocated folder_pub_id and task_pub_id of every project,
+    # rows are updated often, keep space on pages for HOT updates
+    counters_create = """
+CREATE TABLE IF NOT EXISTS tasker.project_counters(
+    project_id INT,
+    folder_pub_id INT NOT NULL DEFAULT 0,
+    task_pub_id INT NOT NULL DEFAULT 0,
+    PRIMARY KEY(project_id),
+    CONSTRAINT fk_project_counters_project
+        FOREIGN KEY(project_id)
+            REFERENCES tasker.projects(project_id)
+            ON DELETE CASCADE
+) WITH (fillfactor = 50)
+"""
+    # Continue from sequences values, ids of deleted folders and tasks
+    # are never reused
+    counters_fill = """
+INSERT INTO tasker.project_counters(project_id, folder_pub_id, task_pub_id)
+SELECT
+    p.project_id,
+    GREATEST(
+        (SELECT last_value FROM pg_sequences
+         WHERE schemaname = 'tasker'
+            and sequencename = 'project_folder_' || p.project_id || '_seq'),
+        (SELECT MAX(f.folder_pub_id) FROM tasker.folders f
+         WHERE f.project_id = p.project_id),
+        0
+    ),
+    GREATEST(
+        (SELECT last_value FROM pg_sequences
+         WHERE schemaname = 'tasker'
+            and sequencename = 'project_task_' || p.project_id || '_seq'),
+        (SELECT MAX(t.task_pub_id) FROM tasker.tasks t
+         WHERE t.project_id = p.project_id),
+        0
+    )
+FROM
+    tasker.projects p
+ON CONFLICT (project_id) DO NOTHING
+"""
+    sequences_drop = """
+DO $$
+DECLARE
+    seq RECORD;
+BEGIN
+    FOR seq IN
+        SELECT sequencename FROM pg_sequences
+        WHERE schemaname = 'tasker'
+            and sequencename ~ '^project_(folder|task)_[0-9]+_seq$'
+    LOOP
+        EXECUTE format('DROP SEQUENCE tasker.%I', seq.sequencename);
+    END LOOP;
+END
+$$
+"""
+
+
+class ProjectVersionMigration(Migration):
+    """ Add a version of projects bumped by changes of their content """
+    _version = 4
+    column_version = """
+ALTER TABLE tasker.projects
+ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0
+"""
+    # Statement-level, a bulk change of tasks bumps the version once
+    function_bump = """
+CREATE OR REPLACE FUNCTION tasker.project_version_bump() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tasker.projects
+    SET version = version + 1
+    WHERE project_id IN (SELECT DISTINCT project_id FROM changed);
+    RETURN NULL;
+END;
+    $$ language plpgsql;
+"""
+    function_edited = """
+CREATE OR REPLACE FUNCTION tasker.project_version_edited() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.version = OLD.version THEN
+        NEW.version = OLD.version + 1;
+    END IF;
+    RETURN NEW;
+END;
+    $$ language plpgsql strict;
+"""
+    trigger_project = """
+CREATE TRIGGER project_update BEFORE UPDATE OF title, description
+on tasker.projects
+FOR EACH ROW EXECUTE PROCEDURE tasker.project_version_edited()
+"""
+    # Transition tables can't be used by triggers with several events
+    triggers_content = """
+CREATE TRIGGER tasks_version_insert AFTER INSERT on tasker.tasks
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER tasks_version_update AFTER UPDATE on tasker.tasks
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER tasks_version_delete AFTER DELETE on tasker.tasks
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER folders_version_insert AFTER INSERT on tasker.folders
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER folders_version_update AFTER UPDATE on tasker.folders
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER folders_version_delete AFTER DELETE on tasker.folders
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER projects_users_version_insert AFTER INSERT
+on tasker.projects_users
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER projects_users_version_update AFTER UPDATE
+on tasker.projects_users
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+
+CREATE TRIGGER projects_users_version_delete AFTER DELETE
+on tasker.projects_users
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.project_version_bump();
+"""
+
+
+class SyncMigration(Migration):
+    """ Track changes of tasks and folders and tombstones for delta sync """
+    _version = 5
+    # Id of the last transaction which has written a row. No default,
+    # a volatile one would rewrite the tables, NULL of old rows is 0
+    columns_sync_xid = """
+ALTER TABLE tasker.tasks ADD COLUMN IF NOT EXISTS sync_xid BIGINT;
+ALTER TABLE tasker.folders ADD COLUMN IF NOT EXISTS sync_xid BIGINT;
+"""
+    function_sync_xid = """
+CREATE OR REPLACE FUNCTION tasker.sync_xid_set() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.sync_xid = txid_current();
+    RETURN NEW;
+END;
+    $$ language plpgsql;
+"""
+    # Rows deleted by cascade deletion of a project don't need tombstones,
+    # the project is already deleted when they are
+    function_tombstones = """
+CREATE OR REPLACE FUNCTION tasker.tombstones_tasks() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO tasker.tombstones(project_id, kind, pub_id)
+    SELECT d.project_id, 'task', d.task_pub_id
+    FROM deleted d
+    WHERE d.project_id IN (SELECT project_id FROM tasker.projects);
+    RETURN NULL;
+END;
+    $$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION tasker.tombstones_folders() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO tasker.tombstones(project_id, kind, pub_id)
+    SELECT d.project_id, 'folder', d.folder_pub_id
+    FROM deleted d
+    WHERE d.project_id IN (SELECT project_id FROM tasker.projects);
+    RETURN NULL;
+END;
+    $$ language plpgsql;
+"""
+    # Greatest sync_xid of purged tombstones, sync from an older cursor
+    # could miss deletions
+    horizon_create = """
+CREATE TABLE IF NOT EXISTS tasker.sync_horizon(
+    xid BIGINT NOT NULL
+)
+"""
+    horizon_fill = """
+INSERT INTO tasker.sync_horizon(xid)
+SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM tasker.sync_horizon)
+"""
+    # No foreign key, deletions don't lock projects rows, tombstones
+    # of deleted projects are purged with the rest
+    tombstones_create = """
+CREATE TABLE IF NOT EXISTS tasker.tombstones(
+    tombstone_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    project_id INT NOT NULL,
+    kind TEXT NOT NULL,
+    pub_id INT NOT NULL,
+    sync_xid BIGINT NOT NULL DEFAULT txid_current(),
+    deleted TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY(tombstone_id)
+)
+"""
+    tombstones_index = """
+CREATE INDEX IF NOT EXISTS tombstones_project_idx
+ON tasker.tombstones(project_id, sync_xid);
+
+CREATE INDEX IF NOT EXISTS tombstones_deleted_idx
+ON tasker.tombstones(deleted);
+"""
+    triggers_sync_xid = """
+CREATE TRIGGER tasks_sync_xid BEFORE INSERT OR UPDATE on tasker.tasks
+FOR EACH ROW EXECUTE PROCEDURE tasker.sync_xid_set();
+
+CREATE TRIGGER folders_sync_xid BEFORE INSERT OR UPDATE on tasker.folders
+FOR EACH ROW EXECUTE PROCEDURE tasker.sync_xid_set();
+"""
+    triggers_tombstones = """
+CREATE TRIGGER tasks_tombstones AFTER DELETE on tasker.tasks
+REFERENCING OLD TABLE AS deleted
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.tombstones_tasks();
+
+CREATE TRIGGER folders_tombstones AFTER DELETE on tasker.folders
+REFERENCING OLD TABLE AS deleted
+FOR EACH STATEMENT EXECUTE PROCEDURE tasker.tombstones_folders();
+"""
+
+
+class SyncIndexesMigration(Migration):
+    """ Add indexes for delta sync of tasks and folders """
+    _version = 6
+    _transaction = False
+    folders_sync = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS folders_sync_idx
+ON tasker.folders(project_id, COALESCE(sync_xid, 0))
+"""
+    tasks_sync = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_sync_idx
+ON tasker.tasks(project_id, COALESCE(sync_xid, 0))
+"""
+
+
+# Migrations in order of versions
+MIGRATIONS = [
+    TokensKeyIdMigration,
+    HotPathIndexesMigration,
+    ProjectCountersMigration,
+    ProjectVersionMigration,
+    SyncMigration,
+    SyncIndexesMigration
+]
@@ -0,0 +1,60 @@
+import functools
+
+from .delete import DeleteQueries
+from .insert import InsertQueries
+from .select import SelectQueries
+from .update import UpdateQueries
+
+
+class QueryNames:
+    """ Symbolic names of queries, e.g. `SelectQueries.tasks_by_project`,
+    used to tag query timings. Queries composed at runtime (with `{}`
+    placeholders) are recognized by the text before the first and after
+    the last placeholder
+    """
+
+    # Name of queries which aren't attributes of the classes
+    unknown = 'other'
+
+    def __init__(self, *classes):
+        """
+        :param classes: classes of queries, e.g. SelectQueries
+        """
+        # Query text: name
+        self._names = {}
+        # (prefix, suffix, name), the longest ones first
+        self._templates = []
+        for cls in classes:
+            for attr, query in vars(cls).items():
+                if attr.startswith('_') or not isinstance(query, str):
+                    continue
+                name = '{}.{}'.format(cls.__name__, attr)
+                if '{' in query:
+                    parts = query.split('{}')
+                    self._templates.append((parts[0], parts[-1], name))
+                else:
+                    self._names[query] = name
+        self._templates.sort(key=lambda item: -len(item[0] + item[1]))
+
+    def get(self, query):
+        """ Get the name of a query
+        :param query: query text, composed queries have to be rendered
+        :type query: str
+        :rtype: str
+        """
+        name = self._names.get(query)
+        if name is None:
+            name = self._match(query)
+        return name
+
+    @functools.lru_cache(maxsize=1024)
+    def _match(self, query):
+        for prefix, suffix, name in self._templates:
+            if query.startswith(prefix) and query.endswith(suffix):
+                return name
+        return self.unknown
+
+
+QUERY_NAMES = QueryNames(
+    SelectQueries, InsertQueries, UpdateQueries, DeleteQueries
+)
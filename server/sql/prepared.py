@@ -0,0 +1,115 @@
+import re
+
+from .delete import DeleteQueries
+from .insert import InsertQueries
+from .select import SelectQueries
+from .update import UpdateQueries
+
+_placeholder = re.compile(r'%\((\w+)\)s|%s|%%')
+
+
+def number_placeholders(query):
+    """ Convert psycopg2 placeholders of a query to `$n` parameters
+    :param query: query with `%s` or `%(name)s` placeholders
+    :type query: str
+    :return: query with `$n` parameters, names of parameters in order of
+        numbers, None for positional ones
+    :rtype: tuple
+    """
+    names = []
+    numbers = {}
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        key = match.group(1)
+        if key is None:
+            names.append(None)
+            return '${}'.format(len(names))
+        if key not in numbers:
+            names.append(key)
+            numbers[key] = len(names)
+        return '${}'.format(numbers[key])
+
+    return _placeholder.sub(replace, query), names
+
+
+class PreparedStatements:
+    """ Static queries prepared once per db connection and executed by name,
+    so their parse and analysis is done once instead of on every request.
+
+    Every public query of the given classes becomes a statement named
+    `<prefix>_<attribute>`, e.g. `select_token_auth`. Queries composed at
+    runtime (with `{}` placeholders), statements which can't be prepared,
+    e.g. FETCH, and excluded queries are skipped, they are executed as text.
+    psycopg2 placeholders are converted to `$n` parameters, see
+    `number_placeholders`.
+    """
+
+    _preparable = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'VALUES')
+
+    def __init__(self, *classes, exclude=()):
+        """
+        :param classes: classes of queries, e.g. SelectQueries
+        :param exclude: queries which are never executed by name
+        :type exclude: tuple
+        """
+        # Query text: (PREPARE query, EXECUTE query)
+        self._statements = {}
+        for cls in classes:
+            prefix = cls.__name__[:-len('Queries')].lower()
+            for attr, query in vars(cls).items():
+                if attr.startswith('_') or not self._is_static(query) or \
+                        query in exclude:
+                    continue
+                name = '{}_{}'.format(prefix, attr)
+                self._statements[query] = self._make(name, query)
+
+    def __len__(self):
+        return len(self._statements)
+
+    @classmethod
+    def _is_static(cls, query):
+        return isinstance(query, str) and '{' not in query and \
+            query.split(None, 1)[0].upper() in cls._preparable
+
+    @classmethod
+    def _make(cls, name, query):
+        query, names = number_placeholders(query)
+        prepare = 'PREPARE {} AS {}'.format(name, query)
+        execute = 'EXECUTE {}'.format(name)
+        if names:
+            execute = '{}({})'.format(execute, ', '.join(
+                '%s' if key is None else '%({})s'.format(key) for key in names
+            ))
+        return prepare, execute
+
+    async def prepare(self, conn):
+        """ Prepare all statements on a connection, it's used as `on_connect`
+        callback of the db pool
+        :param conn: new db connection
+        :type conn: aiopg.Connection
+        """
+        async with conn.cursor() as cur:
+            for prepare, _ in self._statements.values():
+                await cur.execute(prepare)
+
+    def get(self, query):
+        """ Get text for executing a query
+        :param query: query text, e.g. `SelectQueries.task`
+        :type query: str
+        :return: EXECUTE of the prepared statement with the same parameters
+            as the query or the query itself if it isn't prepared
+        :rtype: str
+        """
+        statement = self._statements.get(query)
+        if statement is None:
+            return query
+        return statement[1]
+
+
+PREPARED = PreparedStatements(
+    SelectQueries, InsertQueries, UpdateQueries, DeleteQueries,
+    # Executed as a composed query, never by name
+    exclude=(InsertQueries.add_tasks,)
+)
@@ -0,0 +1,43 @@
+
+class SeedQueries:
+    """ Queries of `db_manage.py seed`, synthetic data is loaded by COPY.
+    Identity columns can't be copied, ids of copied users and folders are
+    selected back
+    """
+    copy_users = 'COPY tasker.users(username, password) FROM STDIN'
+    users = """
+SELECT user_id FROM tasker.users WHERE username LIKE %s ORDER BY user_id
+"""
+    # project_pub_id is generated by its default
+    projects = """
+INSERT INTO tasker.projects(title, description)
+SELECT 'Project ' || n, 'Description of project ' || n
+FROM generate_series(1, %s) n
+RETURNING project_id
+"""
+    copy_projects_users = """
+COPY tasker.projects_users(project_id, user_id, role) FROM STDIN
+"""
+    # Counters are copied with the last pub ids of seeded folders and tasks
+    copy_project_counters = """
+COPY tasker.project_counters(project_id, folder_pub_id, task_pub_id)
+FROM STDIN
+"""
+    copy_folders = """
+COPY tasker.folders(folder_pub_id, title, project_id) FROM STDIN
+"""
+    folders = """
+SELECT project_id, folder_pub_id, folder_id
+FROM tasker.folders
+WHERE project_id = ANY(%s)
+"""
+    copy_tasks = """
+COPY tasker.tasks(
+    task_pub_id, title, description, datetime_due, user_id, project_id,
+    folder_id
+) FROM STDIN
+"""
+    analyze = """
+ANALYZE tasker.users, tasker.projects, tasker.projects_users,
+    tasker.project_counters, tasker.folders, tasker.tasks
+"""
@@ -1,27 +1,44 @@
 
 class SelectQueries:
+    # Server-side cursor used for streaming a list selected by a query
+    # in batches instead of fetching it at once, requires a transaction
+    stream_declare = 'DECLARE stream NO SCROLL CURSOR FOR {}'
+    stream_fetch = 'FETCH FORWARD %s FROM stream'
+    # Plan of a slow query logged in debug mode, the query is executed
+    explain = 'EXPLAIN (ANALYZE, BUFFERS) {}'
+    # Replication lag of a replica in seconds, 0 if it has replayed all
+    # received WAL or if it's a primary
+    replica_lag = """
+SELECT
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(CAST(EXTRACT(
+            EPOCH FROM now() - pg_last_xact_replay_timestamp()
+        ) as FLOAT), 0)
+    END
+"""
     password_auth = 'SELECT password FROM tasker.users WHERE username = %s'
+    # Version of a project on a replica serving reads of its content
+    project_version = \
+        'SELECT version FROM tasker.projects WHERE project_id = %s'
     token_auth = """
 SELECT
-    u.user_id, u.username, t.token_verify
+    u.user_id,
+    u.username,
+    t.token_verify,
+    t.key_id,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.expires_in - now())) as INT) expires_in
 FROM
     tasker.tokens t INNER JOIN tasker.users u on t.user_id = u.user_id
 WHERE
     t.token_select = %s and t.expires_in >= now()
-"""
-    token_renew = """
-SELECT
-    u.username, t.token_verify, t.token_id
-FROM
-     tasker.tokens t INNER JOIN tasker.users u on t.user_id = u.user_id
-WHERE
-    t.token_select = %s and t.token_renew = %s
 """
     # Check access to the project
     # If the project doesn't exists return nothing
     project_access = """
 SELECT
-    projects.project_id, pu.role
+    projects.project_id, pu.role, projects.version
 FROM
     tasker.projects
     INNER JOIN
@@ -33,7 +50,7 @@ WHERE
     # return nothing
     project_folder_access = """
 SELECT
-    projects.project_id, folders.folder_id, pu.role
+    projects.project_id, folders.folder_id, pu.role, projects.version
 FROM
     tasker.projects_users pu
     INNER JOIN
@@ -50,7 +67,8 @@ WHERE
     # return nothing
     project_folder_task_access = """
 SELECT
-    projects.project_id, folders.folder_id, tasks.task_id, pu.role
+    projects.project_id, folders.folder_id, tasks.task_id, pu.role,
+    projects.version
 FROM
     tasker.projects_users pu
     INNER JOIN
@@ -67,6 +85,109 @@ WHERE
     and folders.folder_pub_id = %s
     and tasks.task_pub_id = %s
 """
+    # Check tokens and access to the project, folder and task in a single
+    # round trip. If tokens are invalid return nothing, if the project,
+    # folder or task doesn't exist or the user doesn't have access to it
+    # access columns (project_id, folder_id, task_id, role, version)
+    # are NULL
+    token_project_access = """
+SELECT
+    u.user_id,
+    u.username,
+    t.token_verify,
+    t.key_id,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.expires_in - now())) as INT) expires_in,
+    a.project_id,
+    a.role,
+    a.version
+FROM
+    tasker.tokens t
+    INNER JOIN tasker.users u on t.user_id = u.user_id
+    LEFT JOIN LATERAL (
+        SELECT
+            projects.project_id, pu.role, projects.version
+        FROM
+            tasker.projects
+            INNER JOIN
+            tasker.projects_users pu on projects.project_id = pu.project_id
+        WHERE
+            pu.user_id = u.user_id and projects.project_pub_id = %s
+    ) a on true
+WHERE
+    t.token_select = %s and t.expires_in >= now()
+"""
+    token_project_folder_access = """
+SELECT
+    u.user_id,
+    u.username,
+    t.token_verify,
+    t.key_id,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.expires_in - now())) as INT) expires_in,
+    a.project_id,
+    a.folder_id,
+    a.role,
+    a.version
+FROM
+    tasker.tokens t
+    INNER JOIN tasker.users u on t.user_id = u.user_id
+    LEFT JOIN LATERAL (
+        SELECT
+            projects.project_id, folders.folder_id, pu.role, projects.version
+        FROM
+            tasker.projects_users pu
+            INNER JOIN
+            tasker.projects on pu.project_id = projects.project_id
+
+            INNER JOIN
+            tasker.folders on pu.project_id = folders.project_id
+        WHERE
+            pu.user_id = u.user_id
+            and projects.project_pub_id = %s
+            and folders.folder_pub_id = %s
+    ) a on true
+WHERE
+    t.token_select = %s and t.expires_in >= now()
+"""
+    token_project_folder_task_access = """
+SELECT
+    u.user_id,
+    u.username,
+    t.token_verify,
+    t.key_id,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.expires_in - now())) as INT) expires_in,
+    a.project_id,
+    a.folder_id,
+    a.task_id,
+    a.role,
+    a.version
+FROM
+    tasker.tokens t
+    INNER JOIN tasker.users u on t.user_id = u.user_id
+    LEFT JOIN LATERAL (
+        SELECT
+            projects.project_id, folders.folder_id, tasks.task_id, pu.role,
+            projects.version
+        FROM
+            tasker.projects_users pu
+            INNER JOIN
+            tasker.projects on pu.project_id = projects.project_id
+
+            INNER JOIN
+            tasker.folders on pu.project_id = folders.project_id
+
+            INNER JOIN
+            tasker.tasks on pu.project_id = tasks.project_id
+        WHERE
+            pu.user_id = u.user_id
+            and projects.project_pub_id = %s
+            and folders.folder_pub_id = %s
+            and tasks.task_pub_id = %s
+    ) a on true
+WHERE
+    t.token_select = %s and t.expires_in >= now()
+"""
+    # Lists use keyset pagination: items with id greater than the last seen
+    # one in order of ids, limited to a page size (LIMIT NULL - no limit)
     # List projects available for a user
     projects = """
 SELECT 
@@ -75,7 +196,10 @@ FROM
     tasker.projects_users pu       
     INNER JOIN tasker.projects on pu.project_id = projects.project_id
 WHERE
-    pu.user_id = %s
+    pu.user_id = %s and projects.project_pub_id > %s
+ORDER BY
+    projects.project_pub_id
+LIMIT %s
 """
     # List folders in a project
     folders = """
@@ -84,7 +208,10 @@ SELECT
 FROM 
     tasker.folders f INNER JOIN tasker.projects p on f.project_id = p.project_id
 WHERE 
-    p.project_id = %s
+    p.project_id = %s and f.folder_pub_id > %s
+ORDER BY
+    f.folder_pub_id
+LIMIT %s
 """
     folder = """
 SELECT
@@ -109,7 +236,10 @@ FROM
     INNER JOIN tasker.folders f on t.folder_id = f.folder_id
     INNER JOIN tasker.projects p on t.project_id = p.project_id
 WHERE
-    t.project_id = %s and f.folder_id = %s
+    t.project_id = %s and f.folder_id = %s and t.task_pub_id > %s
+ORDER BY
+    t.task_pub_id
+LIMIT %s
 """
     # List tasks in a project
     tasks_by_project = """
@@ -126,7 +256,10 @@ FROM
     INNER JOIN tasker.folders f on t.folder_id = f.folder_id
     INNER JOIN tasker.projects p on t.project_id = p.project_id
 WHERE
-    t.project_id = %s
+    t.project_id = %s and t.task_pub_id > %s
+ORDER BY
+    t.task_pub_id
+LIMIT %s
 """
     task = """
 SELECT
@@ -173,4 +306,51 @@ GROUP BY
     projects.project_pub_id,
     projects.title, 
     projects.description
+"""
+    # Delta sync: the snapshot taken by the first query of a REPEATABLE READ
+    # transaction. Transactions with ids below the snapshot xmin have
+    # finished, its rows are visible, so xmin is the next cursor.
+    # Rows of transactions still running may be returned again next time
+    sync_snapshot = """
+SELECT
+    txid_snapshot_xmin(txid_current_snapshot()) next_xid,
+    (SELECT xid FROM tasker.sync_horizon) horizon_xid
+"""
+    # Folders and tasks written by transactions since the cursor
+    sync_folders = """
+SELECT
+    f.folder_pub_id id, f.title
+FROM
+    tasker.folders f
+WHERE
+    f.project_id = %s and COALESCE(f.sync_xid, 0) >= %s
+ORDER BY
+    f.folder_pub_id
+"""
+    sync_tasks = """
+SELECT
+    t.task_pub_id id,
+    f.folder_pub_id folder_id,
+    t.title,
+    t.description,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.datetime_from)) as INT) datetime_from,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.datetime_due)) as INT) datetime_due,
+    CAST(FLOOR(EXTRACT(EPOCH FROM t.edited)) as INT) edited
+FROM
+    tasker.tasks t
+    INNER JOIN tasker.folders f on t.folder_id = f.folder_id
+WHERE
+    t.project_id = %s and COALESCE(t.sync_xid, 0) >= %s
+ORDER BY
+    t.task_pub_id
+"""
+    sync_tombstones = """
+SELECT
+    kind, pub_id
+FROM
+    tasker.tombstones
+WHERE
+    project_id = %s and sync_xid >= %s
+ORDER BY
+    pub_id
 """
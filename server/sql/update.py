@@ -7,3 +7,26 @@ UPDATE tasker.users SET display_name = %s WHERE username = %s
     password = 'UPDATE tasker.users SET password = %s WHERE username = %s'
     task = 'UPDATE tasker.tasks SET {} WHERE task_id = %(task_id)s'
     folder = 'UPDATE tasker.folders SET title = %s WHERE folder_id = %s'
+    # Update tasks of a project by list of task_pub_id
+    tasks = """
+UPDATE tasker.tasks t
+SET {}
+WHERE t.project_id = %(project_id)s and t.task_pub_id = ANY(%(ids)s)
+RETURNING t.task_pub_id
+"""
+    # Update tasks and move them to a folder of the same project.
+    # Nothing is returned if the folder doesn't exist, a NULL id if
+    # no task is updated
+    tasks_move = """
+WITH f AS (
+    SELECT folder_id FROM tasker.folders
+    WHERE project_id = %(project_id)s and folder_pub_id = %(folder_pub_id)s
+), u AS (
+    UPDATE tasker.tasks t
+    SET {}
+    FROM f
+    WHERE t.project_id = %(project_id)s and t.task_pub_id = ANY(%(ids)s)
+    RETURNING t.task_pub_id
+)
+SELECT u.task_pub_id FROM f LEFT JOIN u ON true
+"""
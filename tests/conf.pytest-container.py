@@ -3,16 +3,89 @@ import multiprocessing
 
 # Application
 WORKERS = multiprocessing.cpu_count()
+# How to run cheap crypto primitives (token hashing and comparison):
+# 'inline' on the event loop or 'executor' in the thread pool.
+# Password hashing always runs in the pwhash pool
+CRYPTO_DISPATCH = 'inline'
+# Password hashing (Argon2id) runs in a dedicated pool of processes,
+# logins over the queue limit are rejected with 503 and Retry-After.
+# Stored hashes are rehashed on login when the limits change.
+# Processes per host, divided between server processes (at least one each),
+# every process of the pool may take up to PWHASH_MEMLIMIT
+PWHASH_PROCESSES = WORKERS
+PWHASH_QUEUE_SIZE = 64  # per server process
+PWHASH_OPSLIMIT = 2  # passes
+PWHASH_MEMLIMIT = 64 * 1024 * 1024  # bytes
+PWHASH_RETRY_AFTER = 1  # seconds
 DEBUG = True
 TOKEN_EXPIRES_TIME = 7200  # seconds
+TOKEN_CACHE_SIZE = 10000  # entries, 0 disables the cache
+# Every server process caches tokens separately, requests which don't check
+# access to a project accept tokens renewed or deleted by another process
+# for up to the TTL
+TOKEN_CACHE_TTL = 30  # seconds
+# MAC keys and cookie secret shared by all processes and nodes
+KEYRING_PATH = '/tmp/tasker-keyring.json'
+# Retired keys remain valid for the time, should be >= TOKEN_EXPIRES_TIME
+KEY_GRACE_PERIOD = TOKEN_EXPIRES_TIME  # seconds
+KEYRING_RELOAD_INTERVAL = 60  # seconds
+# Expired tokens purge, 0 interval disables it
+TOKENS_PURGE_INTERVAL = 600  # seconds
+TOKENS_PURGE_BATCH_SIZE = 1000
+# Lists of projects, folders and tasks
+PAGE_SIZE = 100  # default number of items per page
+PAGE_SIZE_MAX = 1000
+# Rows fetched at once when a list is streamed with `format=ndjson`
+STREAM_FETCH_SIZE = 1000
+# Max number of tasks created by one bulk request
+TASKS_BULK_MAX = 1000
+# Max number of sub-requests of one /api/batch request
+BATCH_REQUESTS_MAX = 50
+# Tombstones of deleted tasks and folders returned by the sync endpoint
+# are kept for the time, sync from an older cursor has to start over.
+# Purge of older tombstones, 0 interval disables it
+TOMBSTONES_RETENTION = 30 * 24 * 3600  # seconds
+TOMBSTONES_PURGE_INTERVAL = 3600  # seconds
+TOMBSTONES_PURGE_BATCH_SIZE = 1000
+# Response compression negotiated by Accept-Encoding, encodings in order
+# of preference: 'zstd', 'br' (optional dependencies, skipped if not
+# installed) and 'gzip'. Empty list disables compression
+COMPRESS_ENCODINGS = ['zstd', 'br', 'gzip']
+COMPRESS_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+COMPRESS_MIN_SIZE = 1024  # bytes, smaller bodies are sent as is
+# Bodies and stream chunks from the size are compressed in the thread pool
+COMPRESS_EXECUTOR_SIZE = 64 * 1024  # bytes
 
 # HTTP Server
 HOST = '127.0.0.1'
 PORT = 8888
+# Admin endpoints (/metrics), every server process listens on its own port:
+# ADMIN_PORT + number of the process. 0 disables them
+ADMIN_HOST = '127.0.0.1'
+ADMIN_PORT = 9888
 
 # Database
+# Driver: 'aiopg' or 'asyncpg' (optional dependency)
+DB_DRIVER = 'aiopg'
 DB_SETTINGS = {
     'database': 'taskerdb',
     'user': 'taskeruser',
     'host': '/var/run/postgresql'
 }
+# Prepare statements of queries: aiopg prepares static queries once per
+# connection and executes them by name, asyncpg caches statements itself
+DB_PREPARE = True
+# Read replicas for GET requests, settings of a replica override
+# DB_SETTINGS, e.g. [{'host': '10.0.0.2'}]
+DB_REPLICAS = []
+DB_REPLICA_MAX_LAG = 5  # seconds
+DB_REPLICA_CHECK_INTERVAL = 5  # seconds
+# Queries running for the time or longer are logged with arguments
+# redacted, 0 disables the log. In DEBUG mode plans of slow select queries
+# are logged too if DB_SLOW_QUERY_EXPLAIN, they are executed again
+DB_SLOW_QUERY_TIME = 0.5  # seconds
+DB_SLOW_QUERY_EXPLAIN = False
+# A token reads from the primary for the time after a write. The window is
+# tracked per server process: with `run_server.py --processes N` a read
+# served by another process than the write may go to a replica
+READ_YOUR_WRITES_WINDOW = 5  # seconds
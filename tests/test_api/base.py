@@ -10,6 +10,8 @@ from tornado.httputil import url_concat
 
 from db_manage import create_user, delete_user
 from server.app import ServerApp, get_db_pool
+from server.conf import KEY_GRACE_PERIOD
+from server.keyring import Keyring
 
 PATH = {
     'new_tokens': '/api/tokens/new',
@@ -20,7 +22,11 @@ PATH = {
     'folder': '/api/folder/{}/{}',
     'task_project': '/api/task/{}',
     'task_folder': '/api/task/{}/{}',
-    'task': '/api/task/{}/{}/{}'
+    'task': '/api/task/{}/{}/{}',
+    'task_project_bulk': '/api/task/{}/bulk',
+    'task_folder_bulk': '/api/task/{}/{}/bulk',
+    'sync': '/api/sync/{}',
+    'batch': '/api/batch'
 }
 
 
@@ -38,6 +44,14 @@ async def fetch(http_client, base_url, path, method, params=None):
     return await http_client.fetch(**parameters)
 
 
+async def fetch_json(http_client, base_url, path, method, params, data):
+    """ Send data as JSON body, params in the query string """
+    return await http_client.fetch(
+        url_concat(urljoin(base_url, path), params), method=method,
+        body=json.dumps(data), raise_error=False
+    )
+
+
 async def get_new_tokens(http_client, base_url, user):
     r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST', user)
     data = json.loads(r.body)
@@ -55,7 +69,12 @@ def user():
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     loop = tornado.ioloop.IOLoop.current()
     db_pool = loop.asyncio_loop.run_until_complete(get_db_pool())
-    return ServerApp(loop.asyncio_loop, db_pool)
+    # Tests may rotate keys, the keyring file of servers isn't touched
+    keyring = Keyring.load(str(tmp_path / 'keyring.json'), KEY_GRACE_PERIOD)
+    app = ServerApp(loop.asyncio_loop, db_pool, keyring)
+    yield app
+    # Stop processes of the pwhash pool started by logins
+    app.pwhash.shutdown()
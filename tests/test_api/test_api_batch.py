@@ -0,0 +1,97 @@
+
+import json
+import pytest
+
+from .base import PATH, app, user, fetch, fetch_json, get_new_tokens
+
+
+@pytest.mark.gen_test
+async def test_batch_get(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    project_id = user['project_id']
+    # Load a board: projects, folders and tasks of a project
+    data = {'requests': [
+        {'method': 'GET', 'path': PATH['project_base']},
+        {'method': 'GET', 'path': PATH['folder_project'].format(project_id)},
+        {'method': 'GET', 'path': PATH['task_project'].format(project_id)},
+        {'method': 'GET', 'path': PATH['project'].format(-1)}
+    ]}
+    r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                         params, data)
+    assert r.code == 200
+    responses = json.loads(r.body)['responses']
+    assert [item['status'] for item in responses] == [200, 200, 200, 404]
+    assert len(responses[0]['body']['projects']) == 1
+    assert 'folders' in responses[1]['body']
+    assert 'tasks' in responses[2]['body']
+    assert responses[3]['body'] is None
+    # Access to the same project is checked once
+    assert app.db_pool.queries['SelectQueries.project_access'].count == 1
+
+    # Tokens are required
+    r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                         {}, data)
+    assert r.code == 403
+
+
+@pytest.mark.gen_test
+async def test_batch_transaction(http_client, base_url, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    project_id = user['project_id']
+    folder_id = user['folder_id']
+    path = PATH['task_folder'].format(project_id, folder_id)
+    create = {'method': 'POST', 'path': path,
+              'args': {'title': 'Batch task'}}
+
+    # The second request fails, the task isn't created
+    data = {'transaction': True, 'requests': [
+        create,
+        {'method': 'PUT',
+         'path': PATH['task'].format(project_id, folder_id, 0),
+         'args': {'title': 'Updated'}},
+        {'method': 'GET', 'path': path}
+    ]}
+    r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                         params, data)
+    assert r.code == 200
+    res = json.loads(r.body)
+    assert res['committed'] is False
+    assert [item['status'] for item in res['responses']] == [200, 404]
+    # Only the demo tasks of the user are in the folder
+    r = await fetch(http_client, base_url, path, 'GET', params)
+    assert [task['id'] for task in json.loads(r.body)['tasks']] == \
+        user['tasks']
+
+    # All requests succeed, the task is created and updated
+    data['requests'][1] = {
+        'method': 'GET', 'path': PATH['folder_project'].format(project_id)
+    }
+    r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                         params, data)
+    res = json.loads(r.body)
+    assert res['committed'] is True
+    task_id = res['responses'][0]['body']['id']
+    assert [task['id'] for task in res['responses'][2]['body']['tasks']] == \
+        user['tasks'] + [task_id]
+
+
+@pytest.mark.gen_test
+async def test_batch_invalid(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    project_id = user['project_id']
+    for requests in (
+            [],
+            [{'method': 'GET', 'path': PATH['sync'].format(project_id)}],
+            [{'method': 'GET', 'path': PATH['new_tokens']}],
+            [{'method': 'PATCH', 'path': PATH['project_base']}],
+            [{'method': 'GET', 'path': PATH['task_project'].format(project_id),
+              'args': {'format': 'ndjson'}}]):
+        r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                             params, {'requests': requests})
+        assert r.code == 400
+
+    requests = [{'method': 'GET', 'path': PATH['project_base']}] * \
+        (app.batch_requests_max + 1)
+    r = await fetch_json(http_client, base_url, PATH['batch'], 'POST',
+                         params, {'requests': requests})
+    assert r.code == 413
@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import pytest
+from psycopg2.sql import SQL, Identifier, Placeholder
+
+from .base import user
+from server.app import get_db_pool
+from server.sql.insert import InsertQueries
+from server.sql.select import SelectQueries
+from server.sql.update import UpdateQueries
+
+asyncpg = pytest.importorskip('asyncpg')
+
+
+def normalize(rows):
+    """ Rows as tuples, memoryview selected by aiopg as bytes """
+    return [
+        tuple(bytes(v) if isinstance(v, memoryview) else v for v in row)
+        for row in rows
+    ]
+
+
+async def fetch_all(db_pool, queries):
+    res = []
+    for query, args in queries:
+        _res = await db_pool.fetch(query, args)
+        res.append((list(_res.columns) if _res else [], normalize(_res)))
+    return res
+
+
+@pytest.mark.gen_test
+async def test_db_drivers_parity(user):
+    pools = [await get_db_pool(driver=driver)
+             for driver in ('aiopg', 'asyncpg')]
+    try:
+        ids = tuple((await pools[0].fetch(
+            SelectQueries.project_folder_task_access,
+            (user['user_id'], user['project_id'], user['folder_id'],
+             user['tasks'][0])
+        ))[0])
+        project_id, folder_id, task_id = ids[:3]
+        queries = [
+            (SelectQueries.password_auth, (user['username'],)),
+            (SelectQueries.project_access,
+             (user['user_id'], user['project_id'])),
+            (SelectQueries.projects, (user['user_id'], 0, 100)),
+            (SelectQueries.project, (user['user_id'], user['project_id'])),
+            (SelectQueries.folders, (project_id, 0, None)),
+            (SelectQueries.tasks_by_folder, (project_id, folder_id, 0, 2)),
+            (SelectQueries.tasks_by_project, (project_id, 1, None)),
+            (SelectQueries.task, (project_id, folder_id, task_id)),
+            # Nothing found
+            (SelectQueries.task, (project_id, folder_id, -1))
+        ]
+        res = [await fetch_all(db_pool, queries) for db_pool in pools]
+        assert res[0] == res[1]
+        # json is decoded by both drivers
+        assert isinstance(res[1][3][1][0][3], list)
+
+        # Named arguments and composed queries
+        for db_pool in pools:
+            title = 'Task {}'.format(db_pool.driver)
+            _res = await db_pool.fetch(InsertQueries.add_task, {
+                'title': title, 'description': None,
+                'datetime_from': datetime(2020, 1, 1), 'datetime_due': None,
+                'user_id': user['user_id'], 'project_id': project_id,
+                'folder_id': folder_id
+            })
+            new_task_id = _res[0][0]
+            query = SQL(UpdateQueries.task).format(SQL(', ').join([
+                SQL('{} = {}').format(Identifier('description'),
+                                      Placeholder('description'))
+            ]))
+            count = await db_pool.execute(
+                query, {'description': title, 'task_id': new_task_id}
+            )
+            assert count == 1
+            _res = await db_pool.fetch(
+                SelectQueries.task, (project_id, folder_id, new_task_id)
+            )
+            task = dict(zip(_res.columns, _res[0]))
+            assert task['title'] == task['description'] == title
+
+        # Streams return the same rows in batches
+        res = []
+        for db_pool in pools:
+            rows = []
+            async with db_pool.acquire() as conn:
+                async with conn.stream(SelectQueries.tasks_by_project,
+                                       (project_id, 0, None)) as stream:
+                    while True:
+                        _res = await stream.fetch(2)
+                        if not _res:
+                            break
+                        assert len(_res) <= 2
+                        rows.extend(normalize(_res))
+            res.append(rows)
+        assert len(res[0]) == len(user['tasks']) + 2
+        assert res[0] == res[1]
+    finally:
+        for db_pool in pools:
+            db_pool.close()
+            await db_pool.wait_closed()
+
+
+@pytest.mark.gen_test
+async def test_db_nested_transactions(user):
+    pools = [await get_db_pool(driver=driver)
+             for driver in ('aiopg', 'asyncpg')]
+    try:
+        project_id, folder_id, task_id = tuple((await pools[0].fetch(
+            SelectQueries.project_folder_task_access,
+            (user['user_id'], user['project_id'], user['folder_id'],
+             user['tasks'][0])
+        ))[0])[:3]
+        query = SQL(UpdateQueries.task).format(
+            SQL('{} = {}').format(Identifier('title'), Placeholder('title'))
+        )
+        for db_pool in pools:
+            title = 'Outer {}'.format(db_pool.driver)
+            async with db_pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(
+                        query, {'title': title, 'task_id': task_id}
+                    )
+                    # A nested transaction is rolled back alone
+                    with pytest.raises(RuntimeError):
+                        async with conn.transaction():
+                            await conn.execute(query, {
+                                'title': 'Inner', 'task_id': task_id
+                            })
+                            raise RuntimeError
+                    async with conn.transaction():
+                        await conn.execute(query, {
+                            'title': title + ' released', 'task_id': task_id
+                        })
+            _res = await db_pool.fetch(
+                SelectQueries.task, (project_id, folder_id, task_id)
+            )
+            assert dict(zip(_res.columns, _res[0]))['title'] == \
+                title + ' released'
+    finally:
+        for db_pool in pools:
+            db_pool.close()
+            await db_pool.wait_closed()
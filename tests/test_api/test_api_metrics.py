@@ -0,0 +1,56 @@
+
+import pytest
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from .base import PATH, app, user, fetch, get_new_tokens
+from server.app import AdminApp
+
+
+@pytest.mark.gen_test
+async def test_metrics(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    for _ in range(3):
+        r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                        params)
+        assert r.code == 200
+
+    sock, port = bind_unused_port()
+    server = HTTPServer(AdminApp(app))
+    server.add_sockets([sock])
+    try:
+        r = await http_client.fetch('http://127.0.0.1:{}/metrics'.format(port))
+    finally:
+        server.stop()
+    assert r.headers['Content-Type'].startswith('text/plain')
+    lines = r.body.decode().splitlines()
+    assert 'tasker_request_duration_seconds_count{route="ApiProjectAllHandler"'\
+           ',method="GET"} 3' in lines
+    assert 'tasker_responses_total{route="ApiProjectAllHandler",' \
+           'method="GET",status="200"} 3' in lines
+    assert 'tasker_responses_total{route="ApiTokensNewHandler",' \
+           'method="POST",status="200"} 1' in lines
+    # Passwords are verified in the pwhash pool
+    assert 'tasker_pwhash_pending 0' in lines
+    assert 'tasker_pwhash_rejected_total 0' in lines
+    assert 'tasker_db_pool_max_size{{pool="primary"}} {}'.format(
+        app.db_pool.stats()['max_size']
+    ) in lines
+    assert 'tasker_db_query_duration_seconds_count{pool="primary",' \
+           'query="SelectQueries.projects"} 3' in lines
+
+
+@pytest.mark.gen_test
+async def test_slow_query_log(http_client, base_url, app, user, caplog):
+    # Every query is slow
+    app.db_pool.slow_query_time = 1e-9
+    _user = user['password_auth']
+    await get_new_tokens(http_client, base_url, _user)
+    assert app.db_pool.queries['SelectQueries.password_auth'].count == 1
+    assert app.db_pool.queries['InsertQueries.tokens'].count == 1
+    logged = [rec.getMessage() for rec in caplog.records
+              if rec.getMessage().startswith('Slow query')]
+    assert any(msg.startswith('Slow query SelectQueries.password_auth: ')
+               and msg.endswith(', args (?)') for msg in logged)
+    # Values of arguments aren't logged
+    assert not any(_user['username'] in msg for msg in logged)
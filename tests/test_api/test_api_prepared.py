@@ -0,0 +1,21 @@
+
+import pytest
+
+from .base import PATH, app, user, fetch, get_new_tokens
+from server.sql.prepared import PREPARED
+
+
+@pytest.mark.gen_test
+async def test_prepared_statements(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    r = await fetch(http_client, base_url,
+                    PATH['project'].format(user['project_id']), 'GET', params)
+    assert r.code == 200
+    if app.db_pool.driver != 'aiopg':
+        pytest.skip('statements are prepared by the driver')
+    # Every connection of the pool prepares the whole catalogue
+    _res = await app.db_pool.fetch('SELECT name FROM pg_prepared_statements')
+    names = {row[0] for row in _res}
+    assert app.db_pool.prepare is True
+    assert len(names) == len(PREPARED)
+    assert 'select_token_project_access' in names
@@ -2,8 +2,13 @@
 import json
 import pytest
 from datetime import datetime
+from urllib.parse import urljoin
+
+from tornado.httputil import url_concat
 
 from .base import PATH, app, user, fetch, get_new_tokens
+from server.app import get_db_pool
+from server.replicas import Replicas
 
 
 @pytest.mark.gen_test
@@ -84,3 +89,53 @@ async def test_project_delete(http_client, base_url, user):
     r = await fetch(http_client, base_url, PATH['project'].format(-1),
                     'DELETE', params)
     assert r.code == 404
+
+
+@pytest.mark.gen_test
+async def test_project_replicas(http_client, base_url, app, user):
+    # The primary itself is used as a replica without lag
+    replica_pool = await get_db_pool()
+    app.replicas = Replicas([replica_pool], max_lag=5, interval=0, window=60)
+    try:
+        params = await get_new_tokens(http_client, base_url,
+                                      user['password_auth'])
+        path = PATH['project_base']
+        r = await fetch(http_client, base_url, path, 'GET', params)
+        assert r.code == 200
+        assert app.replicas.stats()['reads'] == 1
+        assert app.replicas.stats()['primary_reads'] == 0
+
+        # The version is checked on the replica serving the content
+        url = url_concat(urljoin(
+            base_url, PATH['project'].format(user['project_id'])
+        ), params)
+        r = await http_client.fetch(url)
+        etag = r.headers['Etag']
+        assert etag.startswith('"{}-'.format(user['project_id']))
+        r = await http_client.fetch(url, headers={'If-None-Match': etag},
+                                    raise_error=False)
+        assert r.code == 304
+        assert app.replicas.stats()['reads'] == 3
+        assert app.replicas.stats()['primary_reads'] == 0
+
+        # Reads after a write go to the primary within the window
+        r = await fetch(http_client, base_url,
+                        PATH['folder_project'].format(user['project_id']),
+                        'POST', dict(params, title='New folder'))
+        assert r.code == 200
+        r = await fetch(http_client, base_url, path, 'GET', params)
+        assert r.code == 200
+        assert app.replicas.stats()['primary_reads'] == 1
+
+        # Failed and lagging replicas are dropped from the rotation
+        app.replicas.fail(replica_pool)
+        assert app.replicas.get(params['token_select']) is None
+        assert await app.replicas.check() == 1
+        app.replicas.max_lag = -1
+        assert await app.replicas.check() == 0
+        r = await fetch(http_client, base_url, path, 'GET', params)
+        assert r.code == 200
+        assert app.replicas.stats()['reads'] == 4
+    finally:
+        replica_pool.close()
+        await replica_pool.wait_closed()
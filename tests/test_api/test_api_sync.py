@@ -0,0 +1,88 @@
+import json
+
+import psycopg2
+import pytest
+
+from .base import PATH, app, user, fetch, get_new_tokens
+from server.conf import DB_SETTINGS
+from server.handlers.api.base import ApiHandler
+
+
+@pytest.mark.gen_test
+async def test_sync(http_client, base_url, app, user):
+    project_id, folder_id = user['project_id'], user['folder_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    path = PATH['sync'].format(project_id)
+
+    # Everything without a cursor
+    r = await fetch(http_client, base_url, path, 'GET', params)
+    assert r.code == 200
+    data = json.loads(r.body)
+    assert [item['id'] for item in data['folders']] == [folder_id]
+    assert [item['id'] for item in data['tasks']] == user['tasks']
+    assert data['deleted'] == {'folders': [], 'tasks': []}
+    cursor = data['next']
+
+    # Create a folder, edit a task, delete a task
+    r = await fetch(http_client, base_url,
+                    PATH['folder_project'].format(project_id), 'POST',
+                    dict(params, title='New folder'))
+    new_folder_id = json.loads(r.body)['id']
+    r = await fetch(http_client, base_url,
+                    PATH['task'].format(project_id, folder_id,
+                                        user['tasks'][0]),
+                    'PUT', dict(params, title='Edited'))
+    assert r.code == 200
+    r = await fetch(http_client, base_url,
+                    PATH['task'].format(project_id, folder_id,
+                                        user['tasks'][1]),
+                    'DELETE', params)
+    assert r.code == 200
+
+    # Only changes since the cursor
+    r = await fetch(http_client, base_url, path, 'GET',
+                    dict(params, since=cursor))
+    assert r.code == 200
+    data = json.loads(r.body)
+    assert [item['id'] for item in data['folders']] == [new_folder_id]
+    assert [item['id'] for item in data['tasks']] == [user['tasks'][0]]
+    assert data['tasks'][0]['title'] == 'Edited'
+    assert data['deleted'] == {'folders': [], 'tasks': [user['tasks'][1]]}
+
+    r = await fetch(http_client, base_url,
+                    PATH['folder'].format(project_id, new_folder_id),
+                    'DELETE', params)
+    assert r.code == 200
+    r = await fetch(http_client, base_url, path, 'GET',
+                    dict(params, since=data['next']))
+    data = json.loads(r.body)
+    assert data['deleted']['folders'] == [new_folder_id]
+    assert new_folder_id not in [item['id'] for item in data['folders']]
+
+    r = await fetch(http_client, base_url, path, 'GET',
+                    dict(params, since='invalid'))
+    assert r.code == 400
+
+    # Purged tombstones make older cursors invalid
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE tasker.tombstones SET deleted = now() - '1s'::INTERVAL "
+                "WHERE project_id = (SELECT project_id FROM tasker.projects "
+                "WHERE project_pub_id = %s)", (project_id,)
+            )
+    app.tombstones_reaper.retention = 0
+    assert await app.tombstones_reaper.purge() >= 2
+    r = await fetch(http_client, base_url, path, 'GET',
+                    dict(params, since=cursor))
+    assert r.code == 410
+
+    # The zero cursor is a full sync, whatever tombstones have been purged
+    r = await fetch(http_client, base_url, path, 'GET',
+                    dict(params, since=ApiHandler.encode_cursor(0)))
+    assert r.code == 200
+    data = json.loads(r.body)
+    assert [item['id'] for item in data['folders']] == [folder_id]
+    assert [item['id'] for item in data['tasks']] == \
+        [user['tasks'][0], user['tasks'][2]]
+    assert data['deleted'] == {'folders': [], 'tasks': []}
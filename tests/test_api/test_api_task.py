@@ -1,11 +1,24 @@
 
+import gzip
 import json
+import os
 import pytest
+import tracemalloc
 import asyncio
 from time import mktime
 from datetime import datetime, timedelta
+from urllib.parse import urljoin
 
-from .base import PATH, app, user, fetch, get_new_tokens
+import psycopg2
+from tornado.httputil import url_concat
+
+from .base import PATH, app, user, fetch, fetch_json, get_new_tokens
+from db_manage import delete_user, seed
+from server.conf import DB_SETTINGS
+
+# Number of tasks in a project streamed by test_task_stream,
+# e.g. TASKER_TEST_STREAM_TASKS=1000000 for a big run
+STREAM_TASKS = int(os.environ.get('TASKER_TEST_STREAM_TASKS', 10 ** 5))
 
 
 def check_task_dict(task):
@@ -199,3 +212,320 @@ async def test_task_update(http_client, base_url, user):
                     PATH['task'].format(project_id, folder_id, task_id),
                     'PUT', params)
     assert r.code == 400
+
+
+@pytest.mark.gen_test
+async def test_task_pagination(http_client, base_url, user):
+    project_id, folder_id = user['project_id'], user['folder_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    for i in range(4):
+        params['title'] = 'Task {}'.format(i)
+        await fetch(http_client, base_url,
+                    PATH['task_folder'].format(project_id, folder_id),
+                    'POST', params)
+    del params['title']
+
+    # 3 demo tasks and 4 new ones in pages by 2 tasks
+    for path in (PATH['task_project'].format(project_id),
+                 PATH['task_folder'].format(project_id, folder_id)):
+        ids = []
+        page_params = dict(params, limit=2)
+        while True:
+            r = await fetch(http_client, base_url, path, 'GET', page_params)
+            assert r.code == 200
+            data = json.loads(r.body)
+            assert len(data['tasks']) <= 2
+            ids.extend(task['id'] for task in data['tasks'])
+            if data['next'] is None:
+                break
+            page_params['after'] = data['next']
+        assert len(ids) == 7
+        assert ids == sorted(set(ids))
+
+    # Invalid cursor and limits
+    path = PATH['task_project'].format(project_id)
+    for args in ({'after': 'oops'}, {'limit': 0}, {'limit': 'oops'},
+                 {'limit': 10 ** 6}):
+        r = await fetch(http_client, base_url, path, 'GET',
+                        dict(params, **args))
+        assert r.code == 400
+
+
+@pytest.mark.gen_test(timeout=900)
+async def test_task_stream(http_client, base_url, user):
+    project_id = user['project_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    # Copy a demo task to get a big project
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+INSERT INTO tasker.tasks(task_pub_id, title, user_id, project_id, folder_id)
+SELECT 3 + i, 'Task ' || i, t.user_id, t.project_id, t.folder_id
+FROM tasker.tasks t INNER JOIN tasker.projects p on t.project_id = p.project_id
+CROSS JOIN generate_series(1, %s) i
+WHERE p.project_pub_id = %s and t.task_pub_id = 1
+""", (STREAM_TASKS, project_id))
+
+    count = 0
+    size = 0
+    first = None
+    tail = b''
+
+    def on_chunk(chunk):
+        # Count rows without keeping them, keep the first one
+        nonlocal count, size, first, tail
+        size += len(chunk)
+        rows = (tail + chunk).split(b'\n')
+        tail = rows.pop()
+        if first is None and rows:
+            first = json.loads(rows[0])
+        count += len(rows)
+
+    url = url_concat(urljoin(base_url, PATH['task_project'].format(project_id)),
+                     dict(params, format='ndjson'))
+    # Allocations of the server and the client during the stream only
+    tracemalloc.start()
+    try:
+        r = await http_client.fetch(url, streaming_callback=on_chunk,
+                                    request_timeout=900, raise_error=False)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert r.code == 200
+    assert r.headers['Content-Type'] == 'application/x-ndjson'
+    assert tail == b''
+    assert count == STREAM_TASKS + 3
+    assert first['id'] == 1
+    assert check_task_dict(first) is True
+    # Rows are fetched and sent in batches, the body is never held whole
+    assert peak < size / 4
+
+
+@pytest.mark.gen_test
+async def test_task_bulk_add(http_client, base_url, app, user):
+    project_id, folder_id = user['project_id'], user['folder_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    path = PATH['task_folder_bulk'].format(project_id, folder_id)
+    datetime_due = int(mktime((datetime.now() + timedelta(days=3)).timetuple()))
+    tasks = [
+        {'title': 'Bulk task 1'},
+        {'title': 'Bulk task 2', 'description': 'Description'},
+        {'title': 'Bulk task 3', 'datetime_due': datetime_due}
+    ]
+    r = await fetch_json(http_client, base_url, path, 'POST', params, tasks)
+    assert r.code == 200
+    ids = json.loads(r.body)['ids']
+    # 3 demo tasks, ids are allocated in order
+    assert ids == [4, 5, 6]
+    for task_id, task in zip(ids, tasks):
+        r = await fetch(http_client, base_url,
+                        PATH['task'].format(project_id, folder_id, task_id),
+                        'GET', params)
+        data = json.loads(r.body)
+        for k in ('title', 'description', 'datetime_due'):
+            assert data[k] == task.get(k)
+
+    # Nothing is created if any of tasks is invalid
+    for data in ([], {'title': 'Not an array'}, [{'description': 'No title'}],
+                 [{'title': 'Valid'}, {'title': 'Invalid', 'datetime_due': 'x'}]):
+        r = await fetch_json(http_client, base_url, path, 'POST', params, data)
+        assert r.code == 400
+    r = await fetch_json(http_client, base_url, path, 'POST', params,
+                         [{'title': 'Task'}] * (app.tasks_bulk_max + 1))
+    assert r.code == 413
+    r = await fetch(http_client, base_url, PATH['task_project'].format(project_id),
+                    'GET', params)
+    assert len(json.loads(r.body)['tasks']) == 6
+
+    # Non-existent folder
+    r = await fetch_json(http_client, base_url,
+                         PATH['task_folder_bulk'].format(project_id, -1),
+                         'POST', params, tasks)
+    assert r.code == 404
+
+
+@pytest.mark.gen_test
+async def test_task_bulk_update(http_client, base_url, app, user):
+    project_id, folder_id = user['project_id'], user['folder_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    path = PATH['task_project_bulk'].format(project_id)
+    datetime_due = int(mktime((datetime.now() + timedelta(days=3)).timetuple()))
+    data = {
+        'ids': [1, 2, 100],
+        'patch': {'description': 'Updated', 'datetime_due': datetime_due}
+    }
+    r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+    assert r.code == 200
+    # Non-existent tasks are skipped
+    assert json.loads(r.body)['ids'] == [1, 2]
+    for task_id in (1, 2):
+        r = await fetch(http_client, base_url,
+                        PATH['task'].format(project_id, folder_id, task_id),
+                        'GET', params)
+        task = json.loads(r.body)
+        assert task['description'] == 'Updated'
+        assert task['datetime_due'] == datetime_due
+
+    # Move to a new folder and clear the description at once
+    r = await fetch(http_client, base_url,
+                    PATH['folder_project'].format(project_id), 'POST',
+                    dict(params, title='New folder'))
+    new_folder_id = json.loads(r.body)['id']
+    data = {'ids': [1, 2], 'patch': {'description': ''},
+            'folder_id': new_folder_id}
+    r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+    assert r.code == 200
+    assert json.loads(r.body)['ids'] == [1, 2]
+    r = await fetch(http_client, base_url,
+                    PATH['task_folder'].format(project_id, new_folder_id),
+                    'GET', params)
+    tasks = json.loads(r.body)['tasks']
+    assert [task['id'] for task in tasks] == [1, 2]
+    for task_id in (1, 2):
+        r = await fetch(http_client, base_url,
+                        PATH['task'].format(project_id, new_folder_id,
+                                            task_id),
+                        'GET', params)
+        assert json.loads(r.body)['description'] is None
+
+    # Nothing is moved to a non-existent folder
+    data = {'ids': [1, 2], 'folder_id': -1}
+    r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+    assert r.code == 404
+    # The folder exists, no task matches
+    data = {'ids': [100], 'folder_id': new_folder_id}
+    r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+    assert r.code == 200
+    assert json.loads(r.body)['ids'] == []
+
+    for data in ({'ids': [1]}, {'ids': [], 'patch': {'title': 'Task'}},
+                 {'ids': ['1'], 'patch': {'title': 'Task'}},
+                 {'ids': [1], 'patch': {'title': None}},
+                 {'ids': [1], 'patch': {'datetime_due': 'x'}}, [1, 2]):
+        r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+        assert r.code == 400
+    data = {'ids': list(range(app.tasks_bulk_max + 1)),
+            'patch': {'title': 'Task'}}
+    r = await fetch_json(http_client, base_url, path, 'PUT', params, data)
+    assert r.code == 413
+
+
+@pytest.mark.gen_test
+async def test_task_etag(http_client, base_url, user):
+    project_id, folder_id = user['project_id'], user['folder_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    paths = [
+        PATH['task_project'].format(project_id),
+        PATH['task_folder'].format(project_id, folder_id),
+        PATH['task'].format(project_id, folder_id, user['tasks'][0])
+    ]
+
+    async def get(path, etag=None):
+        headers = {'If-None-Match': etag} if etag is not None else None
+        return await http_client.fetch(
+            url_concat(urljoin(base_url, path), params), headers=headers,
+            raise_error=False
+        )
+
+    etags = []
+    for path in paths:
+        r = await get(path)
+        assert r.code == 200
+        etag = r.headers['Etag']
+        # Strong ETag of the project version
+        assert etag.startswith('"{}-'.format(project_id))
+        r = await get(path, etag)
+        assert r.code == 304
+        assert r.body == b''
+        etags.append(etag)
+
+    # Any change in the project changes the version
+    r = await fetch(http_client, base_url,
+                    PATH['task_folder'].format(project_id, folder_id), 'POST',
+                    dict(params, title='New task'))
+    assert r.code == 200
+    for path, etag in zip(paths, etags):
+        r = await get(path, etag)
+        assert r.code == 200
+        assert r.headers['Etag'] != etag
+
+
+@pytest.mark.gen_test
+async def test_task_compression(http_client, base_url, app, user):
+    project_id = user['project_id']
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    app.compress_min_size = 0
+    path = PATH['task_project'].format(project_id)
+
+    async def get(accept_encoding, url=path, **kw):
+        return await http_client.fetch(
+            url_concat(urljoin(base_url, url), dict(params, **kw)),
+            headers={'Accept-Encoding': accept_encoding},
+            decompress_response=False
+        )
+
+    r = await get('identity')
+    assert 'Content-Encoding' not in r.headers
+    assert r.headers['Vary'] == 'Accept-Encoding'
+    body = r.body
+    etag = r.headers['Etag']
+
+    r = await get('br;q=0, gzip')
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert int(r.headers['Content-Length']) == len(r.body)
+    assert gzip.decompress(r.body) == body
+    # The encoding is a part of the ETag
+    assert r.headers['Etag'] == etag[:-1] + '-gzip"'
+
+    # And of the ETag of a body hash
+    r = await get('identity', PATH['project_base'])
+    etag = r.headers['Etag']
+    r = await get('gzip', PATH['project_base'])
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.headers['Etag'] == etag[:-1] + '-gzip"'
+
+    # Batches of a stream are compressed
+    r = await get('gzip', format='ndjson')
+    assert r.headers['Content-Encoding'] == 'gzip'
+    rows = gzip.decompress(r.body).decode().splitlines()
+    assert [json.loads(row)['id'] for row in rows] == user['tasks']
+
+
+@pytest.mark.gen_test
+async def test_task_seed(http_client, base_url):
+    res = seed(2, 2, 50, folders_per_project=3, password='password',
+               random_seed=1)
+    usernames = [res['prefix'] + str(i) for i in range(2)]
+    try:
+        assert res['projects'] == 4
+        assert res['folders'] == 12
+        assert res['tasks'] == 200
+        params = await get_new_tokens(http_client, base_url, {
+            'username': usernames[0], 'password': 'password'
+        })
+        r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                        params)
+        projects = json.loads(r.body)['projects']
+        assert len(projects) == 2
+
+        project_id = projects[0]['id']
+        r = await fetch(http_client, base_url,
+                        PATH['folder_project'].format(project_id), 'GET',
+                        params)
+        assert [item['id'] for item in json.loads(r.body)['folders']] == \
+            [1, 2, 3]
+        r = await fetch(http_client, base_url,
+                        PATH['task_project'].format(project_id), 'GET',
+                        dict(params, format='ndjson'))
+        ids = [json.loads(line)['id'] for line in r.body.splitlines()]
+        assert ids == list(range(1, len(ids) + 1))
+
+        # Counters continue from the seeded pub ids
+        r = await fetch(http_client, base_url,
+                        PATH['task_folder'].format(project_id, 1), 'POST',
+                        dict(params, title='Task'))
+        assert r.code == 200
+        assert json.loads(r.body)['id'] == len(ids) + 1
+    finally:
+        for username in usernames:
+            delete_user(username)
@@ -1,10 +1,19 @@
 
+import asyncio
 import json
 import pytest
 from uuid import uuid4
 
-from .base import PATH, app, user, fetch
+import psycopg2
+
+from .base import PATH, app, user, fetch, get_new_tokens
 from db_manage import delete_user
+from server.conf import DB_SETTINGS, KEY_GRACE_PERIOD
+from server.keyring import Keyring
+from server.sql.select import SelectQueries
+
+# Concurrent renew requests with the same tokens
+RENEW_STORM = 16
 
 
 @pytest.mark.gen_test
@@ -58,3 +67,171 @@ async def test_tokens_renew(http_client, base_url, user):
     delete_user(user['username'])
     r = await fetch(http_client, base_url, PATH['renew_tokens'], 'POST', tokens)
     assert r.code == 403
+
+
+@pytest.mark.gen_test
+async def test_tokens_renew_concurrent(http_client, base_url, user):
+    r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST',
+                    user['password_auth'])
+    tokens = json.loads(r.body)
+    del tokens['expires_in']
+
+    # Parallel renews of the same tokens, only one of them wins
+    for _ in range(5):
+        responses = await asyncio.gather(*[
+            fetch(http_client, base_url, PATH['renew_tokens'], 'POST', tokens)
+            for _ in range(RENEW_STORM)
+        ])
+        codes = sorted(r.code for r in responses)
+        assert codes == [200] + [403] * (RENEW_STORM - 1)
+        r = next(r for r in responses if r.code == 200)
+        tokens = json.loads(r.body)
+        del tokens['expires_in']
+
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+SELECT t.token_select FROM tasker.tokens t
+INNER JOIN tasker.users u on t.user_id = u.user_id
+WHERE u.username = %s
+""", (user['username'],))
+            assert cur.fetchall() == [(tokens['token_select'],)]
+
+
+@pytest.mark.gen_test
+async def test_tokens_cache(http_client, base_url, app, user):
+    r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST',
+                    user['password_auth'])
+    tokens = json.loads(r.body)
+    del tokens['expires_in']
+    params = {k: tokens[k] for k in ('token_select', 'token_verify')}
+
+    # The first request selects the token from db, the next ones hit cache
+    stats = app.token_cache.stats()
+    for i in range(3):
+        r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                        params)
+        assert r.code == 200
+    assert app.token_cache.misses == stats['misses'] + 1
+    assert app.token_cache.hits == stats['hits'] + 2
+
+    # Cached token with invalid verify token
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                    {'token_select': params['token_select'],
+                     'token_verify': uuid4().hex})
+    assert r.code == 403
+
+    # Renewed tokens are evicted from cache
+    cached = app.token_cache.get(params['token_select'])
+    r = await fetch(http_client, base_url, PATH['renew_tokens'], 'POST', tokens)
+    assert r.code == 200
+    assert app.token_cache.get(params['token_select']) is None
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET', params)
+    assert r.code == 403
+
+    # Cache of another process which hasn't seen the renew, requests
+    # checking access verify tokens in db and evict them
+    app.token_cache.set(params['token_select'], *cached[:4], 60)
+    r = await fetch(http_client, base_url,
+                    PATH['project'].format(user['project_id']), 'GET', params)
+    assert r.code == 403
+    assert app.token_cache.get(params['token_select']) is None
+
+
+@pytest.mark.gen_test
+async def test_tokens_keyring_rotate(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+
+    # Tokens hashed with the retired key are valid during grace period
+    app.keyring.rotate()
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET', params)
+    assert r.code == 200
+    # New tokens are hashed with the new key
+    params_new = await get_new_tokens(http_client, base_url,
+                                      user['password_auth'])
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                    params_new)
+    assert r.code == 200
+
+    # Grace period has passed, the keyring is private to the test app
+    app.keyring.grace_period = -1
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET', params)
+    assert r.code == 403
+    r = await fetch(http_client, base_url, PATH['project_base'], 'GET',
+                    params_new)
+    assert r.code == 200
+
+
+def test_keyring_reload(tmp_path):
+    path = str(tmp_path / 'keyring.json')
+    keyrings = [Keyring.load(path, KEY_GRACE_PERIOD) for _ in range(3)]
+    # Another process rotates keys before the periodic reload
+    key_id = keyrings[0].rotate()
+    key = keyrings[0].current()[1]
+    assert keyrings[1].get(key_id) == key
+    assert (key_id, key) in keyrings[2].valid()
+    assert keyrings[1].get('unknown') is None
+    # Reloads on a miss are rate limited
+    key_id = keyrings[0].rotate()
+    assert keyrings[1].get(key_id) is None
+    keyrings[1].miss_reload_interval = 0
+    assert keyrings[1].get(key_id) == keyrings[0].current()[1]
+
+
+@pytest.mark.gen_test
+async def test_tokens_purge(http_client, base_url, app, user):
+    params = await get_new_tokens(http_client, base_url, user['password_auth'])
+    # Expire a new set of tokens
+    expired = await get_new_tokens(http_client, base_url,
+                                   user['password_auth'])
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE tasker.tokens SET expires_in = now() - '1s'::INTERVAL "
+                "WHERE token_select = %s", (expired['token_select'],)
+            )
+
+    rows_reclaimed = app.tokens_reaper.rows_reclaimed
+    deleted = await app.tokens_reaper.purge()
+    assert deleted >= 1
+    assert app.tokens_reaper.rows_reclaimed == rows_reclaimed + deleted
+    with psycopg2.connect(**DB_SETTINGS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'SELECT token_select FROM tasker.tokens '
+                'WHERE token_select in %s',
+                ((params['token_select'], expired['token_select']),)
+            )
+            assert cur.fetchall() == [(params['token_select'],)]
+
+
+@pytest.mark.gen_test
+async def test_tokens_pwhash(http_client, base_url, app, user):
+    def stored_hash():
+        with psycopg2.connect(**DB_SETTINGS) as conn:
+            with conn.cursor() as cur:
+                cur.execute(SelectQueries.password_auth, (user['username'],))
+                return bytes(cur.fetchone()[0])
+
+    # The hash is made with other parameters, it's replaced on login
+    app.pwhash.opslimit += 1
+    hashed = stored_hash()
+    assert app.pwhash.needs_rehash(hashed)
+    r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST',
+                    user['password_auth'])
+    assert r.code == 200
+    rehashed = stored_hash()
+    assert rehashed != hashed
+    assert not app.pwhash.needs_rehash(rehashed)
+    r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST',
+                    user['password_auth'])
+    assert r.code == 200
+    assert stored_hash() == rehashed
+
+    # The pool is saturated
+    app.pwhash.max_pending = 0
+    r = await fetch(http_client, base_url, PATH['new_tokens'], 'POST',
+                    user['password_auth'])
+    assert r.code == 503
+    assert r.headers['Retry-After'] == str(app.pwhash_retry_after)
+    assert app.pwhash.stats()['rejected'] == 1